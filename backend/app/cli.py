@@ -0,0 +1,79 @@
+"""
+Maintenance commands.
+
+Usage (from backend/):
+    python -m app.cli rebuild-metrics [--repo owner/name]
+    python -m app.cli backfill owner/name [--limit N]
+    python -m app.cli backfill --resume RUN_ID
+"""
+import argparse
+import asyncio
+
+from .models.database import SessionLocal, init_db
+from .services.backfill import get_backfill_service
+from .services.github import get_github_service
+from .services.message_batches import get_message_batch_client
+from .services.metrics_rollup import get_metrics_rollup
+
+
+def rebuild_metrics(args: argparse.Namespace):
+    """Recompute the dashboard metrics rollup from the analyses table."""
+    db = SessionLocal()
+    try:
+        rows = get_metrics_rollup().rebuild(db, repo=args.repo)
+        scope = args.repo or "all repos"
+        print(f"✅ Rebuilt metrics rollup for {scope}: {rows} day(s)")
+    finally:
+        db.close()
+
+
+def backfill(args: argparse.Namespace):
+    """Analyze a repo's most recent PRs through one Message Batch, or resume a run."""
+    service = get_backfill_service()
+    db = SessionLocal()
+
+    async def run(run_id: str):
+        try:
+            return await service.run(db, run_id)
+        finally:
+            await get_github_service().close()
+            await get_message_batch_client().close()
+
+    try:
+        run_id = args.resume or service.create_run(db, args.repo, args.limit).id
+        print(f"⏳ Backfill {run_id}: waiting for the batch may take up to 24 hours")
+        result = asyncio.run(run(run_id))
+        if result is None:
+            print(f"❌ No backfill run {run_id}")
+        elif result.status != "completed":
+            print(f"⚠️  Backfill {run_id} stopped: {result.error_message}")
+            print(f"   Resume with: python -m app.cli backfill --resume {run_id}")
+        else:
+            print(f"✅ Backfill {run_id} for {result.repo}: {result.prs_completed} PR(s) analyzed, "
+                  f"{result.prs_failed} failed, {result.tokens_used} tokens")
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="CodeGuard maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-metrics", help=rebuild_metrics.__doc__)
+    rebuild.add_argument("--repo", help="Only rebuild this repository")
+    rebuild.set_defaults(handler=rebuild_metrics)
+
+    backfill_parser = commands.add_parser("backfill", help=backfill.__doc__)
+    target = backfill_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("repo", nargs="?", help="Repository (owner/name) to backfill")
+    target.add_argument("--resume", metavar="RUN_ID", help="Continue an interrupted backfill run")
+    backfill_parser.add_argument("--limit", type=int, help="Most recent PRs to analyze (default: BACKFILL_MAX_PRS)")
+    backfill_parser.set_defaults(handler=backfill)
+
+    args = parser.parse_args(argv)
+    init_db()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
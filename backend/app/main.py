@@ -3,8 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from .config import get_settings
-from .models.database import init_db
-from .routers import webhook, analysis, metrics
+from .models.database import init_db, SessionLocal, async_engine, async_writer_engine
+from .routers import webhook, analysis, metrics, admin
+from .routers.webhook import process_pr_analysis
+from .services.analyzer import get_analyzer_service
+from .services.backfill import get_backfill_service
+from .services.github import get_github_service
+from .services.job_queue import get_job_queue
+from .services.message_batches import get_message_batch_client
+from .services.metrics_rollup import get_metrics_rollup
 
 settings = get_settings()
 
@@ -15,9 +22,29 @@ async def lifespan(app: FastAPI):
     print("🚀 Starting CodeGuard API...")
     init_db()
     print("✅ Database initialized")
+    db = SessionLocal()
+    try:
+        if get_metrics_rollup().ensure_built(db):
+            print("✅ Built metrics rollup from existing analyses")
+    finally:
+        db.close()
+    if settings.job_workers > 0:
+        get_job_queue().start(process_pr_analysis, settings.job_workers)
+        print(f"✅ Started {settings.job_workers} analysis workers")
+    resumed = await get_backfill_service().resume_unfinished()
+    if resumed:
+        print(f"✅ Resumed {len(resumed)} unfinished backfill run(s)")
     yield
     # Shutdown
     print("👋 Shutting down CodeGuard API...")
+    await get_job_queue().stop()
+    await get_backfill_service().stop()
+    await get_analyzer_service().close()
+    await get_github_service().close()
+    await get_message_batch_client().close()
+    await async_engine.dispose()
+    if async_writer_engine:
+        await async_writer_engine.dispose()
 
 
 app = FastAPI(
@@ -43,6 +70,7 @@ app.add_middleware(
 app.include_router(webhook.router, prefix="/webhook", tags=["webhook"])
 app.include_router(analysis.router, prefix="/api", tags=["analysis"])
 app.include_router(metrics.router, prefix="/api", tags=["metrics"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 
 @app.get("/")
@@ -1,19 +1,178 @@
-from sqlalchemy import create_engine, Column, String, Integer, Float, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, Boolean, Date, DateTime, Text, ForeignKey, JSON, Index
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
 from datetime import datetime
+from typing import Any, Callable, Optional, TypeVar, Union
 import uuid
 
 from ..config import get_settings
 
 settings = get_settings()
 
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False}  # SQLite specific
-)
+T = TypeVar("T")
+
+# Async drivers for each sync URL scheme
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    Map a sync database URL to its async driver (sqlite -> aiosqlite,
+    postgresql -> asyncpg). URLs that already name an async driver are kept.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Unsupported database backend: {backend}")
+    if parsed.drivername in ("sqlite+aiosqlite", "postgresql+asyncpg"):
+        return url
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def is_sqlite_production(url: str) -> bool:
+    return settings.sqlite_production_mode and make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> dict:
+    """Connection and pool arguments for the given database URL."""
+    if make_url(url).get_backend_name() == "sqlite":
+        # Sessions are handed between threads (threadpool, job workers)
+        options = {"connect_args": {"check_same_thread": False}}
+        if is_sqlite_production(url) and make_url(url).get_driver_name() == "aiosqlite":
+            # aiosqlite defaults to a new connection per session; pool the readers
+            options.update(poolclass=AsyncAdaptedQueuePool, pool_size=settings.db_pool_size,
+                           max_overflow=settings.db_max_overflow, pool_timeout=settings.db_pool_timeout)
+        return options
+
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Connection settings for SQLite production mode."""
+    cursor = dbapi_connection.cursor()
+    # Readers don't block the writer (or each other) and commits only append to the log
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Durable at checkpoints rather than every commit; safe from corruption in WAL mode
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # Wait for the write lock (e.g. held by another process) instead of failing at once
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+    cursor.close()
+
+
+def configure_sqlite_writer(engine: Engine):
+    """
+    Start every transaction with BEGIN IMMEDIATE, taking the write lock up
+    front. A deferred transaction that reads and then writes can fail with
+    "database is locked" (without waiting) if another writer committed since
+    its read; an immediate one waits for the lock and then sees the latest data.
+    """
+    @event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        # Let the begin event below emit BEGIN instead of the driver
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+POOL_SIZING = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
+
+
+def merge_options(options: dict, overrides: dict) -> dict:
+    """Apply caller overrides; a different pool class drops the pool sizing options."""
+    if "poolclass" in overrides:
+        options = {key: value for key, value in options.items() if key not in POOL_SIZING}
+    return {**options, **overrides}
+
+
+def make_engine(url: str, **kwargs) -> Engine:
+    engine = create_engine(url, **merge_options(engine_options(url), kwargs))
+    if is_sqlite_production(url):
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+def make_async_engine(url: str, writer: bool = False, **kwargs) -> AsyncEngine:
+    """
+    Args:
+        writer: In SQLite production mode, make the single-connection engine
+            that all writes go through.
+    """
+    async_url = to_async_url(url)
+    options = engine_options(async_url)
+    if writer:
+        options.update(poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0,
+                       pool_timeout=settings.db_pool_timeout)
+
+    engine = create_async_engine(async_url, **merge_options(options, kwargs))
+    if is_sqlite_production(async_url):
+        event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+        if writer:
+            configure_sqlite_writer(engine.sync_engine)
+    return engine
+
+
+class RoutingSession(Session):
+    """
+    Session for SQLite production mode, routing between a pooled reader engine
+    and a single-connection writer engine (``info["reader"]``/``info["writer"]``).
+
+    A transaction reads through the reader pool until it first writes (flush
+    or bulk insert/update/delete); from then until it ends, every statement
+    goes to the writer connection. Writers therefore queue for that one
+    connection, in this process, instead of colliding on SQLite's write lock.
+    """
+
+    _writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self._writing = True
+        return self.info["writer" if self._writing else "reader"]
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _end_write(session: RoutingSession, transaction):
+    if transaction.parent is None:
+        session._writing = False
+
+
+def make_async_sessionmaker(reader: AsyncEngine, writer: Optional[AsyncEngine] = None) -> async_sessionmaker:
+    """Async sessions on ``reader``, routing writes to ``writer`` if given."""
+    # Objects stay loaded after commit: expired attributes can't lazy-load on an AsyncSession
+    if writer is None:
+        return async_sessionmaker(reader, autoflush=False, expire_on_commit=False)
+    return async_sessionmaker(
+        autoflush=False,
+        expire_on_commit=False,
+        sync_session_class=RoutingSession,
+        info={"reader": reader.sync_engine, "writer": writer.sync_engine},
+    )
+
+
+engine = make_engine(settings.database_url)
+async_url = settings.async_database_url or settings.database_url
+async_engine = make_async_engine(async_url)
+# SQLite production mode: all writes go through one connection
+async_writer_engine = make_async_engine(async_url, writer=True) if is_sqlite_production(async_url) else None
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = make_async_sessionmaker(async_engine, async_writer_engine)
 
 Base = declarative_base()
 
@@ -24,6 +183,14 @@ def generate_uuid():
 
 class PRAnalysis(Base):
     __tablename__ = "pr_analyses"
+    __table_args__ = (
+        # Analysis list (newest first, optionally by repo or status; id breaks
+        # ties for cursor pagination) and PR lookups
+        Index("ix_pr_analyses_analyzed_at_id", "analyzed_at", "id"),
+        Index("ix_pr_analyses_repo_analyzed_at_id", "repo", "analyzed_at", "id"),
+        Index("ix_pr_analyses_status_analyzed_at_id", "status", "analyzed_at", "id"),
+        Index("ix_pr_analyses_repo_pr_number_analyzed_at", "repo", "pr_number", "analyzed_at"),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     repo = Column(String, nullable=False, index=True)
@@ -31,18 +198,31 @@ class PRAnalysis(Base):
     pr_title = Column(String, nullable=True)
     pr_url = Column(String, nullable=True)
     author = Column(String, nullable=True)
+    head_sha = Column(String, nullable=True)  # Commit that was reviewed
+    incremental_from_sha = Column(String, nullable=True)  # Previous head, for delta reviews
 
     # Analysis metadata
     analyzed_at = Column(DateTime, default=datetime.utcnow)
-    status = Column(String, default="pending")  # pending, processing, completed, failed
+    status = Column(String, default="pending")  # pending, processing, completed, failed, superseded
     error_message = Column(Text, nullable=True)
+    review_complete = Column(Boolean, default=True)  # False if part of the PR went unreviewed
 
     # Stats
     files_changed = Column(Integer, default=0)
     lines_added = Column(Integer, default=0)
     lines_removed = Column(Integer, default=0)
     analysis_time_ms = Column(Integer, default=0)
-    tokens_used = Column(Integer, default=0)
+    tokens_used = Column(Integer, default=0)  # Uncached input plus output tokens
+    cache_read_tokens = Column(Integer, default=0)  # Input tokens read from Claude's prompt cache
+    cache_creation_tokens = Column(Integer, default=0)  # Input tokens written to the prompt cache
+    github_requests = Column(Integer, default=0)
+    backfill_run_id = Column(String, ForeignKey("backfill_runs.id"), nullable=True, index=True)
+    feedback_version = Column(Integer, default=0)  # Bumped on feedback; part of the ETag
+
+    # Progress while processing (findings are stored as they stream in)
+    chunks_total = Column(Integer, default=0)
+    chunks_done = Column(Integer, default=0)
+    first_issue_ms = Column(Integer, nullable=True)  # Time from start to the first stored finding
 
     # Summary counts
     critical_count = Column(Integer, default=0)
@@ -57,7 +237,7 @@ class Issue(Base):
     __tablename__ = "issues"
 
     id = Column(String, primary_key=True, default=generate_uuid)
-    analysis_id = Column(String, ForeignKey("pr_analyses.id"), nullable=False)
+    analysis_id = Column(String, ForeignKey("pr_analyses.id"), nullable=False, index=True)
 
     # Issue details
     category = Column(String, nullable=False)  # security, quality, testing, docs
@@ -102,6 +282,127 @@ class Feedback(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        Index("ix_analysis_jobs_status_available_at", "status", "available_at"),  # claim
+        Index("ix_analysis_jobs_repo_pr_number", "repo", "pr_number"),  # supersede
+    )
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    analysis_id = Column(String, ForeignKey("pr_analyses.id"), nullable=False, index=True)
+    repo = Column(String, nullable=False)
+    pr_number = Column(Integer, nullable=False)
+
+    # Queue state
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed, superseded
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    last_error = Column(Text, nullable=True)
+    worker_id = Column(String, nullable=True)
+
+    # Scheduling
+    available_at = Column(DateTime, default=datetime.utcnow)  # Not claimable before this
+    leased_until = Column(DateTime, nullable=True)  # Visibility timeout while running
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BackfillRun(Base):
+    """Bulk analysis of a repo's past PRs through one Message Batch (see services/backfill.py)."""
+    __tablename__ = "backfill_runs"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    repo = Column(String, nullable=False, index=True)
+    pr_limit = Column(Integer, nullable=False)  # Most recent PRs to analyze
+
+    status = Column(String, default="collecting")  # collecting, submitted, completed
+    batch_id = Column(String, nullable=True)  # Message Batch, once submitted
+    error_message = Column(Text, nullable=True)  # Why the last attempt stopped; resume to retry
+    leased_by = Column(String, nullable=True)  # Process running it, so no other one runs it too
+    leased_until = Column(DateTime, nullable=True)  # Claimable by another process after this
+
+    # PRs analyzed by this run (already analyzed PRs are skipped)
+    prs_found = Column(Integer, default=0)
+    prs_submitted = Column(Integer, default=0)
+    prs_completed = Column(Integer, default=0)
+    prs_failed = Column(Integer, default=0)
+    tokens_used = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    submitted_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+
+    # sha256 of (patch hash, prompt version, model)
+    key = Column(String, primary_key=True)
+    patch_hash = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)  # Path when first analyzed
+
+    # Cached findings for this file (list of ClaudeIssue dicts)
+    issues = Column(JSON, default=list)
+    tokens_used = Column(Integer, default=0)  # Share of the original call's tokens
+
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class MetricsDaily(Base):
+    """Per-repo, per-day rollup of completed analyses, read by the dashboard."""
+    __tablename__ = "metrics_daily"
+
+    repo = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True, index=True)  # Day of analyzed_at (UTC)
+
+    prs_analyzed = Column(Integer, default=0)
+    issues_found = Column(Integer, default=0)
+
+    # Issues by severity
+    critical_count = Column(Integer, default=0)
+    warning_count = Column(Integer, default=0)
+    suggestion_count = Column(Integer, default=0)
+
+    # Issues by category
+    security_count = Column(Integer, default=0)
+    quality_count = Column(Integer, default=0)
+    testing_count = Column(Integer, default=0)
+    docs_count = Column(Integer, default=0)
+    performance_count = Column(Integer, default=0)
+
+    tokens_used = Column(Integer, default=0)
+    analysis_time_ms = Column(Integer, default=0)
+
+
+class MetricsDailyIssue(Base):
+    """Per-repo, per-day count of each issue title, for the top issues list."""
+    __tablename__ = "metrics_daily_issues"
+
+    repo = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True, index=True)
+    title = Column(String, primary_key=True)
+    category = Column(String, primary_key=True)
+    severity = Column(String, primary_key=True)
+
+    count = Column(Integer, default=0)
+
+
+class SchemaMigration(Base):
+    """Schema migrations applied to this database (see migrations.py)."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
 class RepoConfig(Base):
     __tablename__ = "repo_configs"
 
@@ -123,8 +424,11 @@ class RepoConfig(Base):
 
 
 def init_db():
-    """Create all database tables."""
+    """Create missing tables and apply pending schema migrations."""
+    from .migrations import run_migrations
+
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 
 def get_db():
@@ -134,3 +438,22 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency for FastAPI to get an async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_in_session(db: Union[Session, AsyncSession], fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Call ``fn(session, *args, **kwargs)`` with a sync ORM session.
+
+    On an AsyncSession, ``fn`` runs through ``run_sync`` so its queries go
+    through the async driver without blocking the event loop. This lets the
+    sync services (job queue, caches, rollup) be shared by both session types.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return fn(db, *args, **kwargs)
@@ -0,0 +1,146 @@
+"""
+Versioned schema migrations.
+
+``init_db`` creates missing tables with ``create_all``, which never alters an
+existing table. Changes to existing tables (new columns, new indexes) are
+listed here instead and applied once per database, in order, recording each
+version in ``schema_migrations``. Every step is idempotent, so a database
+created from the current models (which already has the changes) just records
+the versions.
+
+To change the schema: update the model, then append a Migration that brings
+older databases to the same state. Migrations spell out the indexes they touch
+rather than reading them from the models, so old steps keep working after the
+models move on.
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Sequence
+
+from sqlalchemy import inspect, select, insert
+from sqlalchemy.engine import Connection, Engine
+
+from .database import Base, SchemaMigration
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def add_column(conn: Connection, table: str, column_name: str):
+    """Add a model column to an existing table, if it is missing."""
+    if column_name in {column["name"] for column in inspect(conn).get_columns(table)}:
+        return
+
+    column = Base.metadata.tables[table].c[column_name]
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column_name} {column.type.compile(conn.dialect)}"
+    if column.default is not None and column.default.is_scalar:
+        ddl += f" DEFAULT {column.default.arg!r}"
+    conn.exec_driver_sql(ddl)
+
+
+def create_index(conn: Connection, name: str, table: str, columns: Sequence[str]):
+    """Create an index, if it is missing."""
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+def drop_index(conn: Connection, name: str):
+    """Drop an index, if it exists."""
+    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def _pr_analysis_columns(conn: Connection):
+    for column in ("head_sha", "incremental_from_sha", "github_requests"):
+        add_column(conn, "pr_analyses", column)
+
+
+def _hot_query_indexes(conn: Connection):
+    create_index(conn, "ix_pr_analyses_analyzed_at", "pr_analyses", ["analyzed_at"])
+    create_index(conn, "ix_pr_analyses_repo_analyzed_at", "pr_analyses", ["repo", "analyzed_at"])
+    create_index(conn, "ix_pr_analyses_status_analyzed_at", "pr_analyses", ["status", "analyzed_at"])
+    create_index(conn, "ix_pr_analyses_repo_pr_number_analyzed_at", "pr_analyses", ["repo", "pr_number", "analyzed_at"])
+    create_index(conn, "ix_issues_analysis_id", "issues", ["analysis_id"])
+    create_index(conn, "ix_analysis_jobs_status_available_at", "analysis_jobs", ["status", "available_at"])
+    create_index(conn, "ix_analysis_jobs_repo_pr_number", "analysis_jobs", ["repo", "pr_number"])
+
+
+def _keyset_indexes(conn: Connection):
+    # (analyzed_at, id) ordering for cursor pagination replaces the analyzed_at-only indexes
+    for old, new, columns in [
+        ("ix_pr_analyses_analyzed_at", "ix_pr_analyses_analyzed_at_id", ["analyzed_at", "id"]),
+        ("ix_pr_analyses_repo_analyzed_at", "ix_pr_analyses_repo_analyzed_at_id", ["repo", "analyzed_at", "id"]),
+        ("ix_pr_analyses_status_analyzed_at", "ix_pr_analyses_status_analyzed_at_id", ["status", "analyzed_at", "id"]),
+    ]:
+        create_index(conn, new, "pr_analyses", columns)
+        drop_index(conn, old)
+
+
+def _feedback_version(conn: Connection):
+    add_column(conn, "pr_analyses", "feedback_version")
+
+
+def _progress_columns(conn: Connection):
+    for column in ("chunks_total", "chunks_done", "first_issue_ms"):
+        add_column(conn, "pr_analyses", column)
+
+
+def _prompt_cache_columns(conn: Connection):
+    for column in ("cache_read_tokens", "cache_creation_tokens"):
+        add_column(conn, "pr_analyses", column)
+
+
+def _backfill_run_column(conn: Connection):
+    # The backfill_runs table itself is new, so create_all makes it
+    add_column(conn, "pr_analyses", "backfill_run_id")
+    create_index(conn, "ix_pr_analyses_backfill_run_id", "pr_analyses", ["backfill_run_id"])
+
+
+def _review_complete_column(conn: Connection):
+    add_column(conn, "pr_analyses", "review_complete")
+
+
+def _backfill_lease_columns(conn: Connection):
+    for column in ("leased_by", "leased_until"):
+        add_column(conn, "backfill_runs", column)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Add head SHA, incremental base and GitHub request count to analyses", _pr_analysis_columns),
+    Migration(2, "Indexes for analysis list, PR lookup, issue loading and job claiming", _hot_query_indexes),
+    Migration(3, "Keyset pagination indexes on (analyzed_at, id)", _keyset_indexes),
+    Migration(4, "Add feedback version to analyses for ETags", _feedback_version),
+    Migration(5, "Add streaming progress and time to first finding to analyses", _progress_columns),
+    Migration(6, "Add prompt cache read and creation tokens to analyses", _prompt_cache_columns),
+    Migration(7, "Link analyses to the backfill run that made them", _backfill_run_column),
+    Migration(8, "Record whether Claude's review of an analysis was complete", _review_complete_column),
+    Migration(9, "Add a lease to backfill runs so only one process runs each", _backfill_lease_columns),
+]
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Apply pending migrations, each in its own transaction.
+
+    Returns:
+        Versions that were applied.
+    """
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+
+    newly_applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in applied:
+            continue
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            conn.execute(insert(SchemaMigration).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.utcnow(),
+            ))
+        print(f"✅ Applied migration {migration.version}: {migration.description}")
+        newly_applied.append(migration.version)
+
+    return newly_applied
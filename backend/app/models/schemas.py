@@ -10,6 +10,7 @@ class AnalysisStatus(str, Enum):
     processing = "processing"
     completed = "completed"
     failed = "failed"
+    superseded = "superseded"
 
 
 class Severity(str, Enum):
@@ -99,6 +100,11 @@ class AnalysisSummary(BaseModel):
     total_issues: int = 0
 
 
+class AnalysisProgress(BaseModel):
+    chunks_done: int = 0
+    chunks_total: int = 0
+
+
 class AnalysisMetadata(BaseModel):
     analyzed_at: datetime
     analysis_time_ms: int
@@ -106,6 +112,12 @@ class AnalysisMetadata(BaseModel):
     lines_added: int
     lines_removed: int
     tokens_used: int
+    head_sha: Optional[str] = None
+    incremental_from_sha: Optional[str] = None
+    github_requests: int = 0
+    first_issue_ms: Optional[int] = None
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
 
 
 class AnalysisCreate(BaseModel):
@@ -127,6 +139,7 @@ class AnalysisResponse(BaseModel):
     error_message: Optional[str] = None
     summary: AnalysisSummary
     issues: List[IssueResponse] = []
+    progress: AnalysisProgress = AnalysisProgress()
     metadata: AnalysisMetadata
 
     class Config:
@@ -147,6 +160,11 @@ class AnalysisListItem(BaseModel):
         from_attributes = True
 
 
+class AnalysisPage(BaseModel):
+    items: List[AnalysisListItem]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last page
+
+
 # Webhook Response
 class WebhookResponse(BaseModel):
     status: str
@@ -206,6 +224,114 @@ class MetricsResponse(BaseModel):
     top_issues: List[Dict[str, Any]] = []
 
 
+# Admin Schemas
+class QueueStats(BaseModel):
+    queued: int = 0
+    running: int = 0
+    done: int = 0
+    failed: int = 0
+    superseded: int = 0
+    oldest_queued_age_seconds: Optional[float] = None
+    oldest_running_age_seconds: Optional[float] = None
+    workers: int = 0
+    paused_until: Optional[datetime] = None
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    hit_rate: float = 0.0
+    tokens_saved: int = 0
+    entries: int = 0
+    lifetime_hits: int = 0
+    lifetime_tokens_saved: int = 0
+
+
+class ResponseCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    hit_rate: float = 0.0
+    entries: int = 0
+    invalidations: int = 0
+    ttl_seconds: float = 0.0
+    max_entries: int = 0
+
+
+class EventStats(BaseModel):
+    subscribers: int = 0
+    analyses_watched: int = 0
+    published: int = 0
+    resyncs: int = 0
+
+
+class GitHubStats(BaseModel):
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    used: Optional[int] = None
+    reset_at: Optional[datetime] = None
+    paused_until: Optional[datetime] = None
+    requests_per_second: float = 0.0
+    throttled: int = 0
+    rejected: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+class BackfillRunResponse(BaseModel):
+    id: str
+    repo: str
+    pr_limit: int
+    status: str  # collecting, submitted, completed
+    batch_id: Optional[str] = None
+    error_message: Optional[str] = None  # Why the last attempt stopped; resume to retry
+    prs_found: int = 0
+    prs_submitted: int = 0
+    prs_completed: int = 0
+    prs_failed: int = 0
+    tokens_used: int = 0
+    created_at: datetime
+    submitted_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Diff Schemas (internal)
+class FileDiff(BaseModel):
+    filename: str
+    status: Optional[str] = None  # added, modified, removed, renamed
+    patch: Optional[str] = None
+    additions: int = 0
+    deletions: int = 0
+
+
+class PRContext(BaseModel):
+    """PR state fetched once per analysis run and reused by every GitHub operation."""
+    repo: str
+    pr_number: int
+    title: Optional[str] = None
+    author: Optional[str] = None
+    url: Optional[str] = None
+    head_sha: str
+    base_sha: Optional[str] = None
+    additions: int = 0
+    deletions: int = 0
+    changed_files: int = 0
+    files: List[FileDiff] = []
+
+    def pr_info(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "author": self.author,
+            "url": self.url,
+            "head_sha": self.head_sha,
+            "additions": self.additions,
+            "deletions": self.deletions,
+            "changed_files": self.changed_files,
+        }
+
+
 # Claude Analysis Response (internal)
 class ClaudeIssue(BaseModel):
     category: str
@@ -223,3 +349,10 @@ class ClaudeAnalysisResult(BaseModel):
     summary: Optional[str] = None
     has_tests: bool = False
     overall_quality: Optional[str] = None
+    # False when the response couldn't be parsed or was cut off, or files were
+    # left out over the review budget, so findings may be missing; such
+    # results aren't cached
+    complete: bool = True
+    # Prompt cache usage of the call(s) behind this result
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
@@ -1,2 +1,2 @@
 # Routers package
-from . import webhook, analysis, metrics
+from . import webhook, analysis, metrics, admin
@@ -0,0 +1,90 @@
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.database import get_async_db, run_in_session
+from ..models.schemas import (
+    BackfillRunResponse, QueueStats, CacheStats, EventStats, GitHubStats, ResponseCacheStats,
+)
+from ..services.analysis_cache import get_analysis_cache
+from ..services.backfill import get_backfill_service, load_run
+from ..services.event_bus import get_event_bus
+from ..services.github import get_github_service
+from ..services.job_queue import get_job_queue
+from ..services.response_cache import get_response_cache
+
+router = APIRouter()
+
+
+@router.get("/queue", response_model=QueueStats)
+async def queue_stats(db: AsyncSession = Depends(get_async_db)):
+    """Analysis job queue depth and job age."""
+    return QueueStats(**await run_in_session(db, get_job_queue().stats))
+
+
+@router.get("/cache", response_model=CacheStats)
+async def cache_stats(db: AsyncSession = Depends(get_async_db)):
+    """Per-file analysis cache hit/miss counters and token savings."""
+    return CacheStats(**await run_in_session(db, get_analysis_cache().stats))
+
+
+@router.get("/response-cache", response_model=ResponseCacheStats)
+async def response_cache_stats():
+    """Dashboard response cache hit/miss counters."""
+    return ResponseCacheStats(**get_response_cache().stats())
+
+
+@router.get("/events", response_model=EventStats)
+async def event_stats():
+    """Live analysis event subscribers and publish counters."""
+    return EventStats(**get_event_bus().stats())
+
+
+@router.get("/github", response_model=GitHubStats)
+async def github_stats():
+    """GitHub API quota, request throttling and response cache counters."""
+    github = get_github_service()
+    return GitHubStats(
+        **github.rate_limiter.stats(),
+        cache_hits=github.cache_hits,
+        cache_misses=github.cache_misses,
+    )
+
+
+@router.post("/backfill", response_model=BackfillRunResponse, status_code=202)
+async def start_backfill(
+    repo: str,
+    background_tasks: BackgroundTasks,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Analyze a repo's most recent PRs (default ``backfill_max_prs``) through one Message Batch."""
+    service = get_backfill_service()
+    run = await run_in_session(db, service.create_run, repo, limit)
+    background_tasks.add_task(service.run_detached, run.id)
+    return run
+
+
+@router.get("/backfill/{run_id}", response_model=BackfillRunResponse)
+async def get_backfill(run_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Progress of a backfill run."""
+    run = await run_in_session(db, load_run, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Backfill run not found")
+    return run
+
+
+@router.post("/backfill/{run_id}/resume", response_model=BackfillRunResponse, status_code=202)
+async def resume_backfill(
+    run_id: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Continue an interrupted backfill run from its last committed step."""
+    run = await run_in_session(db, load_run, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Backfill run not found")
+    if run.status != "completed":
+        background_tasks.add_task(get_backfill_service().run_detached, run_id)
+    return run
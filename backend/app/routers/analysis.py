@@ -1,14 +1,25 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+import asyncio
+import base64
+import json
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import desc, func, select, tuple_, update
 
-from ..models.database import get_db, PRAnalysis, Issue, Feedback
+from ..config import get_settings
+from ..models.database import get_async_db, PRAnalysis, Issue, Feedback
 from ..models.schemas import (
     AnalysisResponse,
     AnalysisListItem,
+    AnalysisPage,
     AnalysisSummary,
     AnalysisMetadata,
+    AnalysisProgress,
     IssueResponse,
     FeedbackCreate,
     FeedbackResponse,
@@ -16,31 +27,52 @@ from ..models.schemas import (
     Severity,
     AnalysisStatus,
 )
+from ..services.event_bus import get_event_bus
+from ..services.response_cache import ResponseCache, get_response_cache
 
 router = APIRouter()
+settings = get_settings()
+
+# Statuses after which an analysis no longer changes (apart from feedback)
+TERMINAL_STATUSES = {"completed", "failed", "superseded"}
+
+# Keep proxies from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Serialized bodies of completed analyses, keyed by ETag. A completed analysis
+# only changes through feedback, which bumps its ETag, so entries never go stale.
+analysis_body_cache = ResponseCache(ttl=24 * 3600, max_entries=settings.analysis_body_cache_max_entries)
+
+
+def issue_to_response(issue: Issue) -> IssueResponse:
+    """Convert database model to response schema."""
+    return IssueResponse(
+        id=issue.id,
+        category=Category(issue.category),
+        severity=Severity(issue.severity),
+        file_path=issue.file_path,
+        line_number=issue.line_number,
+        title=issue.title,
+        message=issue.message,
+        explanation=issue.explanation,
+        suggestion=issue.suggestion,
+        code_snippet=issue.code_snippet,
+        is_helpful=issue.is_helpful,
+        dismiss_reason=issue.dismiss_reason,
+        github_comment_id=issue.github_comment_id,
+        created_at=issue.created_at,
+    )
 
 
 def analysis_to_response(analysis: PRAnalysis) -> AnalysisResponse:
     """Convert database model to response schema."""
-    issues = [
-        IssueResponse(
-            id=issue.id,
-            category=Category(issue.category),
-            severity=Severity(issue.severity),
-            file_path=issue.file_path,
-            line_number=issue.line_number,
-            title=issue.title,
-            message=issue.message,
-            explanation=issue.explanation,
-            suggestion=issue.suggestion,
-            code_snippet=issue.code_snippet,
-            is_helpful=issue.is_helpful,
-            dismiss_reason=issue.dismiss_reason,
-            github_comment_id=issue.github_comment_id,
-            created_at=issue.created_at,
-        )
-        for issue in analysis.issues
-    ]
+    issues = [issue_to_response(issue) for issue in analysis.issues]
+    if analysis.status == "completed":
+        counts = (analysis.critical_count, analysis.warning_count, analysis.suggestion_count)
+    else:
+        # Counters are only stored on completion; count the findings streamed so far
+        severities = Counter(issue.severity for issue in analysis.issues)
+        counts = (severities["critical"], severities["warning"], severities["suggestion"])
 
     return AnalysisResponse(
         id=analysis.id,
@@ -52,12 +84,16 @@ def analysis_to_response(analysis: PRAnalysis) -> AnalysisResponse:
         status=AnalysisStatus(analysis.status),
         error_message=analysis.error_message,
         summary=AnalysisSummary(
-            critical=analysis.critical_count,
-            warnings=analysis.warning_count,
-            suggestions=analysis.suggestion_count,
-            total_issues=analysis.critical_count + analysis.warning_count + analysis.suggestion_count,
+            critical=counts[0],
+            warnings=counts[1],
+            suggestions=counts[2],
+            total_issues=sum(counts),
         ),
         issues=issues,
+        progress=AnalysisProgress(
+            chunks_done=analysis.chunks_done or 0,
+            chunks_total=analysis.chunks_total or 0,
+        ),
         metadata=AnalysisMetadata(
             analyzed_at=analysis.analyzed_at,
             analysis_time_ms=analysis.analysis_time_ms,
@@ -65,100 +101,332 @@ def analysis_to_response(analysis: PRAnalysis) -> AnalysisResponse:
             lines_added=analysis.lines_added,
             lines_removed=analysis.lines_removed,
             tokens_used=analysis.tokens_used,
+            head_sha=analysis.head_sha,
+            incremental_from_sha=analysis.incremental_from_sha,
+            github_requests=analysis.github_requests or 0,
+            first_issue_ms=analysis.first_issue_ms,
+            cache_read_tokens=analysis.cache_read_tokens or 0,
+            cache_creation_tokens=analysis.cache_creation_tokens or 0,
+        ),
+    )
+
+
+def analysis_to_list_item(analysis: PRAnalysis) -> AnalysisListItem:
+    """Convert database model to list item schema."""
+    return AnalysisListItem(
+        id=analysis.id,
+        repo=analysis.repo,
+        pr_number=analysis.pr_number,
+        pr_title=analysis.pr_title,
+        author=analysis.author,
+        status=AnalysisStatus(analysis.status),
+        summary=AnalysisSummary(
+            critical=analysis.critical_count,
+            warnings=analysis.warning_count,
+            suggestions=analysis.suggestion_count,
+            total_issues=analysis.critical_count + analysis.warning_count + analysis.suggestion_count,
         ),
+        analyzed_at=analysis.analyzed_at,
     )
 
 
-@router.get("/analyses", response_model=List[AnalysisListItem])
+def encode_cursor(analysis: PRAnalysis) -> str:
+    """Opaque cursor pointing just past ``analysis`` in list order."""
+    position = {"analyzed_at": analysis.analyzed_at.isoformat(), "id": analysis.id}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    Returns:
+        tuple: (analyzed_at, id) of the last analysis on the previous page
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position["analyzed_at"]), str(position["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/analyses", response_model=Union[List[AnalysisListItem], AnalysisPage])
 async def list_analyses(
     repo: Optional[str] = Query(None, description="Filter by repository"),
     status: Optional[str] = Query(None, description="Filter by status"),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(
+        None,
+        description="Keyset pagination: empty for the first page, then the previous page's "
+                    "next_cursor. Returns an AnalysisPage instead of a list.",
+    ),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """List all analyses with optional filtering."""
-    query = db.query(PRAnalysis)
+    """List all analyses with optional filtering, newest first."""
+    query = select(PRAnalysis)
 
     if repo:
-        query = query.filter(PRAnalysis.repo == repo)
+        query = query.where(PRAnalysis.repo == repo)
     if status:
-        query = query.filter(PRAnalysis.status == status)
-
-    analyses = query.order_by(desc(PRAnalysis.analyzed_at)).offset(offset).limit(limit).all()
-
-    return [
-        AnalysisListItem(
-            id=a.id,
-            repo=a.repo,
-            pr_number=a.pr_number,
-            pr_title=a.pr_title,
-            author=a.author,
-            status=AnalysisStatus(a.status),
-            summary=AnalysisSummary(
-                critical=a.critical_count,
-                warnings=a.warning_count,
-                suggestions=a.suggestion_count,
-                total_issues=a.critical_count + a.warning_count + a.suggestion_count,
-            ),
-            analyzed_at=a.analyzed_at,
-        )
-        for a in analyses
-    ]
+        query = query.where(PRAnalysis.status == status)
+
+    order = (desc(PRAnalysis.analyzed_at), desc(PRAnalysis.id))
+
+    if cursor is None:
+        # Offset mode (kept for compatibility): cost grows with the offset
+        analyses = (await db.scalars(query.order_by(*order).offset(offset).limit(limit))).all()
+        return [analysis_to_list_item(a) for a in analyses]
+
+    # Keyset mode: seek past the last row seen, so every page costs the same and
+    # rows inserted meanwhile don't shift later pages
+    if cursor:
+        analyzed_at, last_id = decode_cursor(cursor)
+        query = query.where(tuple_(PRAnalysis.analyzed_at, PRAnalysis.id) < (analyzed_at, last_id))
+
+    analyses = (await db.scalars(query.order_by(*order).limit(limit + 1))).all()
+    has_more = len(analyses) > limit
+    analyses = analyses[:limit]
+
+    return AnalysisPage(
+        items=[analysis_to_list_item(a) for a in analyses],
+        next_cursor=encode_cursor(analyses[-1]) if has_more else None,
+    )
+
+
+def analysis_etag(analysis_id: str, feedback_version: Optional[int]) -> str:
+    """Strong ETag of a completed analysis."""
+    return f'"{analysis_id}.{feedback_version or 0}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def load_analysis(db: AsyncSession, analysis_id: str) -> PRAnalysis:
+    """Load an analysis together with its issues."""
+    return await db.scalar(
+        select(PRAnalysis)
+        .options(selectinload(PRAnalysis.issues))
+        .where(PRAnalysis.id == analysis_id)
+    )
+
+
+async def respond_with_analysis(
+    request: Request,
+    db: AsyncSession,
+    analysis_id: str,
+    status: str,
+    feedback_version: Optional[int]
+):
+    """
+    Serve one analysis. Completed analyses are immutable apart from feedback,
+    so they carry a strong ETag and are answered with 304, or from the body
+    cache, without loading their issues.
+    """
+    if status != "completed":
+        return analysis_to_response(await load_analysis(db, analysis_id))
+
+    etag = analysis_etag(analysis_id, feedback_version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = analysis_body_cache.get(etag)
+    if body is None:
+        analysis = await load_analysis(db, analysis_id)
+        body = analysis_to_response(analysis).model_dump_json()
+        analysis_body_cache.set(etag, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/analysis/{analysis_id}", response_model=AnalysisResponse)
 async def get_analysis(
     analysis_id: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific analysis by ID."""
-    analysis = db.query(PRAnalysis).filter(PRAnalysis.id == analysis_id).first()
+    found = (await db.execute(
+        select(PRAnalysis.status, PRAnalysis.feedback_version)
+        .where(PRAnalysis.id == analysis_id)
+    )).first()
 
-    if not analysis:
+    if not found:
         raise HTTPException(status_code=404, detail="Analysis not found")
 
-    return analysis_to_response(analysis)
+    return await respond_with_analysis(request, db, analysis_id, *found)
 
 
 @router.get("/pr/{repo:path}/{pr_number}", response_model=AnalysisResponse)
 async def get_pr_analysis(
     repo: str,
     pr_number: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get the latest analysis for a specific PR."""
-    analysis = (
-        db.query(PRAnalysis)
-        .filter(PRAnalysis.repo == repo, PRAnalysis.pr_number == pr_number)
+    found = (await db.execute(
+        select(PRAnalysis.id, PRAnalysis.status, PRAnalysis.feedback_version)
+        .where(PRAnalysis.repo == repo, PRAnalysis.pr_number == pr_number)
         .order_by(desc(PRAnalysis.analyzed_at))
-        .first()
-    )
+        .limit(1)
+    )).first()
 
-    if not analysis:
+    if not found:
         raise HTTPException(status_code=404, detail="No analysis found for this PR")
 
-    return analysis_to_response(analysis)
+    return await respond_with_analysis(request, db, *found)
+
+
+def format_event(event: str, data: Any) -> str:
+    """Serialize one Server-Sent Event."""
+    payload = data.model_dump_json() if isinstance(data, BaseModel) else json.dumps(data)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def analysis_snapshot(db: AsyncSession, analysis_id: str) -> Optional[AnalysisResponse]:
+    """Load the whole analysis, then release the session's connection until the next event."""
+    analysis = await load_analysis(db, analysis_id)
+    response = analysis_to_response(analysis) if analysis else None
+    await db.close()
+    return response
+
+
+async def analysis_event_stream(db: AsyncSession, analysis_id: str) -> AsyncIterator[str]:
+    """
+    Events for one analysis: a ``snapshot`` of the whole analysis, then each
+    ``issue`` (or batch of ``issues`` reused from the cache) and ``progress``
+    update as it is stored. A status change (or a
+    ``resync`` from the bus) sends a fresh ``snapshot``; once the analysis is
+    finished, a final ``complete`` snapshot ends the stream.
+    """
+    bus = get_event_bus()
+    queue = bus.subscribe(analysis_id)  # Before the snapshot, so nothing in between is missed
+    try:
+        reload = True
+        while True:
+            if reload:
+                analysis = await analysis_snapshot(db, analysis_id)
+                if analysis is None:
+                    return
+                if analysis.status.value in TERMINAL_STATUSES:
+                    yield format_event("complete", analysis)
+                    return
+                yield format_event("snapshot", analysis)
+                status = analysis.status.value
+                reload = False
+
+            try:
+                event, data = await asyncio.wait_for(queue.get(), settings.sse_heartbeat_seconds)
+            except asyncio.TimeoutError:
+                # Workers in another process don't publish to this bus; their
+                # status changes are picked up here instead
+                current = await db.scalar(select(PRAnalysis.status).where(PRAnalysis.id == analysis_id))
+                await db.close()
+                reload = current != status
+                if not reload:
+                    yield ": keep-alive\n\n"
+                continue
+
+            if event in ("status", "resync"):
+                reload = True
+            else:
+                yield format_event(event, data)
+    finally:
+        bus.unsubscribe(queue, analysis_id)
+        await db.close()
+
+
+async def status_counts(db: AsyncSession) -> Dict[Optional[str], int]:
+    """Number of analyses per status, then release the session's connection."""
+    rows = await db.execute(select(PRAnalysis.status, func.count()).group_by(PRAnalysis.status))
+    counts = dict(rows.all())
+    await db.close()
+    return counts
+
+
+async def analyses_event_stream(db: AsyncSession) -> AsyncIterator[str]:
+    """
+    Status changes of every analysis, for refreshing lists and metrics. When
+    the counts per status in the database change between heartbeats without
+    an event (e.g. the workers run in another process), a ``resync`` is sent.
+    """
+    bus = get_event_bus()
+    queue = bus.subscribe()
+    try:
+        counts = await status_counts(db)
+        yield ": connected\n\n"
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), settings.sse_heartbeat_seconds)
+            except asyncio.TimeoutError:
+                current = await status_counts(db)
+                if current != counts:
+                    counts = current
+                    yield format_event("resync", None)
+                else:
+                    yield ": keep-alive\n\n"
+                continue
+            yield format_event(event, data)
+    finally:
+        bus.unsubscribe(queue)
+        await db.close()
+
+
+@router.get("/analysis/{analysis_id}/events")
+async def analysis_events(
+    analysis_id: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Server-Sent Events stream of one analysis' status, findings and progress."""
+    found = await db.scalar(select(PRAnalysis.id).where(PRAnalysis.id == analysis_id))
+    if not found:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+
+    return StreamingResponse(
+        analysis_event_stream(db, analysis_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@router.get("/analyses/events")
+async def all_analysis_events(db: AsyncSession = Depends(get_async_db)):
+    """Server-Sent Events stream of status changes of all analyses."""
+    return StreamingResponse(analyses_event_stream(db), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @router.post("/feedback", response_model=FeedbackResponse)
 async def submit_feedback(
     feedback: FeedbackCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Submit feedback on an issue."""
     # Verify issue exists
-    issue = db.query(Issue).filter(Issue.id == feedback.issue_id).first()
+    issue = await db.get(Issue, feedback.issue_id)
     if not issue:
         raise HTTPException(status_code=404, detail="Issue not found")
 
     # Get repo from analysis
-    analysis = db.query(PRAnalysis).filter(PRAnalysis.id == issue.analysis_id).first()
+    analysis = await db.get(PRAnalysis, issue.analysis_id)
 
     # Update issue
     issue.is_helpful = feedback.is_helpful
     if feedback.reason:
         issue.dismiss_reason = feedback.reason
+    if analysis:
+        # Changes the analysis' ETag; incremented in SQL so concurrent
+        # submissions each get their own version
+        await db.execute(
+            update(PRAnalysis)
+            .where(PRAnalysis.id == analysis.id)
+            .values(feedback_version=func.coalesce(PRAnalysis.feedback_version, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
 
     # Create feedback record
     feedback_record = Feedback(
@@ -169,8 +437,9 @@ async def submit_feedback(
         comment=feedback.comment,
     )
     db.add(feedback_record)
-    db.commit()
-    db.refresh(feedback_record)
+    await db.commit()
+    get_response_cache().invalidate(feedback_record.repo)
+    await db.refresh(feedback_record)
 
     return FeedbackResponse(
         id=feedback_record.id,
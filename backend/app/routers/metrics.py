@@ -1,16 +1,18 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, and_, select
 
-from ..models.database import get_db, PRAnalysis, Issue
+from ..models.database import get_async_db, PRAnalysis, MetricsDaily, MetricsDailyIssue
 from ..models.schemas import (
     MetricsResponse,
     IssuesByCategory,
     IssuesBySeverity,
     DailyMetrics,
 )
+from ..services.metrics_rollup import CATEGORIES, SEVERITIES
+from ..services.response_cache import get_response_cache
 
 router = APIRouter()
 
@@ -22,80 +24,39 @@ MINUTES_SAVED_PER_ISSUE = 3
 async def get_metrics(
     repo: Optional[str] = Query(None, description="Filter by repository"),
     days: int = Query(30, ge=1, le=365, description="Number of days to include"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get dashboard metrics."""
+    """Get dashboard metrics (read from the daily rollup, whole UTC days)."""
+    cache = get_response_cache()
+    cache_key = ("metrics", repo, days)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # Date range filter
-    start_date = datetime.utcnow() - timedelta(days=days)
+    today = datetime.utcnow().date()
+    start_date = today - timedelta(days=days)
 
     # Base query filters
-    analysis_filters = [PRAnalysis.analyzed_at >= start_date]
+    rollup_filters = [MetricsDaily.date >= start_date]
+    issue_filters = [MetricsDailyIssue.date >= start_date]
     if repo:
-        analysis_filters.append(PRAnalysis.repo == repo)
-
-    # Total PRs analyzed
-    total_prs = db.query(func.count(PRAnalysis.id)).filter(
-        and_(*analysis_filters, PRAnalysis.status == "completed")
-    ).scalar() or 0
+        rollup_filters.append(MetricsDaily.repo == repo)
+        issue_filters.append(MetricsDailyIssue.repo == repo)
 
-    # Total issues found
-    if repo:
-        issue_query = (
-            db.query(func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(and_(*analysis_filters))
-        )
-    else:
-        issue_query = (
-            db.query(func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(PRAnalysis.analyzed_at >= start_date)
-        )
-    total_issues = issue_query.scalar() or 0
-
-    # Issues by category
-    category_counts = {"security": 0, "quality": 0, "testing": 0, "docs": 0, "performance": 0}
-    if repo:
-        categories = (
-            db.query(Issue.category, func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(and_(*analysis_filters))
-            .group_by(Issue.category)
-            .all()
-        )
-    else:
-        categories = (
-            db.query(Issue.category, func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(PRAnalysis.analyzed_at >= start_date)
-            .group_by(Issue.category)
-            .all()
-        )
-    for category, count in categories:
-        if category in category_counts:
-            category_counts[category] = count
+    # Totals, issues by category and issues by severity
+    count_columns = ["prs_analyzed", "issues_found"] + [
+        f"{name}_count" for name in SEVERITIES + CATEGORIES
+    ]
+    totals = (await db.execute(select(*[
+        func.coalesce(func.sum(getattr(MetricsDaily, column)), 0) for column in count_columns
+    ]).where(and_(*rollup_filters)))).one()
+    totals = dict(zip(count_columns, totals))
 
-    # Issues by severity
-    severity_counts = {"critical": 0, "warning": 0, "suggestion": 0}
-    if repo:
-        severities = (
-            db.query(Issue.severity, func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(and_(*analysis_filters))
-            .group_by(Issue.severity)
-            .all()
-        )
-    else:
-        severities = (
-            db.query(Issue.severity, func.count(Issue.id))
-            .join(PRAnalysis)
-            .filter(PRAnalysis.analyzed_at >= start_date)
-            .group_by(Issue.severity)
-            .all()
-        )
-    for severity, count in severities:
-        if severity in severity_counts:
-            severity_counts[severity] = count
+    total_prs = totals["prs_analyzed"]
+    total_issues = totals["issues_found"]
+    category_counts = {name: totals[f"{name}_count"] for name in CATEGORIES}
+    severity_counts = {name: totals[f"{name}_count"] for name in SEVERITIES}
 
     # Average issues per PR
     avg_issues = total_issues / total_prs if total_prs > 0 else 0
@@ -103,57 +64,46 @@ async def get_metrics(
     # Estimated time saved (3 minutes per issue)
     time_saved_hours = (total_issues * MINUTES_SAVED_PER_ISSUE) / 60
 
-    # Daily metrics for chart
-    daily_metrics = []
-    for i in range(min(days, 30)):  # Max 30 days for daily breakdown
-        day = datetime.utcnow() - timedelta(days=i)
-        day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
+    # Daily metrics for chart, zero-filled for quiet days
+    daily_days = min(days, 30)  # Max 30 days for daily breakdown
+    first_day = today - timedelta(days=daily_days - 1)
 
-        day_filters = [
-            PRAnalysis.analyzed_at >= day_start,
-            PRAnalysis.analyzed_at < day_end,
-            PRAnalysis.status == "completed",
-        ]
-        if repo:
-            day_filters.append(PRAnalysis.repo == repo)
-
-        prs_count = db.query(func.count(PRAnalysis.id)).filter(and_(*day_filters)).scalar() or 0
-
-        issues_count = db.query(func.sum(
-            PRAnalysis.critical_count + PRAnalysis.warning_count + PRAnalysis.suggestion_count
-        )).filter(and_(*day_filters)).scalar() or 0
-
-        critical_count = db.query(func.sum(PRAnalysis.critical_count)).filter(
-            and_(*day_filters)
-        ).scalar() or 0
+    day_filters = [MetricsDaily.date >= first_day]
+    if repo:
+        day_filters.append(MetricsDaily.repo == repo)
+
+    daily_rows = (await db.execute(
+        select(
+            MetricsDaily.date,
+            func.sum(MetricsDaily.prs_analyzed),
+            func.sum(MetricsDaily.issues_found),
+            func.sum(MetricsDaily.critical_count),
+        )
+        .where(and_(*day_filters))
+        .group_by(MetricsDaily.date)
+    )).all()
+    by_day = {day: (prs, issues, critical) for day, prs, issues, critical in daily_rows}
 
+    daily_metrics = []
+    for i in range(daily_days):
+        day = first_day + timedelta(days=i)
+        prs_count, issues_count, critical_count = by_day.get(day, (0, 0, 0))
         daily_metrics.append(DailyMetrics(
-            date=day_start.strftime("%Y-%m-%d"),
-            prs_analyzed=prs_count,
-            issues_found=int(issues_count),
-            critical_issues=int(critical_count),
+            date=day.strftime("%Y-%m-%d"),
+            prs_analyzed=int(prs_count or 0),
+            issues_found=int(issues_count or 0),
+            critical_issues=int(critical_count or 0),
         ))
 
-    # Reverse to get chronological order
-    daily_metrics.reverse()
-
     # Top issues (most common issue titles)
-    top_issues_query = (
-        db.query(Issue.title, Issue.category, Issue.severity, func.count(Issue.id).label("count"))
-        .join(PRAnalysis)
-        .filter(PRAnalysis.analyzed_at >= start_date)
-    )
-    if repo:
-        top_issues_query = top_issues_query.filter(PRAnalysis.repo == repo)
-
-    top_issues = (
-        top_issues_query
-        .group_by(Issue.title, Issue.category, Issue.severity)
-        .order_by(func.count(Issue.id).desc())
+    issue_count = func.sum(MetricsDailyIssue.count)
+    top_issues = (await db.execute(
+        select(MetricsDailyIssue.title, MetricsDailyIssue.category, MetricsDailyIssue.severity, issue_count)
+        .where(and_(*issue_filters))
+        .group_by(MetricsDailyIssue.title, MetricsDailyIssue.category, MetricsDailyIssue.severity)
+        .order_by(issue_count.desc())
         .limit(10)
-        .all()
-    )
+    )).all()
 
     top_issues_list = [
         {
@@ -165,7 +115,7 @@ async def get_metrics(
         for title, category, severity, count in top_issues
     ]
 
-    return MetricsResponse(
+    response = MetricsResponse(
         total_prs_analyzed=total_prs,
         total_issues_found=total_issues,
         issues_by_category=IssuesByCategory(**category_counts),
@@ -175,16 +125,24 @@ async def get_metrics(
         daily_metrics=daily_metrics,
         top_issues=top_issues_list,
     )
+    cache.set(cache_key, response, repo=repo)
+    return response
 
 
 @router.get("/repos")
-async def list_repos(db: Session = Depends(get_db)):
+async def list_repos(db: AsyncSession = Depends(get_async_db)):
     """List all repositories with analyses."""
-    repos = (
-        db.query(PRAnalysis.repo, func.count(PRAnalysis.id).label("count"))
+    cache = get_response_cache()
+    cached = cache.get(("repos",))
+    if cached is not None:
+        return cached
+
+    repos = (await db.execute(
+        select(PRAnalysis.repo, func.count(PRAnalysis.id).label("count"))
         .group_by(PRAnalysis.repo)
         .order_by(func.count(PRAnalysis.id).desc())
-        .all()
-    )
+    )).all()
 
-    return [{"repo": repo, "analysis_count": count} for repo, count in repos]
+    response = [{"repo": repo, "analysis_count": count} for repo, count in repos]
+    cache.set(("repos",), response)
+    return response
@@ -1,13 +1,26 @@
+import asyncio
 import hashlib
 import hmac
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks, Depends
-from sqlalchemy.orm import Session
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence, Union
+from fastapi import APIRouter, Request, HTTPException, Depends
+from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from ..config import get_settings
-from ..models.database import get_db, PRAnalysis, Issue
-from ..models.schemas import GitHubWebhookPayload, WebhookResponse, Category, Severity
-from ..services.analyzer import get_analyzer_service
-from ..services.github import get_github_service
+from ..models.database import get_async_db, run_in_session, PRAnalysis, Issue
+from ..models.schemas import ClaudeIssue, GitHubWebhookPayload, WebhookResponse, FileDiff, IssueResponse
+from ..services.analysis_store import apply_pr_context, complete_analysis, insert_issues, issue_from_finding
+from ..services.analyzer import AnalysisError, AnalyzerService, get_analyzer_service
+from ..services.event_bus import get_event_bus
+from ..services.github import GitHubService, get_github_service
+from ..services.job_queue import DeferJob, get_job_queue
+from ..services.response_cache import get_response_cache
+from ..services.rate_limit import RateLimitExceeded
+from ..utils.diff import shift_line
+from .analysis import issue_to_response
 
 router = APIRouter()
 settings = get_settings()
@@ -27,122 +40,331 @@ def verify_signature(payload: bytes, signature: str) -> bool:
     return hmac.compare_digest(f"sha256={expected}", signature)
 
 
+def find_previous_analysis(db: Session, analysis: PRAnalysis) -> Optional[PRAnalysis]:
+    """
+    Latest completed review of the same PR that recorded its head SHA and
+    reviewed every file, with its issues. A partial review can't be the base
+    of an incremental one: the files it missed would never be reviewed.
+    """
+    return (
+        db.query(PRAnalysis)
+        .options(selectinload(PRAnalysis.issues))
+        .filter(
+            PRAnalysis.repo == analysis.repo,
+            PRAnalysis.pr_number == analysis.pr_number,
+            PRAnalysis.status == "completed",
+            PRAnalysis.review_complete.is_(True),
+            PRAnalysis.head_sha.isnot(None),
+            PRAnalysis.id != analysis.id,
+        )
+        .order_by(desc(PRAnalysis.analyzed_at))
+        .first()
+    )
+
+
+def is_superseded(db: Session, analysis_id: str) -> bool:
+    """Check the stored status without discarding pending changes."""
+    status = db.query(PRAnalysis.status).filter(PRAnalysis.id == analysis_id).scalar()
+    return status == "superseded"
+
+
+def start_analysis(db: Session, analysis_id: str) -> Optional[PRAnalysis]:
+    """Mark an analysis as processing, unless it is gone, superseded or already completed."""
+    analysis = db.query(PRAnalysis).filter(PRAnalysis.id == analysis_id).first()
+    if not analysis or analysis.status in ("superseded", "completed"):
+        return None
+
+    # Findings stored by an earlier, failed attempt are found again by this one
+    db.query(Issue).filter(Issue.analysis_id == analysis_id).delete(synchronize_session=False)
+    analysis.status = "processing"
+    analysis.chunks_done = analysis.chunks_total = 0
+    analysis.first_issue_ms = None
+    db.commit()
+    get_event_bus().publish_status(analysis_id, "processing")
+    return analysis
+
+
+def fail_analysis(db: Session, analysis: PRAnalysis, error: str):
+    """Discard pending changes and mark an analysis as failed."""
+    db.rollback()
+    analysis.status = "failed"
+    analysis.error_message = error
+    db.commit()
+    get_event_bus().publish_status(analysis.id, "failed", error)
+
+
+def store_streamed_issues(db: Session, issues: Sequence[Issue]):
+    """Insert and commit findings while the analysis is still running."""
+    insert_issues(db, issues)
+    db.commit()
+
+
+def save_analysis(
+    db: Session,
+    analysis: PRAnalysis,
+    issues: List[Issue],
+    stored: Sequence[Issue] = ()
+) -> List[IssueResponse]:
+    """
+    Store a completed analysis in one commit: its issues in a single
+    multi-row insert, then its counters, status and rollup.
+
+    ``stored`` are issues already inserted while streaming; they count towards
+    the totals but are not inserted again. The issues are never loaded into
+    the session; the returned responses are built from them in memory.
+
+    Returns:
+        The stored issues, for publishing.
+    """
+    insert_issues(db, issues)
+
+    issues = [*stored, *issues]
+    completed = complete_analysis(db, analysis, issues)
+
+    db.commit()
+    if completed:
+        get_event_bus().publish_status(analysis.id, "completed")
+    return [issue_to_response(issue) for issue in issues]
+
+
+async def select_incremental_files(
+    previous: PRAnalysis,
+    head_sha: str,
+    pr_files: List[FileDiff]
+) -> Optional[tuple[List[FileDiff], List[tuple[Issue, Optional[int]]]]]:
+    """
+    Narrow a re-review to the files changed since the previous head.
+
+    Previous findings are carried over unless the delta's hunks cover their
+    line (the re-review sees those lines again); findings without a line in
+    a changed file are dropped for the same reason.
+
+    Returns:
+        tuple: (files_to_analyze, [(issue_to_carry_over, its_new_line_number)]),
+        or None when the previous head is not an ancestor (e.g. after a
+        force-push) and the whole PR must be re-reviewed.
+    """
+    delta, compare_info = await get_github_service().get_compare_files(
+        previous.repo, previous.head_sha, head_sha
+    )
+    if compare_info.get("status") not in ("ahead", "identical"):
+        return None
+
+    pr_paths = {file.filename for file in pr_files}
+    delta_patches = {file.filename: file.patch for file in delta}
+
+    files = [file for file in delta if file.filename in pr_paths]
+    carried_issues = []
+    for issue in previous.issues:
+        if issue.file_path not in pr_paths:
+            continue
+        line_number = issue.line_number
+        if issue.file_path in delta_patches:
+            patch = delta_patches[issue.file_path]
+            if not patch or line_number is None:
+                continue
+            line_number = shift_line(patch, line_number)
+            if line_number is None:
+                continue
+        carried_issues.append((issue, line_number))
+    return files, carried_issues
+
+
 async def process_pr_analysis(
     analysis_id: str,
     repo: str,
     pr_number: int,
-    db: Session
+    db: Union[Session, AsyncSession]
 ):
-    """Background task to analyze a PR."""
+    """
+    Analyze a PR. Run by the job queue workers; raises so failed jobs are
+    retried, and the queue marks the analysis failed once attempts run out.
+
+    Accepts a sync or async session: database work goes through
+    ``run_in_session`` so it doesn't block the event loop on an AsyncSession.
+    """
     analyzer = get_analyzer_service()
     github = get_github_service()
 
     # Update status to processing
-    analysis = db.query(PRAnalysis).filter(PRAnalysis.id == analysis_id).first()
+    analysis = await run_in_session(db, start_analysis, analysis_id)
     if not analysis:
         return
 
-    analysis.status = "processing"
-    db.commit()
+    try:
+        with github.track_requests() as github_stats:
+            await run_pr_analysis(analysis, github, analyzer, db)
+        analysis.github_requests = github_stats.requests
+        await run_in_session(db, Session.commit)
+        print(f"Analysis {analysis_id}: {github_stats.requests} GitHub requests "
+              f"({github_stats.not_modified} not modified)")
+
+    except RateLimitExceeded as e:
+        # Out of GitHub quota: park the job (and the whole queue) until it resets
+        # rather than burning retries on requests that will be refused
+        await run_in_session(db, Session.rollback)
+        raise DeferJob(
+            datetime.utcfromtimestamp(e.retry_at),
+            reason=str(e),
+            pause_queue=True,
+        ) from e
 
+    except Exception as e:
+        print(f"Error processing PR: {e}")
+        await run_in_session(db, Session.rollback)
+        raise
+
+
+async def run_pr_analysis(
+    analysis: PRAnalysis,
+    github: GitHubService,
+    analyzer: AnalyzerService,
+    db: Union[Session, AsyncSession]
+):
+    """
+    Fetch, analyze, persist and publish one PR analysis.
+
+    With ``analysis_streaming_enabled``, each finding is committed as soon as
+    Claude has produced it, and chunk progress is committed as chunks finish,
+    so the dashboard shows findings long before the analysis completes.
+
+    Errors that a retry can't fix (e.g. the PR is gone, Claude rejects the
+    request) fail the analysis; transient ones (GitHubUnavailable, retryable
+    AnalysisError) are raised for the job queue to retry. Either way no review
+    is posted.
+    """
+    started = time.monotonic()
+    analysis_id = analysis.id
+    repo = analysis.repo
+    pr_number = analysis.pr_number
+
+    # Fetch the PR once; every later GitHub operation reuses this context
+    context, error = await github.get_pr_context(repo, pr_number)
+    if error:
+        await run_in_session(db, fail_analysis, analysis, error)
+        return
+
+    apply_pr_context(analysis, context)
+    files = context.files
+
+    # On a new push, only review the commits since the last reviewed head
+    carried_issues = []
+    previous = await run_in_session(db, find_previous_analysis, analysis)
+    if settings.incremental_analysis_enabled and previous and analysis.head_sha:
+        incremental = await select_incremental_files(previous, analysis.head_sha, files)
+        if incremental:
+            files, carried_issues = incremental
+            analysis.incremental_from_sha = previous.head_sha
+
+    # The session can't be shared by concurrent chunks, so writes take turns
+    write_lock = asyncio.Lock()
+    streamed: List[Issue] = []
+    events = get_event_bus()
+
+    async def store_issues(findings: List[ClaudeIssue]) -> List[Issue]:
+        issues = [issue_from_finding(analysis_id, finding) for finding in findings]
+        async with write_lock:
+            if not streamed:
+                analysis.first_issue_ms = int((time.monotonic() - started) * 1000)
+            await run_in_session(db, store_streamed_issues, issues)
+            streamed.extend(issues)
+        return issues
+
+    async def store_issue(finding: ClaudeIssue):
+        [issue] = await store_issues([finding])
+        events.publish(analysis_id, "issue", issue_to_response(issue).model_dump(mode="json"))
+
+    async def store_cached_issues(findings: List[ClaudeIssue]):
+        # Known up front: one insert and one event rather than one per finding
+        if findings:
+            issues = await store_issues(findings)
+            events.publish(analysis_id, "issues", [issue_to_response(issue).model_dump(mode="json") for issue in issues])
+
+    async def record_progress(done: int, total: int):
+        async with write_lock:
+            analysis.chunks_done = done
+            analysis.chunks_total = total
+            await run_in_session(db, Session.commit)
+        events.publish(analysis_id, "progress", {"chunks_done": done, "chunks_total": total})
+
+    # Analyze with Claude
+    streaming = settings.analysis_streaming_enabled
     try:
-        # Fetch PR diff
-        diff, pr_info = github.get_pr_diff(repo, pr_number)
-
-        if "error" in pr_info:
-            analysis.status = "failed"
-            analysis.error_message = pr_info["error"]
-            db.commit()
-            return
-
-        # Update analysis with PR info
-        analysis.pr_title = pr_info.get("title")
-        analysis.author = pr_info.get("author")
-        analysis.pr_url = pr_info.get("url")
-        analysis.files_changed = pr_info.get("changed_files", 0)
-        analysis.lines_added = pr_info.get("additions", 0)
-        analysis.lines_removed = pr_info.get("deletions", 0)
-
-        # Analyze with Claude
-        result, analysis_time_ms, tokens_used = await analyzer.analyze_diff(
+        result, analysis_time_ms, tokens_used = await analyzer.analyze_files(
             repo=repo,
             pr_title=analysis.pr_title or "",
             author=analysis.author or "",
-            diff=diff
+            files=files,
+            db=db,
+            on_issue=store_issue if streaming else None,
+            on_progress=record_progress,
+            on_cached=store_cached_issues if streaming else None
         )
+    except AnalysisError as e:
+        if e.retryable:
+            raise
+        await run_in_session(db, fail_analysis, analysis, str(e))
+        return
 
-        analysis.analysis_time_ms = analysis_time_ms
-        analysis.tokens_used = tokens_used
-
-        # Create issues
-        critical_count = 0
-        warning_count = 0
-        suggestion_count = 0
-
-        for issue_data in result.issues:
-            issue = Issue(
-                analysis_id=analysis_id,
-                category=issue_data.category,
-                severity=issue_data.severity,
-                file_path=issue_data.file_path,
-                line_number=issue_data.line_number,
-                title=issue_data.title,
-                message=issue_data.message,
-                explanation=issue_data.explanation,
-                suggestion=issue_data.suggestion,
-            )
-            db.add(issue)
-
-            if issue_data.severity == "critical":
-                critical_count += 1
-            elif issue_data.severity == "warning":
-                warning_count += 1
-            else:
-                suggestion_count += 1
-
-        analysis.critical_count = critical_count
-        analysis.warning_count = warning_count
-        analysis.suggestion_count = suggestion_count
-        analysis.status = "completed"
-
-        db.commit()
-
-        # Post review comment to GitHub
-        db.refresh(analysis)
-        issues_response = []
-        for issue in analysis.issues:
-            from ..models.schemas import IssueResponse
-            issues_response.append(IssueResponse(
-                id=issue.id,
-                category=Category(issue.category),
-                severity=Severity(issue.severity),
-                file_path=issue.file_path,
-                line_number=issue.line_number,
-                title=issue.title,
-                message=issue.message,
-                explanation=issue.explanation,
-                suggestion=issue.suggestion,
-                is_helpful=issue.is_helpful,
-                dismiss_reason=issue.dismiss_reason,
-                github_comment_id=issue.github_comment_id,
-                created_at=issue.created_at,
-            ))
-
-        comment_body = github.format_review_comment(issues_response, result.summary)
-        github.post_review_comment(repo, pr_number, comment_body)
+    # A newer push may have superseded this run (possibly from another worker process)
+    if await run_in_session(db, is_superseded, analysis_id):
+        await run_in_session(db, Session.rollback)
+        return
 
-    except Exception as e:
-        print(f"Error processing PR: {e}")
-        analysis.status = "failed"
-        analysis.error_message = str(e)
-        db.commit()
+    analysis.analysis_time_ms = analysis_time_ms
+    analysis.tokens_used = tokens_used
+    analysis.cache_read_tokens = result.cache_read_tokens
+    analysis.cache_creation_tokens = result.cache_creation_tokens
+    analysis.review_complete = result.complete
+
+    if analysis.incremental_from_sha:
+        result.summary = (
+            f"Reviewed {len(files)} file(s) changed since {analysis.incremental_from_sha[:7]}; "
+            f"{len(carried_issues)} earlier finding(s) carried over. {result.summary or ''}"
+        ).strip()
+
+    # Create issues (when streaming, every finding in the result is already stored)
+    new_issues = [] if streaming else [
+        issue_from_finding(analysis_id, issue_data) for issue_data in result.issues
+    ]
+    # Still-valid findings keep their feedback from the previous review
+    new_issues += [
+        Issue(
+            analysis_id=analysis_id,
+            category=issue.category,
+            severity=issue.severity,
+            file_path=issue.file_path,
+            line_number=line_number,
+            title=issue.title,
+            message=issue.message,
+            explanation=issue.explanation,
+            suggestion=issue.suggestion,
+            code_snippet=issue.code_snippet,
+            is_helpful=issue.is_helpful,
+            dismiss_reason=issue.dismiss_reason,
+        )
+        for issue, line_number in carried_issues
+    ]
+
+    issues_response = await run_in_session(db, save_analysis, analysis, new_issues, streamed)
+    get_response_cache().invalidate(repo)
+
+    # One review carrying the summary and the top inline comments
+    comment_body = github.format_review_comment(issues_response, result.summary, complete=result.complete)
+    comments = github.build_inline_comments(issues_response, context.files) if analysis.head_sha else []
+    try:
+        await github.post_review_comment(
+            repo, pr_number, comment_body, commit_sha=analysis.head_sha, comments=comments
+        )
+    except RateLimitExceeded as e:
+        # The analysis is already stored; deferring the job would redo it
+        print(f"Analysis {analysis_id}: review not posted, {e}")
 
 
 @router.post("/github", response_model=WebhookResponse)
 async def github_webhook(
     request: Request,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Handle GitHub webhook events."""
     # Get raw body for signature verification
@@ -187,20 +409,23 @@ async def github_webhook(
         pr_title=payload.pull_request.title,
         pr_url=payload.pull_request.html_url,
         author=payload.pull_request.user.login,
+        head_sha=payload.pull_request.head.sha,
         status="pending",
     )
     db.add(analysis)
-    db.commit()
-    db.refresh(analysis)
-
-    # Queue background analysis
-    background_tasks.add_task(
-        process_pr_analysis,
-        analysis.id,
-        payload.repository.full_name,
-        payload.pull_request.number,
-        db
+    await db.flush()
+
+    # Queue analysis (committed together with the analysis record). Pushes in
+    # quick succession are coalesced: each one supersedes the previous run and
+    # restarts the quiet window, so only the latest head is analyzed.
+    await run_in_session(
+        db,
+        get_job_queue().enqueue,
+        analysis,
+        delay=settings.webhook_quiet_window,
+        supersede=True,
     )
+    get_response_cache().invalidate(analysis.repo)
 
     return WebhookResponse(
         status="processing",
@@ -213,8 +438,7 @@ async def github_webhook(
 async def test_analysis(
     repo: str,
     pr_number: int,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Manually trigger analysis for testing."""
     # Create analysis record
@@ -224,17 +448,11 @@ async def test_analysis(
         status="pending",
     )
     db.add(analysis)
-    db.commit()
-    db.refresh(analysis)
-
-    # Queue background analysis
-    background_tasks.add_task(
-        process_pr_analysis,
-        analysis.id,
-        repo,
-        pr_number,
-        db
-    )
+    await db.flush()
+
+    # Queue analysis (committed together with the analysis record)
+    await run_in_session(db, get_job_queue().enqueue, analysis)
+    get_response_cache().invalidate(repo)
 
     return WebhookResponse(
         status="processing",
@@ -0,0 +1,190 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import Collection, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models.database import AnalysisCacheEntry
+from ..models.schemas import ClaudeIssue, FileDiff
+from ..utils.diff import estimate_tokens, resolve_path
+from ..utils.prompts import PROMPT_VERSION
+
+settings = get_settings()
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of per-file findings.
+
+    Entries are keyed on the hash of a file's patch plus the prompt version and
+    model, so a file whose patch is unchanged between pushes reuses its earlier
+    issues instead of being sent to Claude again. Reviews under repo-specific
+    guidance pass that guidance as ``variant`` so they get their own entries.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def make_key(self, patch: str, variant: Optional[str] = None) -> tuple[str, str]:
+        """
+        Returns:
+            tuple: (cache_key, patch_hash)
+        """
+        patch_hash = hashlib.sha256(patch.encode()).hexdigest()
+        material = f"{patch_hash}:{PROMPT_VERSION}:{settings.anthropic_model}"
+        if variant:
+            material += f":{hashlib.sha256(variant.encode()).hexdigest()}"
+        key = hashlib.sha256(material.encode()).hexdigest()
+        return key, patch_hash
+
+    def lookup(
+        self,
+        db: Session,
+        files: List[FileDiff],
+        variant: Optional[str] = None
+    ) -> Dict[str, List[ClaudeIssue]]:
+        """
+        Find cached issues for the given files.
+
+        Returns:
+            Mapping of filename to cached issues, for cache hits only.
+        """
+        keys = {}
+        for file in files:
+            if file.patch:
+                keys[self.make_key(file.patch, variant)[0]] = file
+
+        if not keys:
+            return {}
+
+        entries = (
+            db.query(AnalysisCacheEntry)
+            .filter(AnalysisCacheEntry.key.in_(list(keys)))
+            .all()
+        )
+
+        now = datetime.utcnow()
+        hits = {}
+        for entry in entries:
+            file = keys[entry.key]
+            hits[file.filename] = [
+                ClaudeIssue(**{**issue, "file_path": file.filename})
+                for issue in entry.issues or []
+            ]
+            entry.hit_count += 1
+            entry.last_used_at = now
+            self.tokens_saved += entry.tokens_used
+
+        self.hits += len(hits)
+        self.misses += len(keys) - len(hits)
+        if entries:
+            db.commit()
+
+        return hits
+
+    def store(
+        self,
+        db: Session,
+        files: List[FileDiff],
+        issues: List[ClaudeIssue],
+        tokens_used: int,
+        variant: Optional[str] = None,
+        partial: Collection[str] = ()
+    ):
+        """
+        Cache the issues found for each file of one Claude call, except the
+        ``partial`` ones (only some of their hunks were sent). Nothing is
+        cached if an issue can't be matched to one of the call's files, since
+        any of them may be the file it belongs to.
+        """
+        by_file: Dict[str, List[ClaudeIssue]] = {file.filename: [] for file in files}
+        for issue in issues:
+            filename = resolve_path(issue.file_path, by_file)
+            if filename is None:
+                return
+            by_file[filename].append(issue)
+
+        files = [file for file in files if file.patch and file.filename not in partial]
+        if not files:
+            return
+
+        # Attribute the call's tokens to files by their share of the diff
+        file_tokens = {file.filename: estimate_tokens(file.patch) for file in files}
+        total_tokens = sum(file_tokens.values())
+
+        for file in files:
+            key, patch_hash = self.make_key(file.patch, variant)
+            db.merge(AnalysisCacheEntry(
+                key=key,
+                patch_hash=patch_hash,
+                prompt_version=PROMPT_VERSION,
+                model=settings.anthropic_model,
+                file_path=file.filename,
+                issues=[issue.model_dump() for issue in by_file[file.filename]],
+                tokens_used=tokens_used * file_tokens[file.filename] // total_tokens,
+            ))
+
+        db.commit()
+        self.evict(db)
+
+    def evict(self, db: Session) -> int:
+        """
+        Drop entries older than the max age, then the least recently used
+        entries beyond the size limit.
+
+        Returns:
+            Number of entries removed.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=settings.analysis_cache_max_age_days)
+        removed = (
+            db.query(AnalysisCacheEntry)
+            .filter(AnalysisCacheEntry.last_used_at < cutoff)
+            .delete(synchronize_session=False)
+        )
+
+        overflow = db.query(func.count(AnalysisCacheEntry.key)).scalar() - settings.analysis_cache_max_entries
+        if overflow > 0:
+            stale_keys = (
+                db.query(AnalysisCacheEntry.key)
+                .order_by(AnalysisCacheEntry.last_used_at)
+                .limit(overflow)
+            )
+            removed += (
+                db.query(AnalysisCacheEntry)
+                .filter(AnalysisCacheEntry.key.in_(stale_keys.scalar_subquery()))
+                .delete(synchronize_session=False)
+            )
+
+        db.commit()
+        return removed
+
+    def stats(self, db: Session) -> dict:
+        """Hit/miss counters for this process plus lifetime totals from the database."""
+        entries, lifetime_hits, lifetime_tokens_saved = db.query(
+            func.count(AnalysisCacheEntry.key),
+            func.coalesce(func.sum(AnalysisCacheEntry.hit_count), 0),
+            func.coalesce(func.sum(AnalysisCacheEntry.hit_count * AnalysisCacheEntry.tokens_used), 0),
+        ).one()
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "entries": entries,
+            "lifetime_hits": lifetime_hits,
+            "lifetime_tokens_saved": lifetime_tokens_saved,
+        }
+
+
+# Singleton instance
+analysis_cache = AnalysisCache()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    return analysis_cache
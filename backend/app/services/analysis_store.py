@@ -0,0 +1,64 @@
+from collections import Counter
+from datetime import datetime
+from typing import Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ..models.database import generate_uuid, PRAnalysis, Issue
+from ..models.schemas import ClaudeIssue, PRContext
+from .metrics_rollup import get_metrics_rollup
+
+
+def apply_pr_context(analysis: PRAnalysis, context: PRContext):
+    """Copy the PR's details onto its analysis."""
+    analysis.pr_title = context.title
+    analysis.author = context.author
+    analysis.pr_url = context.url
+    analysis.files_changed = context.changed_files
+    analysis.lines_added = context.additions
+    analysis.lines_removed = context.deletions
+    analysis.head_sha = analysis.head_sha or context.head_sha
+
+
+def issue_from_finding(analysis_id: str, finding: ClaudeIssue) -> Issue:
+    """Build an (unsaved) issue row from one of Claude's findings."""
+    return Issue(
+        analysis_id=analysis_id,
+        category=finding.category,
+        severity=finding.severity,
+        file_path=finding.file_path,
+        line_number=finding.line_number,
+        title=finding.title,
+        message=finding.message,
+        explanation=finding.explanation,
+        suggestion=finding.suggestion,
+    )
+
+
+def insert_issues(db: Session, issues: Sequence[Issue]):
+    """Insert issues in a single multi-row statement, without loading them into the session."""
+    # Column defaults only apply to ORM-flushed objects, so fill them in here
+    now = datetime.utcnow()
+    for issue in issues:
+        issue.id = issue.id or generate_uuid()
+        issue.created_at = now
+
+    if issues:
+        columns = [column.key for column in Issue.__table__.columns]
+        db.execute(insert(Issue), [{key: getattr(issue, key) for key in columns} for issue in issues])
+
+
+def complete_analysis(db: Session, analysis: PRAnalysis, issues: Sequence[Issue]) -> bool:
+    """
+    Set an analysis' issue counts, mark it completed and add it to the rollup;
+    doesn't commit.
+
+    Returns:
+        False if the analysis was no longer processing, e.g. it was superseded.
+    """
+    severities = Counter(issue.severity for issue in issues)
+    analysis.critical_count = severities["critical"]
+    analysis.warning_count = severities["warning"]
+    analysis.suggestion_count = len(issues) - severities["critical"] - severities["warning"]
+    return get_metrics_rollup().record_completion(db, analysis, list(issues))
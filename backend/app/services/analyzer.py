@@ -1,31 +1,121 @@
+import asyncio
 import json
 import time
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional, Union
 import anthropic
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
 from ..config import get_settings
-from ..models.schemas import ClaudeAnalysisResult, ClaudeIssue
-from ..utils.prompts import ANALYSIS_SYSTEM_PROMPT, build_analysis_prompt
+from ..models.database import run_in_session, RepoConfig
+from ..models.schemas import ClaudeAnalysisResult, ClaudeIssue, FileDiff
+from ..utils.diff import PackedDiff, chunk_files, pack_files, render_diff
+from ..utils.json_stream import IssueStreamParser
+from ..utils.prompts import build_analysis_prompt, build_repo_guidance, build_system_prompt
+from .analysis_cache import get_analysis_cache
 
 settings = get_settings()
 
+# Worst-wins ordering used when merging chunk results
+QUALITY_RANK = {"good": 0, "acceptable": 1, "needs_improvement": 2}
+
+# Filenames listed per kind in the packing note of the summary
+PACKING_NOTE_FILES = 10
+
+# Called with each finding as soon as it is available
+IssueCallback = Callable[[ClaudeIssue], Awaitable[None]]
+# Called once with every finding reused from the cache
+CachedIssuesCallback = Callable[[List[ClaudeIssue]], Awaitable[None]]
+# Called with (chunks_done, chunks_total) as the analysis progresses
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class AnalysisError(Exception):
+    """
+    Claude could not review a diff. ``retryable`` errors (timeouts, lost
+    connections, rate limits, overload and other 5xx) may succeed on a later
+    attempt; others, such as a rejected request, won't.
+    """
+
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.RateLimitError, httpx.TransportError)):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+
+def load_repo_guidance(db: Session, repo: str) -> Optional[str]:
+    """The repo's custom review guidance (``RepoConfig.custom_prompts``), if any."""
+    custom_prompts = db.query(RepoConfig.custom_prompts).filter(RepoConfig.repo == repo).scalar()
+    return build_repo_guidance(custom_prompts)
+
 
 class AnalyzerService:
     def __init__(self):
         self.client = None
         if settings.anthropic_api_key:
-            self.client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
+            # Async client on a shared, keep-alive connection pool so LLM calls
+            # never block the event loop.
+            self.client = anthropic.AsyncAnthropic(
+                api_key=settings.anthropic_api_key,
+                timeout=settings.analysis_timeout,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=settings.anthropic_max_connections,
+                        max_keepalive_connections=settings.anthropic_max_keepalive_connections,
+                    ),
+                    timeout=settings.analysis_timeout,
+                ),
+            )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """Concurrency cap for in-flight Claude calls, bound to the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(settings.anthropic_max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def close(self):
+        """Release pooled connections."""
+        if self.client:
+            await self.client.close()
 
     async def analyze_diff(
         self,
         repo: str,
         pr_title: str,
         author: str,
-        diff: str
+        diff: str,
+        on_issue: Optional[IssueCallback] = None,
+        guidance: Optional[str] = None,
+        cache_prefix: bool = False
     ) -> tuple[ClaudeAnalysisResult, int, int]:
         """
         Analyze a PR diff using Claude.
 
+        The system prompt (instructions, output format and the repo's
+        ``guidance``) goes ahead of the diff. Its shared instructions are
+        always marked cacheable, so reviews read them from Claude's prompt
+        cache; with ``cache_prefix``, e.g. when other calls will send the same
+        prompt, the repo's guidance is too. ``tokens_used`` counts uncached
+        input and output tokens; cache reads and writes are reported on the
+        result.
+
+        With ``on_issue``, the response is streamed and each issue is passed to
+        ``on_issue`` as soon as its JSON object is complete; the returned result
+        holds exactly those issues.
+
+        API errors raise AnalysisError rather than passing for an empty review.
+
         Returns:
             tuple: (analysis_result, analysis_time_ms, tokens_used)
         """
@@ -33,19 +123,16 @@ class AnalyzerService:
             # Return empty result if no API key configured
             return ClaudeAnalysisResult(issues=[], summary="API key not configured"), 0, 0
 
-        start_time = time.time()
-
-        user_prompt = build_analysis_prompt(repo, pr_title, author, diff)
+        request = self.build_request(repo, pr_title, author, diff, guidance, cache_prefix)
 
+        streamed: List[ClaudeIssue] = []
         try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4096,
-                system=ANALYSIS_SYSTEM_PROMPT,
-                messages=[
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
+            async with self.semaphore:
+                start_time = time.time()
+                if on_issue:
+                    message = await self._stream_message(request, on_issue, streamed)
+                else:
+                    message = await self.client.messages.create(**request)
 
             analysis_time_ms = int((time.time() - start_time) * 1000)
             tokens_used = message.usage.input_tokens + message.usage.output_tokens
@@ -53,15 +140,233 @@ class AnalyzerService:
             # Parse response
             response_text = message.content[0].text
             result = self._parse_response(response_text)
+            result.cache_read_tokens = getattr(message.usage, "cache_read_input_tokens", None) or 0
+            result.cache_creation_tokens = getattr(message.usage, "cache_creation_input_tokens", None) or 0
+            if getattr(message, "stop_reason", None) == "max_tokens":
+                result.complete = False
+            if on_issue:
+                # What was streamed (and possibly already stored) is authoritative
+                result.issues = streamed
 
             return result, analysis_time_ms, tokens_used
 
-        except anthropic.APIError as e:
+        except (anthropic.APIError, httpx.TransportError) as e:
             print(f"Claude API error: {e}")
-            return ClaudeAnalysisResult(
-                issues=[],
-                summary=f"Analysis failed: {str(e)}"
-            ), 0, 0
+            raise AnalysisError(f"Claude API error: {e}", retryable=_is_transient(e)) from e
+
+    def build_request(
+        self,
+        repo: str,
+        pr_title: str,
+        author: str,
+        diff: str,
+        guidance: Optional[str] = None,
+        cache_prefix: bool = False
+    ) -> dict:
+        """
+        Messages API parameters for reviewing one diff (also used as a batch
+        request's params). The shared instructions are marked cacheable; with
+        ``cache_prefix``, the whole system prompt is, if it is long enough.
+        """
+        return dict(
+            model=settings.anthropic_model,
+            max_tokens=4096,
+            system=build_system_prompt(guidance, settings.prompt_cache_min_tokens, cache_guidance=cache_prefix),
+            messages=[
+                {"role": "user", "content": build_analysis_prompt(repo, pr_title, author, diff)}
+            ]
+        )
+
+    def parse_message(self, message: dict) -> tuple[ClaudeAnalysisResult, int]:
+        """
+        Parse a Messages API response given as JSON, e.g. a batch result.
+
+        Returns:
+            tuple: (analysis_result, tokens_used)
+        """
+        text = "".join(block.get("text", "") for block in message.get("content", []) if block.get("type") == "text")
+        usage = message.get("usage") or {}
+
+        result = self._parse_response(text)
+        result.cache_read_tokens = usage.get("cache_read_input_tokens") or 0
+        result.cache_creation_tokens = usage.get("cache_creation_input_tokens") or 0
+        if message.get("stop_reason") == "max_tokens":
+            result.complete = False
+        return result, (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+
+    async def _stream_message(self, request: dict, on_issue: IssueCallback, streamed: List[ClaudeIssue]):
+        """
+        Stream a request, appending each completed issue to ``streamed`` and
+        passing it to ``on_issue``.
+
+        Returns:
+            The final message, for its full text and usage.
+        """
+        parser = IssueStreamParser()
+        async with self.client.messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                for issue_data in parser.feed(text):
+                    issue = self._parse_issue(issue_data)
+                    if issue:
+                        streamed.append(issue)
+                        await on_issue(issue)
+            return await stream.get_final_message()
+
+    async def analyze_files(
+        self,
+        repo: str,
+        pr_title: str,
+        author: str,
+        files: List[FileDiff],
+        db: Optional[Union[Session, AsyncSession]] = None,
+        on_issue: Optional[IssueCallback] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        on_cached: Optional[CachedIssuesCallback] = None
+    ) -> tuple[ClaudeAnalysisResult, int, int]:
+        """
+        Analyze a PR from its per-file diffs.
+
+        When a database session is given, files whose patch is unchanged since
+        an earlier analysis reuse their cached issues. Large PRs are split into
+        chunks of ``analysis_chunk_token_budget`` tokens that are analyzed
+        concurrently and merged, so wall-clock time tracks the largest chunk
+        rather than the whole PR. What is sent is capped at
+        ``analysis_token_budget`` tokens, highest-risk files first; files left
+        out (in whole or part) are listed in the summary.
+
+        With ``on_issue``, every new issue is passed to it as soon as Claude has
+        produced it, and ``on_progress`` is told how many chunks are done.
+        Issues reused from the cache are passed together to ``on_cached`` (or
+        one by one to ``on_issue`` without it) before any call is made. If a chunk raises AnalysisError, the other chunks are
+        cancelled and the error is raised.
+
+        Returns:
+            tuple: (analysis_result, analysis_time_ms, tokens_used)
+        """
+        if not self.client:
+            return ClaudeAnalysisResult(issues=[], summary="API key not configured"), 0, 0
+
+        start_time = time.time()
+        cache = get_analysis_cache()
+        use_cache = db is not None and settings.analysis_cache_enabled
+
+        guidance = await run_in_session(db, load_repo_guidance, repo) if db is not None else None
+        cached = await run_in_session(db, cache.lookup, files, guidance) if use_cache else {}
+        uncached = [file for file in files if file.filename not in cached]
+
+        # Without fan-out everything goes into one call of one chunk's size
+        budget = settings.analysis_token_budget if settings.analysis_fanout_enabled else settings.analysis_chunk_token_budget
+        packed = pack_files(uncached, budget, settings.max_diff_lines)
+        pending = packed.files
+
+        results = []
+        if cached:
+            results.append(ClaudeAnalysisResult(
+                issues=[issue for issues in cached.values() for issue in issues],
+                summary=f"{len(cached)} unchanged file(s) reused from the previous review.",
+            ))
+            if on_cached:
+                await on_cached(results[0].issues)
+            elif on_issue:
+                for issue in results[0].issues:
+                    await on_issue(issue)
+
+        tokens_used = 0
+        if pending:
+            chunks = [pending]
+            if settings.analysis_fanout_enabled:
+                chunks = chunk_files(pending, settings.analysis_chunk_token_budget)
+                if len(chunks) == 1:
+                    chunks = [pending]  # Keep the original file order
+
+            workers = asyncio.Semaphore(settings.analysis_fanout_workers)
+            chunks_done = 0
+            if on_progress:
+                await on_progress(0, len(chunks))
+
+            async def analyze_chunk(chunk: List[FileDiff]):
+                nonlocal chunks_done
+                async with workers:
+                    # Chunks of one PR share the system prompt
+                    outcome = await self.analyze_diff(
+                        repo, pr_title, author, render_diff(chunk), on_issue, guidance,
+                        cache_prefix=len(chunks) > 1,
+                    )
+                chunks_done += 1
+                if on_progress:
+                    await on_progress(chunks_done, len(chunks))
+                return outcome
+
+            tasks = [asyncio.create_task(analyze_chunk(chunk)) for chunk in chunks]
+            try:
+                outcomes = await asyncio.gather(*tasks)
+            except BaseException:
+                # Don't leave sibling chunks storing findings for a failed run
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+            whole_files = {file.filename: file.patch for file in uncached}
+            for chunk, (result, _, chunk_tokens) in zip(chunks, outcomes):
+                results.append(result)
+                tokens_used += chunk_tokens
+                if use_cache and result.complete:
+                    # Hunk-split pieces of a file are not cacheable on their own
+                    await run_in_session(
+                        db,
+                        cache.store,
+                        chunk,
+                        result.issues,
+                        chunk_tokens,
+                        guidance,
+                        {piece.filename for piece in chunk if piece.patch != whole_files[piece.filename]},
+                    )
+
+        analysis_time_ms = int((time.time() - start_time) * 1000)
+        if not results:
+            result = ClaudeAnalysisResult(issues=[], summary="No changed files to review.")
+        else:
+            result = results[0] if len(results) == 1 else self._merge_results(results)
+
+        note = self._packing_note(packed)
+        if note:
+            result.summary = f"{result.summary or ''} {note}".strip()
+            result.complete = False
+
+        return result, analysis_time_ms, tokens_used
+
+    def _packing_note(self, packed: PackedDiff) -> Optional[str]:
+        """Summary sentence listing the files left out of the review, if any."""
+        def listing(filenames: List[str]) -> str:
+            shown = ", ".join(filenames[:PACKING_NOTE_FILES])
+            more = len(filenames) - PACKING_NOTE_FILES
+            return f"{shown} and {more} more" if more > 0 else shown
+
+        notes = []
+        if packed.skipped:
+            notes.append(f"Not reviewed (over the review budget): {listing(packed.skipped)}.")
+        if packed.truncated:
+            notes.append(f"Only partly reviewed: {listing(packed.truncated)}.")
+        return " ".join(notes) or None
+
+    def _merge_results(self, results: List[ClaudeAnalysisResult]) -> ClaudeAnalysisResult:
+        """Combine per-chunk results into a single analysis result."""
+        summaries = [result.summary for result in results if result.summary]
+        qualities = [
+            result.overall_quality for result in results
+            if result.overall_quality in QUALITY_RANK
+        ]
+
+        return ClaudeAnalysisResult(
+            issues=[issue for result in results for issue in result.issues],
+            summary=f"Reviewed in {len(results)} parts. " + " ".join(summaries),
+            has_tests=any(result.has_tests for result in results),
+            overall_quality=max(qualities, key=QUALITY_RANK.get) if qualities else None,
+            cache_read_tokens=sum(result.cache_read_tokens for result in results),
+            cache_creation_tokens=sum(result.cache_creation_tokens for result in results),
+            complete=all(result.complete for result in results),
+        )
 
     def _parse_response(self, response_text: str) -> ClaudeAnalysisResult:
         """Parse Claude's JSON response into structured result."""
@@ -74,23 +379,10 @@ class AnalyzerService:
                 json_str = response_text[json_start:json_end]
                 data = json.loads(json_str)
 
-                issues = []
-                for issue_data in data.get("issues", []):
-                    try:
-                        issue = ClaudeIssue(
-                            category=issue_data.get("category", "quality"),
-                            severity=issue_data.get("severity", "suggestion"),
-                            file_path=issue_data.get("file_path", "unknown"),
-                            line_number=issue_data.get("line_number"),
-                            title=issue_data.get("title", "Issue found"),
-                            message=issue_data.get("message", ""),
-                            explanation=issue_data.get("explanation"),
-                            suggestion=issue_data.get("suggestion"),
-                        )
-                        issues.append(issue)
-                    except Exception as e:
-                        print(f"Error parsing issue: {e}")
-                        continue
+                issues = [
+                    issue for issue in map(self._parse_issue, data.get("issues", []))
+                    if issue
+                ]
 
                 return ClaudeAnalysisResult(
                     issues=issues,
@@ -99,11 +391,28 @@ class AnalyzerService:
                     overall_quality=data.get("overall_quality"),
                 )
 
-            return ClaudeAnalysisResult(issues=[], summary="Could not parse response")
+            return ClaudeAnalysisResult(issues=[], summary="Could not parse response", complete=False)
 
         except json.JSONDecodeError as e:
             print(f"JSON parse error: {e}")
-            return ClaudeAnalysisResult(issues=[], summary="Invalid JSON response")
+            return ClaudeAnalysisResult(issues=[], summary="Invalid JSON response", complete=False)
+
+    def _parse_issue(self, issue_data: dict) -> Optional[ClaudeIssue]:
+        """Parse one issue object, or None if it is malformed."""
+        try:
+            return ClaudeIssue(
+                category=issue_data.get("category", "quality"),
+                severity=issue_data.get("severity", "suggestion"),
+                file_path=issue_data.get("file_path", "unknown"),
+                line_number=issue_data.get("line_number"),
+                title=issue_data.get("title", "Issue found"),
+                message=issue_data.get("message", ""),
+                explanation=issue_data.get("explanation"),
+                suggestion=issue_data.get("suggestion"),
+            )
+        except Exception as e:
+            print(f"Error parsing issue: {e}")
+            return None
 
 
 # Singleton instance
@@ -0,0 +1,416 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Union
+
+import httpx
+from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models.database import AsyncSessionLocal, generate_uuid, run_in_session, BackfillRun, Issue, PRAnalysis
+from ..models.schemas import PRContext
+from ..utils.diff import pack_files, render_diff
+from .analysis_store import apply_pr_context, complete_analysis, insert_issues, issue_from_finding
+from .analyzer import get_analyzer_service, load_repo_guidance
+from .event_bus import get_event_bus
+from .github import GitHubUnavailable, get_github_service
+from .job_queue import LEASE_RENEWALS_PER_TIMEOUT
+from .message_batches import MessageBatchError, get_message_batch_client
+from .rate_limit import RateLimitExceeded
+from .response_cache import get_response_cache
+
+settings = get_settings()
+
+
+class BackfillError(Exception):
+    """A backfill step could not complete; running the backfill again resumes it."""
+
+
+def add_analyses(db: Session, run_id: str, pr_numbers: Sequence[int]) -> List[tuple[str, int]]:
+    """
+    Create a pending analysis for each PR that has neither a completed
+    analysis nor one from this run.
+
+    Returns:
+        (analysis_id, pr_number) of every pending analysis of the run.
+    """
+    run = db.get(BackfillRun, run_id)
+    covered = {
+        number for (number,) in db.query(PRAnalysis.pr_number).filter(
+            PRAnalysis.repo == run.repo,
+            (PRAnalysis.status == "completed") | (PRAnalysis.backfill_run_id == run_id),
+        )
+    }
+    db.add_all([
+        PRAnalysis(repo=run.repo, pr_number=number, status="pending", backfill_run_id=run_id)
+        for number in dict.fromkeys(pr_numbers) if number not in covered
+    ])
+    run.prs_found = len(pr_numbers)
+    db.commit()
+    get_response_cache().invalidate(run.repo)
+
+    return [
+        (analysis_id, number) for analysis_id, number in db.query(PRAnalysis.id, PRAnalysis.pr_number)
+        .filter(PRAnalysis.backfill_run_id == run_id, PRAnalysis.status == "pending")
+        .order_by(PRAnalysis.pr_number.desc())
+    ]
+
+
+def mark_submitted(
+    db: Session,
+    run_id: str,
+    batch_id: Optional[str],
+    contexts: Dict[str, PRContext],
+    errors: Dict[str, str]
+):
+    """Record the submitted batch; analyses whose PR couldn't be fetched fail."""
+    analyses = db.query(PRAnalysis).filter(PRAnalysis.id.in_([*contexts, *errors])).all()
+    for analysis in analyses:
+        if analysis.id in errors:
+            analysis.status = "failed"
+            analysis.error_message = errors[analysis.id]
+        else:
+            apply_pr_context(analysis, contexts[analysis.id])
+            analysis.status = "processing"
+
+    now = datetime.utcnow()
+    run = db.get(BackfillRun, run_id)
+    run.batch_id = batch_id
+    run.prs_submitted = len(contexts)
+    run.prs_failed = len(errors)
+    run.error_message = None
+    if batch_id:
+        run.status = "submitted"
+        run.submitted_at = now
+    else:
+        run.status = "completed"
+        run.finished_at = now
+    db.commit()
+
+    events = get_event_bus()
+    for analysis_id in contexts:
+        events.publish_status(analysis_id, "processing")
+    for analysis_id, error in errors.items():
+        events.publish_status(analysis_id, "failed", error)
+
+
+def _result_error(outcome: Dict[str, Any]) -> str:
+    if outcome.get("type") == "errored":
+        error = outcome.get("error") or {}
+        error = error.get("error", error)
+        return f"Batch request failed: {error.get('message', 'unknown error')}"
+    return f"Batch request {outcome.get('type') or 'failed'}"
+
+
+def store_results(db: Session, run_id: str, results: List[Dict[str, Any]]):
+    """
+    Store the results of a run's batch in one transaction: every issue in a
+    single multi-row insert, then the analyses' counters, status and rollup.
+    Results that are already stored are not stored or counted again.
+    """
+    # Conditional update so the results are stored once, even by two processes
+    stored = (
+        db.query(BackfillRun)
+        .filter(BackfillRun.id == run_id, BackfillRun.status == "submitted")
+        .update({BackfillRun.status: "completed"}, synchronize_session=False)
+    )
+    if not stored:
+        db.rollback()
+        return
+
+    run = db.get(BackfillRun, run_id, populate_existing=True)
+    pending = {
+        analysis.id: analysis for analysis in db.query(PRAnalysis).filter(
+            PRAnalysis.backfill_run_id == run_id, PRAnalysis.status == "processing"
+        )
+    }
+
+    analyzer = get_analyzer_service()
+    completed: List[tuple[PRAnalysis, List[Issue]]] = []
+    failed: List[PRAnalysis] = []
+    for entry in results:
+        analysis = pending.pop(entry.get("custom_id"), None)
+        if analysis is None:
+            continue
+        outcome = entry.get("result") or {}
+        if outcome.get("type") != "succeeded":
+            analysis.error_message = _result_error(outcome)
+            failed.append(analysis)
+            continue
+
+        result, tokens_used = analyzer.parse_message(outcome["message"])
+        analysis.tokens_used = tokens_used
+        analysis.cache_read_tokens = result.cache_read_tokens
+        analysis.cache_creation_tokens = result.cache_creation_tokens
+        analysis.review_complete = result.complete
+        completed.append((analysis, [issue_from_finding(analysis.id, finding) for finding in result.issues]))
+
+    for analysis in pending.values():
+        analysis.error_message = "No result in the batch"
+        failed.append(analysis)
+    for analysis in failed:
+        analysis.status = "failed"
+
+    insert_issues(db, [issue for _, issues in completed for issue in issues])
+    for analysis, issues in completed:
+        complete_analysis(db, analysis, issues)
+
+    run.prs_completed = (run.prs_completed or 0) + len(completed)
+    run.prs_failed = (run.prs_failed or 0) + len(failed)
+    run.tokens_used = (run.tokens_used or 0) + sum(analysis.tokens_used for analysis, _ in completed)
+    run.error_message = None
+    run.finished_at = datetime.utcnow()
+    db.commit()
+    get_response_cache().invalidate(run.repo)
+
+    events = get_event_bus()
+    for analysis, _ in completed:
+        events.publish_status(analysis.id, "completed")
+    for analysis in failed:
+        events.publish_status(analysis.id, "failed", analysis.error_message)
+
+
+def record_error(db: Session, run_id: str, error: str):
+    """Note why a run stopped; it keeps its status so running it again resumes it."""
+    db.rollback()
+    db.get(BackfillRun, run_id).error_message = error
+    db.commit()
+
+
+def claim_run(db: Session, run_id: str, owner: str) -> bool:
+    """
+    Lease an unfinished run, so only one process (app instance or CLI) runs it.
+
+    Returns:
+        False if the run is completed or another process holds its lease.
+    """
+    now = datetime.utcnow()
+    # Conditional update so two processes can't lease the same run
+    claimed = (
+        db.query(BackfillRun)
+        .filter(
+            BackfillRun.id == run_id,
+            BackfillRun.status != "completed",
+            or_(BackfillRun.leased_until.is_(None), BackfillRun.leased_until < now),
+        )
+        .update(
+            {
+                BackfillRun.leased_by: owner,
+                BackfillRun.leased_until: now + timedelta(seconds=settings.backfill_lease_timeout),
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return bool(claimed)
+
+
+def renew_lease(db: Session, run_id: str, owner: str) -> bool:
+    """
+    Extend a run's lease.
+
+    Returns:
+        False if the process no longer holds the run.
+    """
+    renewed = (
+        db.query(BackfillRun)
+        .filter(BackfillRun.id == run_id, BackfillRun.leased_by == owner)
+        .update(
+            {BackfillRun.leased_until: datetime.utcnow() + timedelta(seconds=settings.backfill_lease_timeout)},
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return bool(renewed)
+
+
+def release_run(db: Session, run_id: str, owner: str):
+    """Give up a run's lease, discarding any step that wasn't committed."""
+    db.rollback()
+    db.query(BackfillRun).filter(BackfillRun.id == run_id, BackfillRun.leased_by == owner).update(
+        {BackfillRun.leased_by: None, BackfillRun.leased_until: None},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def load_run(db: Session, run_id: str) -> Optional[BackfillRun]:
+    return db.get(BackfillRun, run_id, populate_existing=True)
+
+
+def unfinished_runs(db: Session) -> List[str]:
+    """IDs of the runs whose results aren't stored yet, oldest first."""
+    return [
+        run_id for (run_id,) in db.query(BackfillRun.id)
+        .filter(BackfillRun.status != "completed")
+        .order_by(BackfillRun.created_at)
+    ]
+
+
+class BackfillService:
+    """
+    Analyzes a repo's most recent PRs in bulk, e.g. when onboarding it,
+    through one Message Batch instead of a synchronous Claude call per PR.
+
+    A run lists the PRs (skipping those already analyzed), fetches their
+    diffs, submits one request per PR, polls until the batch has ended and
+    stores every result in one transaction. Each step is committed, so a run
+    that was interrupted (restart, GitHub quota, API error) continues where it
+    stopped when run again: PRs are not collected twice, a submitted batch is
+    polled rather than resubmitted, and results are stored once. (A crash
+    between submitting the batch and committing its ID does submit again.)
+
+    Runs outlive a restart: on startup the app resumes every unfinished run
+    (``resume_unfinished``). A process leases a run in the database while it
+    runs it, so other app instances or a CLI ``--resume`` leave it alone; the
+    lease is renewed while the run is in progress and expires if the process
+    dies, letting the next attempt take over.
+
+    Backfilled analyses are stored like any other, but no review is posted
+    to the PRs.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._tasks: Set[asyncio.Task] = set()
+
+    def create_run(self, db: Session, repo: str, limit: Optional[int] = None) -> BackfillRun:
+        run = BackfillRun(repo=repo, pr_limit=limit or settings.backfill_max_prs)
+        db.add(run)
+        db.commit()
+        db.refresh(run)
+        return run
+
+    async def run(self, db: Union[Session, AsyncSession], run_id: str) -> Optional[BackfillRun]:
+        """
+        Run a backfill, or resume an interrupted one, until its results are
+        stored. Errors are recorded on the run rather than raised. A run that
+        another process (or task) holds the lease of is left to it.
+
+        Returns:
+            The run, or None if there is no such run.
+        """
+        owner = generate_uuid()
+        if not await run_in_session(db, claim_run, run_id, owner):
+            return await run_in_session(db, load_run, run_id)
+        run = await run_in_session(db, load_run, run_id)
+        repo, limit, status, batch_id = run.repo, run.pr_limit, run.status, run.batch_id
+
+        lease = asyncio.create_task(self._keep_leased(run_id, owner))
+        try:
+            if status == "collecting":
+                batch_id = await self._submit(db, run_id, repo, limit)
+                status = "submitted" if batch_id else "completed"
+            if status == "submitted":
+                batch = await self._wait(batch_id)
+                results = await get_message_batch_client().results(batch)
+                await run_in_session(db, store_results, run_id, results)
+
+        except (BackfillError, GitHubUnavailable, MessageBatchError, RateLimitExceeded, httpx.HTTPError) as e:
+            print(f"Backfill {run_id} stopped: {e}")
+            await run_in_session(db, record_error, run_id, str(e))
+        finally:
+            lease.cancel()
+            await asyncio.gather(lease, return_exceptions=True)
+            await run_in_session(db, release_run, run_id, owner)
+
+        return await run_in_session(db, load_run, run_id)
+
+    async def _keep_leased(self, run_id: str, owner: str):
+        """Renew a run's lease while it is in progress, in a session of its own."""
+        while True:
+            await asyncio.sleep(settings.backfill_lease_timeout / LEASE_RENEWALS_PER_TIMEOUT)
+            db = self.session_factory()
+            try:
+                if not await run_in_session(db, renew_lease, run_id, owner):
+                    return
+            except Exception as e:
+                print(f"Backfill {run_id}: could not renew lease: {e}")
+            finally:
+                await run_in_session(db, Session.close)
+
+    async def run_detached(self, run_id: str):
+        """Run a backfill on its own session, e.g. as a background task."""
+        async with self.session_factory() as db:
+            await self.run(db, run_id)
+
+    async def resume_unfinished(self) -> List[asyncio.Task]:
+        """
+        Resume every unfinished run in the background, e.g. on startup.
+
+        Returns:
+            The tasks running them.
+        """
+        async with self.session_factory() as db:
+            run_ids = await run_in_session(db, unfinished_runs)
+
+        tasks = [asyncio.create_task(self.run_detached(run_id)) for run_id in run_ids]
+        for task in tasks:
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return tasks
+
+    async def stop(self):
+        """Cancel resumed runs; they continue from their last committed step on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _submit(self, db: Union[Session, AsyncSession], run_id: str, repo: str, limit: int) -> Optional[str]:
+        """
+        Collect the PRs and submit their batch.
+
+        Returns:
+            The batch ID, or None if there was nothing to submit.
+        """
+        github = get_github_service()
+        analyzer = get_analyzer_service()
+
+        pr_numbers, error = await github.list_pull_numbers(repo, limit)
+        if error:
+            raise BackfillError(f"Could not list pull requests: {error}")
+        pending = await run_in_session(db, add_analyses, run_id, pr_numbers)
+        guidance = await run_in_session(db, load_repo_guidance, repo)
+
+        fetched = await asyncio.gather(*[github.get_pr_context(repo, number) for _, number in pending])
+
+        requests = []
+        contexts: Dict[str, PRContext] = {}
+        errors: Dict[str, str] = {}
+        for (analysis_id, _), (context, error) in zip(pending, fetched):
+            if error:
+                errors[analysis_id] = error
+                continue
+            contexts[analysis_id] = context
+            packed = pack_files(context.files, settings.analysis_token_budget, settings.max_diff_lines)
+            requests.append({
+                "custom_id": analysis_id,
+                # Requests of one batch share the system prompt
+                "params": analyzer.build_request(
+                    repo, context.title or "", context.author or "", render_diff(packed.files), guidance,
+                    cache_prefix=len(pending) > 1,
+                ),
+            })
+
+        batch_id = (await get_message_batch_client().create(requests))["id"] if requests else None
+        await run_in_session(db, mark_submitted, run_id, batch_id, contexts, errors)
+        return batch_id
+
+    async def _wait(self, batch_id: str) -> Dict[str, Any]:
+        """Poll a batch until it has ended."""
+        batches = get_message_batch_client()
+        while True:
+            batch = await batches.retrieve(batch_id)
+            if batch.get("processing_status") == "ended":
+                return batch
+            await asyncio.sleep(settings.backfill_poll_interval)
+
+
+# Singleton instance
+backfill_service = BackfillService()
+
+
+def get_backfill_service() -> BackfillService:
+    return backfill_service
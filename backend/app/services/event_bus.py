@@ -0,0 +1,85 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+from ..config import get_settings
+
+settings = get_settings()
+
+# (event name, JSON-serializable data)
+Event = Tuple[str, Optional[dict]]
+
+
+class AnalysisEventBus:
+    """
+    In-process fan-out of analysis events to Server-Sent Events subscribers.
+
+    Each subscriber gets its own bounded queue, either for one analysis or for
+    status changes of every analysis (``ALL``). A subscriber that falls behind
+    has its backlog dropped and gets a single ``resync`` event instead, telling
+    it to reload. Publish only after the change is committed, so a subscriber
+    that reloads on an event sees it.
+    """
+
+    ALL = "*"
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self.queue_size = settings.sse_queue_size if queue_size is None else queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.published = 0
+        self.resyncs = 0
+
+    def subscribe(self, analysis_id: str = ALL) -> asyncio.Queue:
+        """
+        Returns:
+            Queue of ``(event, data)`` tuples; pass it to ``unsubscribe`` when done.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[analysis_id].add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, analysis_id: str = ALL):
+        subscribers = self._subscribers.get(analysis_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[analysis_id]
+
+    def publish(self, analysis_id: str, event: str, data: dict):
+        """Send an event to the analysis' subscribers; status changes also go to ``ALL``."""
+        targets = set(self._subscribers.get(analysis_id, ()))
+        if event == "status":
+            targets |= self._subscribers.get(self.ALL, set())
+
+        for queue in targets:
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", None))
+                self.resyncs += 1
+        self.published += 1
+
+    def publish_status(self, analysis_id: str, status: str, error_message: Optional[str] = None):
+        self.publish(analysis_id, "status", {
+            "analysis_id": analysis_id,
+            "status": status,
+            "error_message": error_message,
+        })
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "analyses_watched": len([key for key in self._subscribers if key != self.ALL]),
+            "published": self.published,
+            "resyncs": self.resyncs,
+        }
+
+
+# Singleton instance
+event_bus = AnalysisEventBus()
+
+
+def get_event_bus() -> AnalysisEventBus:
+    return event_bus
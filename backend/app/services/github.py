@@ -1,90 +1,379 @@
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Optional, List, Dict, Any
-from github import Github, GithubException
-from github.PullRequest import PullRequest
+import httpx
 
 from ..config import get_settings
-from ..models.schemas import IssueResponse
+from ..models.schemas import IssueResponse, FileDiff, PRContext
+from ..utils.diff import render_diff, commentable_lines
+from .rate_limit import GitHubRateLimiter, RateLimitExceeded
 
 settings = get_settings()
 
+SEVERITY_ORDER = {"critical": 0, "warning": 1, "suggestion": 2}
+
+
+class GitHubAPIError(Exception):
+    """Non-2xx response from the GitHub REST API."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class GitHubUnavailable(Exception):
+    """A GitHub request failed in a way a later attempt may not (5xx, timeout, lost connection)."""
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed GitHub request may succeed if retried."""
+    if isinstance(error, GitHubAPIError):
+        return error.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class RequestStats:
+    """GitHub requests made during one analysis run."""
+
+    def __init__(self):
+        self.requests = 0
+        self.not_modified = 0  # Served from the ETag cache
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("github_request_stats", default=None)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 
 class GitHubService:
     def __init__(self):
         self.client = None
         if settings.github_token:
-            self.client = Github(settings.github_token)
+            http2 = settings.github_http2 and _http2_available()
+            if settings.github_http2 and not http2:
+                print("GITHUB_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+
+            # Keep-alive pool shared by all analyses so GitHub I/O can overlap
+            self.client = httpx.AsyncClient(
+                base_url=settings.github_api_url,
+                headers={
+                    "Authorization": f"Bearer {settings.github_token}",
+                    "Accept": "application/vnd.github+json",
+                    "X-GitHub-Api-Version": "2022-11-28",
+                    "User-Agent": "CodeGuard",
+                },
+                timeout=settings.github_timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.github_max_connections,
+                    max_keepalive_connections=settings.github_max_keepalive_connections,
+                ),
+                http2=http2,
+            )
 
-    def get_pr_diff(self, repo: str, pr_number: int) -> tuple[str, dict]:
+        # Conditional-request cache: URL -> {etag, last_modified, body, link}.
+        # GitHub doesn't count 304 Not Modified responses against the rate limit.
+        self._etag_cache: "OrderedDict[str, Dict[str, Optional[str]]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._load_etag_cache()
+
+        # Shared by every request this service makes, across all analyses
+        self.rate_limiter = GitHubRateLimiter()
+
+    async def close(self):
+        """Release pooled connections and persist the response cache."""
+        self._save_etag_cache()
+        if self.client:
+            await self.client.aclose()
+
+    def _load_etag_cache(self):
+        path = settings.github_cache_path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+            self._etag_cache = OrderedDict(entries[-settings.github_cache_max_entries:])
+        except (OSError, ValueError) as e:
+            print(f"Could not load GitHub response cache: {e}")
+
+    def _save_etag_cache(self):
+        path = settings.github_cache_path
+        if not path:
+            return
+        try:
+            with open(path, "w") as f:
+                json.dump(list(self._etag_cache.items()), f)
+        except OSError as e:
+            print(f"Could not save GitHub response cache: {e}")
+
+    @contextmanager
+    def track_requests(self):
+        """
+        Count GitHub requests made inside this block (including by tasks it
+        spawns), e.g. ``with github.track_requests() as stats: ...``.
+        """
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            _request_stats.reset(token)
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, revalidating cached GET responses with ETag/Last-Modified."""
+        await self.rate_limiter.acquire()
+
+        stats = _request_stats.get()
+        if stats:
+            stats.requests += 1
+
+        request = self.client.build_request(method, url, **kwargs)
+        if method != "GET" or settings.github_cache_max_entries <= 0:
+            return self._check_rate_limit(await self.client.send(request))
+
+        key = str(request.url)
+        cached = self._etag_cache.get(key)
+        if cached:
+            if cached["etag"]:
+                request.headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                request.headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self._check_rate_limit(await self.client.send(request))
+
+        if response.status_code == 304 and cached:
+            self.cache_hits += 1
+            if stats:
+                stats.not_modified += 1
+            self._etag_cache.move_to_end(key)
+            headers = {"Content-Type": "application/json"}
+            if cached["link"]:
+                headers["Link"] = cached["link"]
+            return httpx.Response(200, content=cached["body"].encode(), headers=headers, request=request)
+
+        self.cache_misses += 1
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            self._etag_cache[key] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": response.text,
+                "link": response.headers.get("Link"),
+            }
+            self._etag_cache.move_to_end(key)
+            while len(self._etag_cache) > settings.github_cache_max_entries:
+                self._etag_cache.popitem(last=False)
+
+        return response
+
+    def _check_rate_limit(self, response: httpx.Response) -> httpx.Response:
+        """Record quota headers; raise RateLimitExceeded if GitHub rejected the request."""
+        if self.rate_limiter.update(response):
+            raise RateLimitExceeded(self.rate_limiter.paused_until)
+        return response
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, raising GitHubAPIError on error responses."""
+        response = await self._send(method, url, **kwargs)
+        if response.is_error:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise GitHubAPIError(response.status_code, message)
+        return response
+
+    async def _get_paginated(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """GET every page of a list endpoint (or until ``limit`` items) by following Link headers."""
+        items = []
+        response = await self._request("GET", url, params={"per_page": 100, **(params or {})})
+        items.extend(response.json())
+        while "next" in response.links and (limit is None or len(items) < limit):
+            response = await self._request("GET", response.links["next"]["url"])
+            items.extend(response.json())
+        return items[:limit]
+
+    async def get_pr_diff(self, repo: str, pr_number: int) -> tuple[str, dict]:
         """
         Fetch the diff for a pull request.
 
         Returns:
             tuple: (diff_text, pr_info)
         """
+        files, pr_info = await self.get_pr_files(repo, pr_number)
+        return render_diff(files), pr_info
+
+    async def get_pr_files(self, repo: str, pr_number: int) -> tuple[List[FileDiff], dict]:
+        """
+        Fetch the per-file diffs for a pull request.
+
+        Returns:
+            tuple: (files, pr_info)
+        """
+        context, error = await self.get_pr_context(repo, pr_number)
+        if error:
+            return [], {"error": error}
+        return context.files, context.pr_info()
+
+    async def get_pr_context(self, repo: str, pr_number: int) -> tuple[Optional[PRContext], Optional[str]]:
+        """
+        Fetch everything one analysis run needs about a PR (metadata, head
+        commit, files) in one go, to be reused by every later operation.
+        Transient failures raise GitHubUnavailable so the caller can retry.
+
+        Returns:
+            tuple: (context, error_message)
+        """
         if not self.client:
-            return "", {"error": "GitHub token not configured"}
+            return None, "GitHub token not configured"
 
         try:
-            repository = self.client.get_repo(repo)
-            pr = repository.get_pull(pr_number)
-
-            # Get the diff
-            files = pr.get_files()
-            diff_parts = []
-
-            for file in files:
-                diff_parts.append(f"--- {file.filename}")
-                diff_parts.append(f"+++ {file.filename}")
-                if file.patch:
-                    diff_parts.append(file.patch)
-                diff_parts.append("")
-
-            diff_text = "\n".join(diff_parts)
-
-            pr_info = {
-                "title": pr.title,
-                "author": pr.user.login,
-                "url": pr.html_url,
-                "additions": pr.additions,
-                "deletions": pr.deletions,
-                "changed_files": pr.changed_files,
-            }
+            pr = (await self._request("GET", f"/repos/{repo}/pulls/{pr_number}")).json()
+            files = [
+                self._file_diff(file)
+                for file in await self._get_paginated(f"/repos/{repo}/pulls/{pr_number}/files")
+            ]
+
+            context = PRContext(
+                repo=repo,
+                pr_number=pr_number,
+                title=pr["title"],
+                author=pr["user"]["login"],
+                url=pr["html_url"],
+                head_sha=pr["head"]["sha"],
+                base_sha=pr["base"]["sha"],
+                additions=pr.get("additions", 0),
+                deletions=pr.get("deletions", 0),
+                changed_files=pr.get("changed_files", 0),
+                files=files,
+            )
+            return context, None
 
-            return diff_text, pr_info
+        except RateLimitExceeded:
+            # Not a PR error: let the caller defer the analysis until the quota resets
+            raise
+        except (GitHubAPIError, httpx.HTTPError) as e:
+            print(f"GitHub API error: {e}")
+            if is_transient(e):
+                raise GitHubUnavailable(str(e) or type(e).__name__) from e
+            return None, str(e)
 
-        except GithubException as e:
+    async def list_pull_numbers(self, repo: str, limit: int, state: str = "all") -> tuple[List[int], Optional[str]]:
+        """
+        List the repo's most recently created PRs, newest first.
+
+        Returns:
+            tuple: (pr_numbers, error_message)
+        """
+        if not self.client:
+            return [], "GitHub token not configured"
+
+        try:
+            pulls = await self._get_paginated(
+                f"/repos/{repo}/pulls",
+                params={"state": state, "sort": "created", "direction": "desc"},
+                limit=limit,
+            )
+            return [pull["number"] for pull in pulls], None
+
+        except RateLimitExceeded:
+            raise
+        except (GitHubAPIError, httpx.HTTPError) as e:
             print(f"GitHub API error: {e}")
-            return "", {"error": str(e)}
+            return [], str(e)
+
+    async def get_compare_files(self, repo: str, base_sha: str, head_sha: str) -> tuple[List[FileDiff], dict]:
+        """
+        Fetch the per-file diffs between two commits.
+
+        Returns:
+            tuple: (files, compare_info) where compare_info["status"] is
+            GitHub's ahead/behind/diverged/identical
+        """
+        if not self.client:
+            return [], {"error": "GitHub token not configured"}
 
-    def post_review_comment(
+        try:
+            comparison = (await self._request("GET", f"/repos/{repo}/compare/{base_sha}...{head_sha}")).json()
+            files = [self._file_diff(file) for file in comparison.get("files", [])]
+            return files, {"status": comparison["status"]}
+
+        except RateLimitExceeded:
+            # Not a PR error: let the caller defer the analysis until the quota resets
+            raise
+        except (GitHubAPIError, httpx.HTTPError) as e:
+            print(f"GitHub API error: {e}")
+            return [], {"error": str(e)}
+
+    def _file_diff(self, file: Dict[str, Any]) -> FileDiff:
+        return FileDiff(
+            filename=file["filename"],
+            status=file.get("status"),
+            patch=file.get("patch"),
+            additions=file.get("additions", 0),
+            deletions=file.get("deletions", 0),
+        )
+
+    async def post_review_comment(
         self,
         repo: str,
         pr_number: int,
         body: str,
-        commit_sha: Optional[str] = None
+        commit_sha: Optional[str] = None,
+        comments: Optional[List[Dict[str, Any]]] = None
     ) -> Optional[str]:
         """
-        Post a review comment on a PR.
+        Post a review on a PR: the summary body plus any inline comments, in
+        a single request.
 
         Returns:
-            Comment ID if successful, None otherwise
+            Review ID if successful, None otherwise
         """
         if not self.client:
             return None
 
-        try:
-            repository = self.client.get_repo(repo)
-            pr = repository.get_pull(pr_number)
-
-            # Create a review with a summary comment
-            review = pr.create_review(body=body, event="COMMENT")
-            return str(review.id)
+        url = f"/repos/{repo}/pulls/{pr_number}/reviews"
+        payload = {"body": body, "event": "COMMENT"}
+        if commit_sha:
+            payload["commit_id"] = commit_sha
+        if comments:
+            payload["comments"] = comments
 
-        except GithubException as e:
+        try:
+            try:
+                review = await self._request("POST", url, json=payload)
+            except GitHubAPIError as e:
+                if e.status_code != 422 or not comments:
+                    raise
+                # A comment GitHub can't place (e.g. the PR moved on) rejects
+                # the whole review; publish the summary on its own instead
+                print(f"Inline comments rejected, posting summary only: {e}")
+                payload.pop("comments")
+                review = await self._request("POST", url, json=payload)
+            return str(review.json()["id"])
+
+        except (GitHubAPIError, httpx.HTTPError) as e:
             print(f"Error posting review: {e}")
             return None
 
-    def post_inline_comment(
+    async def post_inline_comment(
         self,
         repo: str,
         pr_number: int,
@@ -103,33 +392,92 @@ class GitHubService:
             return None
 
         try:
-            repository = self.client.get_repo(repo)
-            pr = repository.get_pull(pr_number)
-
-            # Get the latest commit
-            commit = repository.get_commit(commit_sha)
-
-            comment = pr.create_review_comment(
-                body=body,
-                commit=commit,
-                path=file_path,
-                line=line,
+            comment = await self._request(
+                "POST",
+                f"/repos/{repo}/pulls/{pr_number}/comments",
+                json={
+                    "body": body,
+                    "commit_id": commit_sha,
+                    "path": file_path,
+                    "line": line,
+                    "side": "RIGHT",
+                },
             )
-            return str(comment.id)
+            return str(comment.json()["id"])
 
-        except GithubException as e:
+        except (GitHubAPIError, httpx.HTTPError) as e:
             print(f"Error posting inline comment: {e}")
             return None
 
-    def format_review_comment(self, issues: List[IssueResponse], summary: str = None) -> str:
-        """Format issues into a GitHub review comment."""
+    def build_inline_comments(
+        self,
+        issues: List[IssueResponse],
+        files: List[FileDiff],
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Pick the most severe issues that sit on lines of the diff and format
+        them as review comments for ``post_review_comment``.
+
+        Returns:
+            Up to ``limit`` (default: max_inline_comments) comment payloads
+        """
+        limit = settings.max_inline_comments if limit is None else limit
+        lines = {file.filename: commentable_lines(file.patch) for file in files if file.patch}
+
+        placeable = [
+            issue for issue in issues
+            if issue.line_number and issue.line_number in lines.get(issue.file_path, ())
+        ]
+        placeable.sort(key=lambda issue: (
+            SEVERITY_ORDER.get(issue.severity.value, len(SEVERITY_ORDER)),
+            issue.file_path,
+            issue.line_number,
+        ))
+
+        return [
+            {
+                "path": issue.file_path,
+                "line": issue.line_number,
+                "side": "RIGHT",
+                "body": self._format_inline_comment(issue),
+            }
+            for issue in placeable[:limit]
+        ]
+
+    def _format_inline_comment(self, issue: IssueResponse) -> str:
+        """Format a single issue as an inline review comment."""
+        icon = {"critical": "🔴", "warning": "⚠️"}.get(issue.severity.value, "💡")
+        lines = [f"{icon} **{issue.title}**", "", issue.message]
+
+        if issue.explanation:
+            lines.append(f"\n*Why:* {issue.explanation}")
+
+        if issue.suggestion:
+            lines.append(f"\n*Fix:* {issue.suggestion}")
+
+        return "\n".join(lines)
+
+    def format_review_comment(self, issues: List[IssueResponse], summary: str = None, complete: bool = True) -> str:
+        """
+        Format issues into a GitHub review comment. An incomplete review (part
+        of the PR went unreviewed) says so instead of reporting a clean PR.
+        """
         lines = ["## 🤖 CodeGuard Review\n"]
+        if not complete:
+            lines.append("⚠️ **Partial review:** part of this PR could not be reviewed, "
+                         "so some issues may be missing.\n")
 
         # Summary
         critical = sum(1 for i in issues if i.severity.value == "critical")
         warnings = sum(1 for i in issues if i.severity.value == "warning")
         suggestions = sum(1 for i in issues if i.severity.value == "suggestion")
 
+        if not issues and not complete:
+            if summary:
+                lines.append(f"*{summary}*\n")
+            return "\n".join(lines)
+
         if not issues:
             lines.append("✅ **No issues found!** Great job!\n")
             if summary:
@@ -145,6 +493,8 @@ class GitHubService:
         if suggestions:
             parts.append(f"💡 {suggestions} suggestions")
         lines.append(f" • {' • '.join(parts)}\n")
+        if summary:
+            lines.append(f"*{summary}*\n")
 
         # Group issues by severity
         if critical:
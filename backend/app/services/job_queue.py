@@ -0,0 +1,448 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Union
+
+from sqlalchemy import func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models.database import AsyncSessionLocal, run_in_session, AnalysisJob, PRAnalysis
+from .event_bus import get_event_bus
+
+settings = get_settings()
+
+# Handler signature: (analysis_id, repo, pr_number, db)
+JobHandler = Callable[[str, str, int, Union[Session, AsyncSession]], Awaitable[None]]
+
+# A running job's lease is renewed this many times per visibility timeout
+LEASE_RENEWALS_PER_TIMEOUT = 3
+
+
+class DeferJob(Exception):
+    """
+    Raised by a handler to put its job back on the queue until ``retry_at``
+    without using up an attempt, e.g. while an upstream quota is exhausted.
+    With ``pause_queue`` the workers stop claiming any job until then.
+    """
+
+    def __init__(self, retry_at: datetime, reason: str = "Deferred", pause_queue: bool = False):
+        super().__init__(reason)
+        self.retry_at = retry_at
+        self.pause_queue = pause_queue
+
+
+class JobQueue:
+    """
+    Durable, DB-backed queue of PR analysis jobs.
+
+    Jobs survive restarts: a job that was running when its worker died becomes
+    claimable again once its visibility timeout (lease) expires; the worker
+    renews the lease while the job runs, so a slow analysis is not picked up
+    twice. Failed jobs (including ones whose worker kept dying) are retried
+    with exponential backoff up to ``max_attempts``. A newer push to a PR can
+    supersede its queued and in-flight jobs.
+
+    ``session_factory`` may make sync or async sessions; the bookkeeping
+    methods take a sync session and are run through ``run_in_session``.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+        # Handler tasks of jobs run by this process, for superseding in-flight runs
+        self._running: Dict[str, asyncio.Task] = {}
+        self._superseded: Set[str] = set()
+        # Set when a handler defers with pause_queue; no job is claimed before then
+        self.paused_until: Optional[datetime] = None
+
+    def enqueue(
+        self,
+        db: Session,
+        analysis: PRAnalysis,
+        delay: float = 0,
+        supersede: bool = False
+    ) -> AnalysisJob:
+        """
+        Queue an analysis and commit it together with any pending changes.
+
+        Args:
+            delay: Seconds before the job becomes claimable (debounce window).
+            supersede: Cancel queued and in-flight analyses of the same PR so
+                only this, the latest, one is analyzed and published.
+        """
+        superseded, superseded_analyses = self._supersede_older(db, analysis) if supersede else ([], [])
+
+        job = AnalysisJob(
+            analysis_id=analysis.id,
+            repo=analysis.repo,
+            pr_number=analysis.pr_number,
+            max_attempts=settings.job_max_attempts,
+            available_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        db.add(job)
+        analysis_id, status = analysis.id, analysis.status or "pending"
+        db.commit()
+
+        events = get_event_bus()
+        events.publish_status(analysis_id, status)
+        for older_id in superseded_analyses:
+            events.publish_status(older_id, "superseded", f"Superseded by analysis {analysis_id}")
+
+        for job_id in superseded:
+            task = self._running.get(job_id)
+            if task:
+                self._superseded.add(job_id)
+                task.cancel()
+
+        return job
+
+    def _supersede_older(self, db: Session, analysis: PRAnalysis) -> tuple[List[str], List[str]]:
+        """
+        Mark earlier unfinished jobs for the same PR as superseded.
+
+        Returns:
+            tuple: (IDs of the superseded jobs that were running, IDs of the
+            analyses that were superseded)
+        """
+        older = (
+            db.query(AnalysisJob)
+            .filter(
+                AnalysisJob.repo == analysis.repo,
+                AnalysisJob.pr_number == analysis.pr_number,
+                AnalysisJob.status.in_(["queued", "running"]),
+                AnalysisJob.analysis_id != analysis.id,
+            )
+            .all()
+        )
+
+        now = datetime.utcnow()
+        running = []
+        analyses = []
+        for job in older:
+            if job.status == "running":
+                running.append(job.id)
+            job.status = "superseded"
+            job.leased_until = None
+            job.finished_at = now
+            updated = db.query(PRAnalysis).filter(
+                PRAnalysis.id == job.analysis_id,
+                PRAnalysis.status.in_(["pending", "processing"]),
+            ).update(
+                {PRAnalysis.status: "superseded", PRAnalysis.error_message: f"Superseded by analysis {analysis.id}"},
+                synchronize_session=False,
+            )
+            if updated:
+                analyses.append(job.analysis_id)
+
+        return running, analyses
+
+    def claim(self, db: Session, worker_id: str) -> Optional[AnalysisJob]:
+        """
+        Lease the oldest runnable job.
+
+        Returns:
+            The claimed job, or None if nothing is runnable.
+        """
+        now = datetime.utcnow()
+        self._fail_abandoned(db, now)
+        runnable = or_(
+            and_(AnalysisJob.status == "queued", AnalysisJob.available_at <= now),
+            and_(
+                AnalysisJob.status == "running",
+                AnalysisJob.leased_until < now,
+                AnalysisJob.attempts < AnalysisJob.max_attempts,
+            ),
+        )
+
+        candidates = (
+            db.query(AnalysisJob.id)
+            .filter(runnable)
+            .order_by(AnalysisJob.available_at)
+            .limit(5)
+            .all()
+        )
+        for (job_id,) in candidates:
+            # Conditional update so two workers can't lease the same job
+            claimed = (
+                db.query(AnalysisJob)
+                .filter(AnalysisJob.id == job_id, runnable)
+                .update(
+                    {
+                        AnalysisJob.status: "running",
+                        AnalysisJob.attempts: AnalysisJob.attempts + 1,
+                        AnalysisJob.worker_id: worker_id,
+                        AnalysisJob.started_at: now,
+                        AnalysisJob.leased_until: now + timedelta(seconds=settings.job_visibility_timeout),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if claimed:
+                return db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+
+        return None
+
+    def _fail_abandoned(self, db: Session, now: datetime):
+        """Give up on jobs whose lease expired on their last attempt, e.g. because they crash the worker."""
+        abandoned = (
+            db.query(AnalysisJob.id, AnalysisJob.analysis_id)
+            .filter(
+                AnalysisJob.status == "running",
+                AnalysisJob.leased_until < now,
+                AnalysisJob.attempts >= AnalysisJob.max_attempts,
+            )
+            .all()
+        )
+        if not abandoned:
+            return
+
+        error = "Worker stopped responding on the last attempt"
+        db.query(AnalysisJob).filter(
+            AnalysisJob.id.in_([job_id for job_id, _ in abandoned]),
+            AnalysisJob.status == "running",
+            AnalysisJob.leased_until < now,
+        ).update(
+            {
+                AnalysisJob.status: "failed",
+                AnalysisJob.last_error: error,
+                AnalysisJob.leased_until: None,
+                AnalysisJob.finished_at: now,
+            },
+            synchronize_session=False,
+        )
+        db.query(PRAnalysis).filter(
+            PRAnalysis.id.in_([analysis_id for _, analysis_id in abandoned]),
+            PRAnalysis.status.in_(["pending", "processing"]),
+        ).update(
+            {PRAnalysis.status: "failed", PRAnalysis.error_message: error},
+            synchronize_session=False,
+        )
+        db.commit()
+        for _, analysis_id in abandoned:
+            get_event_bus().publish_status(analysis_id, "failed", error)
+
+    def renew_lease(self, db: Session, job_id: str, worker_id: str) -> bool:
+        """
+        Extend a running job's lease.
+
+        Returns:
+            False if the worker no longer holds the job (e.g. it was superseded).
+        """
+        renewed = (
+            db.query(AnalysisJob)
+            .filter(
+                AnalysisJob.id == job_id,
+                AnalysisJob.status == "running",
+                AnalysisJob.worker_id == worker_id,
+            )
+            .update(
+                {AnalysisJob.leased_until: datetime.utcnow() + timedelta(seconds=settings.job_visibility_timeout)},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return bool(renewed)
+
+    async def _keep_leased(self, job_id: str, worker_id: str):
+        """Renew a job's lease while its handler runs, in a session of its own."""
+        while True:
+            await asyncio.sleep(settings.job_visibility_timeout / LEASE_RENEWALS_PER_TIMEOUT)
+            db = self.session_factory()
+            try:
+                if not await run_in_session(db, self.renew_lease, job_id, worker_id):
+                    return
+            except Exception as e:
+                print(f"Job {job_id}: could not renew lease: {e}")
+            finally:
+                await run_in_session(db, Session.close)
+
+    def complete(self, db: Session, job: AnalysisJob):
+        """Mark a job as done."""
+        db.refresh(job)
+        if job.status == "superseded":
+            return
+        job.status = "done"
+        job.leased_until = None
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+    def fail(self, db: Session, job: AnalysisJob, error: str):
+        """
+        Record a failure and either schedule a retry (the analysis goes back to
+        pending) or give up and mark the analysis failed.
+        """
+        db.rollback()
+        if job.status == "superseded":
+            return
+        job.last_error = error
+        job.leased_until = None
+        analysis = db.query(PRAnalysis).filter(PRAnalysis.id == job.analysis_id).first()
+
+        if job.attempts < job.max_attempts:
+            backoff = settings.job_retry_backoff * (2 ** (job.attempts - 1))
+            job.status = "queued"
+            job.available_at = datetime.utcnow() + timedelta(seconds=backoff)
+            if analysis:
+                analysis.status = "pending"
+        else:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+            if analysis:
+                analysis.status = "failed"
+                analysis.error_message = error
+
+        status = analysis.status if analysis else None
+        db.commit()
+        if status:
+            get_event_bus().publish_status(job.analysis_id, status, error if status == "failed" else None)
+
+    def release(self, db: Session, job: AnalysisJob):
+        """Put an interrupted job back on the queue without using up an attempt."""
+        db.rollback()
+        job.status = "queued"
+        job.attempts = max(job.attempts - 1, 0)
+        job.leased_until = None
+        job.worker_id = None
+        job.available_at = datetime.utcnow()
+        analysis = db.query(PRAnalysis).filter(PRAnalysis.id == job.analysis_id).first()
+        if analysis:
+            analysis.status = "pending"
+        db.commit()
+
+    def defer(self, db: Session, job: AnalysisJob, retry_at: datetime, reason: str):
+        """Requeue a job for ``retry_at`` without using up an attempt."""
+        db.rollback()
+        if job.status == "superseded":
+            return
+        job.status = "queued"
+        job.attempts = max(job.attempts - 1, 0)
+        job.last_error = reason
+        job.leased_until = None
+        job.worker_id = None
+        job.available_at = retry_at
+        analysis = db.query(PRAnalysis).filter(PRAnalysis.id == job.analysis_id).first()
+        if analysis and analysis.status == "processing":
+            analysis.status = "pending"
+        db.commit()
+
+    def is_paused(self) -> bool:
+        return bool(self.paused_until and self.paused_until > datetime.utcnow())
+
+    def stats(self, db: Session) -> dict:
+        """Queue depth by status and age of the oldest waiting/running jobs."""
+        now = datetime.utcnow()
+        counts = dict(
+            db.query(AnalysisJob.status, func.count(AnalysisJob.id))
+            .group_by(AnalysisJob.status)
+            .all()
+        )
+        oldest_queued = (
+            db.query(func.min(AnalysisJob.created_at))
+            .filter(AnalysisJob.status == "queued")
+            .scalar()
+        )
+        oldest_running = (
+            db.query(func.min(AnalysisJob.started_at))
+            .filter(AnalysisJob.status == "running")
+            .scalar()
+        )
+
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "superseded": counts.get("superseded", 0),
+            "oldest_queued_age_seconds": (now - oldest_queued).total_seconds() if oldest_queued else None,
+            "oldest_running_age_seconds": (now - oldest_running).total_seconds() if oldest_running else None,
+            "workers": len(self._workers),
+            "paused_until": self.paused_until if self.is_paused() else None,
+        }
+
+    async def run_next(self, handler: JobHandler, worker_id: str) -> bool:
+        """
+        Claim and run a single job.
+
+        Returns:
+            True if a job was run, False if the queue was empty.
+        """
+        if self.is_paused():
+            return False
+
+        db = self.session_factory()
+        try:
+            job = await run_in_session(db, self.claim, worker_id)
+            if not job:
+                return False
+
+            # Handlers may roll back, expiring ``job``; its attributes can't
+            # be lazy-loaded outside run_in_session on an async session
+            job_id, attempt, max_attempts = job.id, job.attempts, job.max_attempts
+            task = asyncio.create_task(handler(job.analysis_id, job.repo, job.pr_number, db))
+            self._running[job_id] = task
+            lease = asyncio.create_task(self._keep_leased(job_id, worker_id))
+            try:
+                await task
+            except asyncio.CancelledError:
+                if job_id in self._superseded and task.cancelled():
+                    # A newer push for this PR arrived; the job is already marked superseded
+                    print(f"Job {job_id} superseded by a newer push")
+                    await run_in_session(db, Session.rollback)
+                    return True
+                await run_in_session(db, self.release, job)
+                raise
+            except DeferJob as e:
+                print(f"Job {job_id} deferred until {e.retry_at}: {e}")
+                await run_in_session(db, self.defer, job, e.retry_at, str(e))
+                if e.pause_queue and (not self.paused_until or e.retry_at > self.paused_until):
+                    self.paused_until = e.retry_at
+            except Exception as e:
+                print(f"Job {job_id} failed (attempt {attempt}/{max_attempts}): {e}")
+                await run_in_session(db, self.fail, job, str(e))
+            else:
+                await run_in_session(db, self.complete, job)
+            finally:
+                lease.cancel()
+                await asyncio.gather(lease, return_exceptions=True)
+                self._running.pop(job_id, None)
+                self._superseded.discard(job_id)
+            return True
+        finally:
+            await run_in_session(db, Session.close)
+
+    async def _worker(self, handler: JobHandler, worker_id: str):
+        while not self._stopping:
+            try:
+                ran = await self.run_next(handler, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Worker {worker_id} error: {e}")
+                ran = False
+            if not ran:
+                await asyncio.sleep(settings.job_poll_interval)
+
+    def start(self, handler: JobHandler, workers: int):
+        """Start the async worker pool on the running loop."""
+        self._stopping = False
+        for i in range(workers):
+            self._workers.append(asyncio.create_task(self._worker(handler, f"worker-{i}")))
+
+    async def stop(self):
+        """Stop workers; interrupted jobs are released back to the queue."""
+        self._stopping = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+# Singleton instance
+job_queue = JobQueue()
+
+
+def get_job_queue() -> JobQueue:
+    return job_queue
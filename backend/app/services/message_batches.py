@@ -0,0 +1,98 @@
+import json
+from typing import Any, Dict, List
+
+import httpx
+
+from ..config import get_settings
+
+settings = get_settings()
+
+ANTHROPIC_VERSION = "2023-06-01"
+
+
+class MessageBatchError(Exception):
+    """Non-2xx response from the Message Batches API."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class MessageBatchClient:
+    """
+    Client for Anthropic's Message Batches API.
+
+    A batch of Messages API requests is processed asynchronously (usually
+    within an hour, at most 24) at half the price of synchronous calls and
+    outside their rate limits. The pinned SDK predates batches, so this talks
+    to the REST endpoints directly.
+    """
+
+    def __init__(self):
+        self.client = None
+        if settings.anthropic_api_key:
+            self.client = httpx.AsyncClient(
+                base_url=settings.anthropic_api_url,
+                headers={
+                    "x-api-key": settings.anthropic_api_key,
+                    "anthropic-version": ANTHROPIC_VERSION,
+                },
+                timeout=settings.analysis_timeout,
+            )
+
+    async def close(self):
+        """Release pooled connections."""
+        if self.client:
+            await self.client.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, raising MessageBatchError on error responses."""
+        if not self.client:
+            raise MessageBatchError(0, "API key not configured")
+
+        response = await self.client.request(method, url, **kwargs)
+        if response.is_error:
+            try:
+                message = response.json()["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise MessageBatchError(response.status_code, message)
+        return response
+
+    async def create(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Submit a batch of ``{"custom_id": ..., "params": {...}}`` requests.
+
+        Returns:
+            The batch, with its ``id`` and ``processing_status``.
+        """
+        return (await self._request("POST", "/v1/messages/batches", json={"requests": requests})).json()
+
+    async def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        """
+        Returns:
+            The batch; ``processing_status`` is "ended" once every request has
+            a result at ``results_url``.
+        """
+        return (await self._request("GET", f"/v1/messages/batches/{batch_id}")).json()
+
+    async def results(self, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Download an ended batch's results.
+
+        Returns:
+            One ``{"custom_id": ..., "result": {"type": ...}}`` per request, in
+            no particular order. ``type`` is succeeded (with ``message``),
+            errored, canceled or expired.
+        """
+        response = await self._request("GET", batch["results_url"])
+        return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+# Singleton instance
+message_batch_client = MessageBatchClient()
+
+
+def get_message_batch_client() -> MessageBatchClient:
+    return message_batch_client
@@ -0,0 +1,224 @@
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.database import PRAnalysis, Issue, MetricsDaily, MetricsDailyIssue
+
+CATEGORIES = ["security", "quality", "testing", "docs", "performance"]
+SEVERITIES = ["critical", "warning", "suggestion"]
+# Primary key of metrics_daily_issues
+TITLE_KEY = ["repo", "date", "title", "category", "severity"]
+
+
+def _as_date(value) -> date:
+    # func.date() returns a string on SQLite and a date on PostgreSQL
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _empty_day(repo: str, day: date) -> MetricsDaily:
+    counts = {f"{name}_count": 0 for name in SEVERITIES + CATEGORIES}
+    return MetricsDaily(
+        repo=repo, date=day, prs_analyzed=0, issues_found=0,
+        tokens_used=0, analysis_time_ms=0, **counts,
+    )
+
+
+class MetricsRollup:
+    """
+    Maintains the ``metrics_daily`` rollups the dashboard reads, so metrics
+    cost the same no matter how much analysis history is kept.
+    """
+
+    def record_completion(self, db: Session, analysis: PRAnalysis, issues: List[Issue]) -> bool:
+        """
+        Mark an analysis completed and add it to the rollup, if it is still
+        processing: one that was already completed (e.g. by an earlier run of
+        a retried job) is never counted twice, and one that was superseded or
+        failed meanwhile stays that way. Does not commit.
+
+        Returns:
+            Whether the analysis was newly completed.
+        """
+        moved = db.execute(
+            update(PRAnalysis)
+            .where(PRAnalysis.id == analysis.id, PRAnalysis.status == "processing")
+            .values(status="completed")
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if moved:
+            analysis.status = "completed"
+            self.record_analysis(db, analysis, issues)
+        return bool(moved)
+
+    def record_analysis(self, db: Session, analysis: PRAnalysis, issues: List[Issue]):
+        """
+        Add a completed analysis to its day's rollup.
+
+        Does not commit: call it before the commit that marks the analysis
+        completed, so the rollup changes in the same transaction.
+        """
+        key = {
+            "repo": analysis.repo,
+            "date": (analysis.analyzed_at or datetime.utcnow()).date(),
+        }
+
+        counts = Counter({
+            "prs_analyzed": 1,
+            "issues_found": len(issues),
+            "tokens_used": analysis.tokens_used or 0,
+            "analysis_time_ms": analysis.analysis_time_ms or 0,
+        })
+        for issue in issues:
+            if issue.severity in SEVERITIES:
+                counts[f"{issue.severity}_count"] += 1
+            if issue.category in CATEGORIES:
+                counts[f"{issue.category}_count"] += 1
+        self._increment(db, MetricsDaily, key, counts)
+
+        titles = Counter((issue.title, issue.category, issue.severity) for issue in issues)
+        if titles:
+            self._increment_titles(db, key, titles)
+
+    def _increment(self, db: Session, model, key: dict, counts: Dict[str, int]):
+        """Add ``counts`` to the row identified by ``key``, creating it if needed."""
+        values = {getattr(model, name): getattr(model, name) + count for name, count in counts.items()}
+        if db.query(model).filter_by(**key).update(values, synchronize_session=False):
+            return
+
+        try:
+            with db.begin_nested():
+                row = _empty_day(key["repo"], key["date"]) if model is MetricsDaily else model(**key)
+                for name, count in counts.items():
+                    setattr(row, name, count)
+                db.add(row)
+        except IntegrityError:
+            # Another worker created the row first
+            db.query(model).filter_by(**key).update(values, synchronize_session=False)
+
+    def _increment_titles(self, db: Session, key: dict, titles: Counter):
+        """
+        Add per-title counts for one repo-day in a fixed number of round trips
+        (one select, one executemany update, one multi-row insert), however
+        many distinct titles an analysis found.
+        """
+        table = MetricsDailyIssue.__table__
+        existing = set(
+            db.query(MetricsDailyIssue.title, MetricsDailyIssue.category, MetricsDailyIssue.severity)
+            .filter_by(**key)
+            .all()
+        )
+        rows = [
+            {**key, "title": title, "category": category, "severity": severity, "count": count}
+            for (title, category, severity), count in titles.items()
+        ]
+
+        updates = [row for row in rows if (row["title"], row["category"], row["severity"]) in existing]
+        if updates:
+            db.execute(
+                update(table)
+                .where(*[table.c[name] == bindparam(f"key_{name}") for name in TITLE_KEY])
+                .values(count=table.c["count"] + bindparam("increment")),
+                [{**{f"key_{name}": row[name] for name in TITLE_KEY}, "increment": row["count"]} for row in updates],
+            )
+
+        inserts = [row for row in rows if row not in updates]
+        if not inserts:
+            return
+        try:
+            with db.begin_nested():
+                db.execute(insert(MetricsDailyIssue), inserts)
+        except IntegrityError:
+            # Another worker added some of these titles first
+            for row in inserts:
+                self._increment(db, MetricsDailyIssue, {name: row[name] for name in TITLE_KEY}, {"count": row["count"]})
+
+    def rebuild(self, db: Session, repo: Optional[str] = None) -> int:
+        """
+        Recompute the rollups from the analyses and issues tables.
+
+        Returns:
+            Number of (repo, day) rows written.
+        """
+        for model in (MetricsDaily, MetricsDailyIssue):
+            query = db.query(model)
+            if repo:
+                query = query.filter(model.repo == repo)
+            query.delete(synchronize_session=False)
+
+        filters = [PRAnalysis.status == "completed"]
+        if repo:
+            filters.append(PRAnalysis.repo == repo)
+        day = func.date(PRAnalysis.analyzed_at)
+
+        days = {}
+        analyses = (
+            db.query(
+                PRAnalysis.repo,
+                day,
+                func.count(PRAnalysis.id),
+                func.coalesce(func.sum(PRAnalysis.tokens_used), 0),
+                func.coalesce(func.sum(PRAnalysis.analysis_time_ms), 0),
+            )
+            .filter(*filters)
+            .group_by(PRAnalysis.repo, day)
+            .all()
+        )
+        for analysis_repo, analysis_day, prs, tokens, time_ms in analyses:
+            row = _empty_day(analysis_repo, _as_date(analysis_day))
+            row.prs_analyzed = prs
+            row.tokens_used = tokens
+            row.analysis_time_ms = time_ms
+            days[(analysis_repo, row.date)] = row
+
+        issues = (
+            db.query(PRAnalysis.repo, day, Issue.title, Issue.category, Issue.severity, func.count(Issue.id))
+            .join(Issue.analysis)
+            .filter(*filters)
+            .group_by(PRAnalysis.repo, day, Issue.title, Issue.category, Issue.severity)
+            .all()
+        )
+        title_rows = []
+        for issue_repo, issue_day, title, category, severity, count in issues:
+            row = days[(issue_repo, _as_date(issue_day))]
+            row.issues_found += count
+            if severity in SEVERITIES:
+                setattr(row, f"{severity}_count", getattr(row, f"{severity}_count") + count)
+            if category in CATEGORIES:
+                setattr(row, f"{category}_count", getattr(row, f"{category}_count") + count)
+            title_rows.append({
+                "repo": issue_repo, "date": row.date, "title": title,
+                "category": category, "severity": severity, "count": count,
+            })
+
+        db.add_all(days.values())
+        if title_rows:
+            db.execute(insert(MetricsDailyIssue), title_rows)
+        db.commit()
+        return len(days)
+
+    def ensure_built(self, db: Session) -> bool:
+        """
+        Build the rollups for a database that has analyses but no rollup yet
+        (e.g. the first start after upgrading).
+
+        Returns:
+            True if a rebuild was needed.
+        """
+        if db.query(MetricsDaily.repo).first():
+            return False
+        if not db.query(PRAnalysis.id).filter(PRAnalysis.status == "completed").first():
+            return False
+        self.rebuild(db)
+        return True
+
+
+# Singleton instance
+metrics_rollup = MetricsRollup()
+
+
+def get_metrics_rollup() -> MetricsRollup:
+    return metrics_rollup
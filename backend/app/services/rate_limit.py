@@ -0,0 +1,123 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+
+from ..config import get_settings
+
+settings = get_settings()
+
+
+class RateLimitExceeded(Exception):
+    """GitHub quota is exhausted until ``retry_at`` (epoch seconds)."""
+
+    def __init__(self, retry_at: float, message: str = "GitHub rate limit exceeded"):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class GitHubRateLimiter:
+    """
+    Token bucket shared by every GitHub request, kept in step with GitHub's
+    own quota headers.
+
+    The refill rate is the configured rate, slowed down to spread whatever is
+    left of the hourly quota over the time until it resets. When the quota is
+    exhausted (or GitHub asks us to back off with Retry-After) requests wait
+    for short pauses and raise RateLimitExceeded for long ones, so callers can
+    park the work instead of failing it.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None):
+        self.rate = rate or settings.github_requests_per_second
+        self.burst = burst or settings.github_burst
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+
+        # Latest quota reported by GitHub
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.used: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.paused_until: Optional[float] = None
+
+        self.throttled = 0  # Requests that had to wait for a token
+        self.rejected = 0  # Requests refused because the pause was too long
+
+    def current_rate(self) -> float:
+        """Refill rate, capped so the remaining quota lasts until it resets."""
+        now = time.time()
+        if self.remaining is not None and self.reset_at and self.reset_at > now:
+            return max(min(self.rate, self.remaining / (self.reset_at - now)), 0.01)
+        return self.rate
+
+    async def acquire(self):
+        """Wait for a request slot, or raise RateLimitExceeded if GitHub is paused for too long."""
+        while True:
+            now = time.time()
+            if self.paused_until and self.paused_until > now:
+                wait = self.paused_until - now
+                if wait > settings.github_rate_limit_max_wait:
+                    self.rejected += 1
+                    raise RateLimitExceeded(self.paused_until)
+                self.throttled += 1
+                await asyncio.sleep(wait)
+                continue
+
+            rate = self.current_rate()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            self.throttled += 1
+            await asyncio.sleep((1 - self.tokens) / rate)
+
+    def update(self, response: httpx.Response) -> bool:
+        """
+        Record quota headers from a GitHub response.
+
+        Returns:
+            True if the response is a primary or secondary rate-limit rejection.
+        """
+        headers = response.headers
+        now = time.time()
+
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+            self.limit = int(headers.get("X-RateLimit-Limit", self.limit or 0))
+            self.used = int(headers.get("X-RateLimit-Used", self.used or 0))
+            if "X-RateLimit-Reset" in headers:
+                self.reset_at = float(headers["X-RateLimit-Reset"])
+            if self.remaining == 0 and self.reset_at:
+                # Quota used up: hold further requests until it resets
+                self.paused_until = self.reset_at
+
+        if response.status_code not in (403, 429):
+            return False
+
+        if "Retry-After" in headers:
+            # Secondary rate limit
+            self.paused_until = now + float(headers["Retry-After"])
+            return True
+
+        return self.remaining == 0
+
+    def stats(self) -> dict:
+        def as_datetime(timestamp: Optional[float]) -> Optional[datetime]:
+            return datetime.utcfromtimestamp(timestamp) if timestamp else None
+
+        paused = self.paused_until if self.paused_until and self.paused_until > time.time() else None
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "used": self.used,
+            "reset_at": as_datetime(self.reset_at),
+            "paused_until": as_datetime(paused),
+            "requests_per_second": round(self.current_rate(), 3),
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
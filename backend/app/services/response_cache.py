@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from ..config import get_settings
+
+settings = get_settings()
+
+
+class ResponseCache:
+    """
+    In-process TTL + LRU cache for computed API responses (dashboard metrics,
+    repo list).
+
+    Each entry records the repo it was computed for (None for all-repo
+    responses), so a write to one repo only drops that repo's entries and the
+    all-repo ones.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = settings.response_cache_ttl if ttl is None else ttl
+        self.max_entries = settings.response_cache_max_entries if max_entries is None else max_entries
+        # key -> (expires_at, repo, value)
+        self._entries: "OrderedDict[Hashable, tuple[float, Optional[str], Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns:
+            The cached value, or None if missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+        if entry:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Any, repo: Optional[str] = None):
+        """Cache a response computed for ``repo`` (None: all repos)."""
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, repo, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, repo: Optional[str] = None):
+        """Drop responses affected by a write to ``repo`` (or everything if None)."""
+        stale = [
+            key for key, (_, entry_repo, _) in self._entries.items()
+            if repo is None or entry_repo is None or entry_repo == repo
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries,
+        }
+
+
+# Singleton instance
+response_cache = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
@@ -0,0 +1,276 @@
+import re
+from typing import Collection, List, NamedTuple, Optional, Set
+
+from ..models.schemas import FileDiff
+
+# Rough heuristic for code: ~4 characters per token
+CHARS_PER_TOKEN = 4
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+HUNK_RANGES = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+# Review priority of a file, most important first
+RISK_SENSITIVE, RISK_SOURCE, RISK_TEST, RISK_DOCS, RISK_GENERATED = range(5)
+
+SENSITIVE_PATH = re.compile(
+    r"auth|login|passw|secret|token(?!i[sz])|crypt|credential|permission|session|security|"
+    r"\.env|config|settings|sql|migration|dockerfile|\.github/workflows",
+    re.IGNORECASE,
+)
+TEST_PATH = re.compile(
+    r"(^|/)(tests?|__tests__|spec)/|(^|/)test_[^/]*$|_test\.\w+$|\.(test|spec)\.\w+$",
+    re.IGNORECASE,
+)
+DOCS_PATH = re.compile(r"(^|/)docs?/|\.(md|rst|txt|adoc)$|(^|/)(LICENSE|CHANGELOG)[^/]*$", re.IGNORECASE)
+GENERATED_PATH = re.compile(
+    r"(^|/)(vendor|node_modules|dist|build)/|\.min\.(js|css)$|\.(map|snap|svg)$|_pb2\.py$|\.generated\.",
+    re.IGNORECASE,
+)
+LOCKFILES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock",
+    "Cargo.lock", "Gemfile.lock", "composer.lock", "go.sum", "uv.lock",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def render_file(file: FileDiff) -> str:
+    """Render a single file in the diff format sent to Claude."""
+    parts = [f"--- {file.filename}", f"+++ {file.filename}"]
+    if file.patch:
+        parts.append(file.patch)
+    parts.append("")
+    return "\n".join(parts)
+
+
+def render_diff(files: List[FileDiff]) -> str:
+    """Concatenate file diffs into a single diff string."""
+    return "\n".join(render_file(file) for file in files)
+
+
+def resolve_path(path: str, filenames: Collection[str]) -> Optional[str]:
+    """
+    The diff filename a path reported by Claude refers to, tolerating a
+    leading "./" or "/" and git's "a/" and "b/" prefixes.
+
+    Returns:
+        The filename, or None if the path matches none of ``filenames``.
+    """
+    path = path.strip()
+    while path.startswith("./"):
+        path = path[2:]
+    path = path.lstrip("/")
+    if path in filenames:
+        return path
+    if path[:2] in ("a/", "b/") and path[2:] in filenames:
+        return path[2:]
+    return None
+
+
+def split_hunks(patch: str) -> List[str]:
+    """Split a unified diff patch into its hunks."""
+    hunks: List[List[str]] = []
+    for line in patch.splitlines():
+        if line.startswith("@@") or not hunks:
+            hunks.append([])
+        hunks[-1].append(line)
+    return ["\n".join(hunk) for hunk in hunks]
+
+
+def changed_lines(patch: Optional[str]) -> int:
+    """Number of added and removed lines in a patch."""
+    if not patch:
+        return 0
+    return sum(
+        1 for line in patch.splitlines()
+        if line[:1] in ("+", "-") and not line.startswith(("+++", "---"))
+    )
+
+
+def risk_tier(filename: str) -> int:
+    """Review priority of a file from its path (``RISK_*``, lower is reviewed first)."""
+    if filename.rsplit("/", 1)[-1] in LOCKFILES or GENERATED_PATH.search(filename):
+        return RISK_GENERATED
+    if TEST_PATH.search(filename):
+        return RISK_TEST
+    if DOCS_PATH.search(filename):
+        return RISK_DOCS
+    if SENSITIVE_PATH.search(filename):
+        return RISK_SENSITIVE
+    return RISK_SOURCE
+
+
+def file_priority(file: FileDiff) -> tuple[int, int]:
+    """Sort key: risk tier, then churn (largest first)."""
+    churn = file.additions + file.deletions or changed_lines(file.patch)
+    return risk_tier(file.filename), -churn
+
+
+def rank_files(files: List[FileDiff]) -> List[FileDiff]:
+    """Order files by review priority, most important first."""
+    return sorted(files, key=file_priority)
+
+
+class PackedDiff(NamedTuple):
+    files: List[FileDiff]  # To review, in their original order; some may hold only part of their hunks
+    skipped: List[str]  # Filenames left out entirely
+    truncated: List[str]  # Filenames reviewed only in part
+
+
+def _fit_hunks(file: FileDiff, token_budget: int, max_lines: int) -> Optional[FileDiff]:
+    """
+    The file with as many of its whole hunks as fit ``token_budget`` tokens and
+    ``max_lines`` changed lines (0: no limit), or None if none fit.
+    """
+    tokens = estimate_tokens(render_file(file.model_copy(update={"patch": None})))
+    if not file.patch:
+        return file if tokens <= token_budget else None
+
+    hunks = split_hunks(file.patch)
+    kept = []
+    lines = 0
+    for hunk in hunks:
+        hunk_tokens = estimate_tokens(hunk)
+        hunk_lines = changed_lines(hunk)
+        if tokens + hunk_tokens > token_budget or (max_lines and lines + hunk_lines > max_lines):
+            continue
+        kept.append(hunk)
+        tokens += hunk_tokens
+        lines += hunk_lines
+
+    if not kept:
+        return None
+    if len(kept) == len(hunks):
+        return file
+    return file.model_copy(update={"patch": "\n".join(kept)})
+
+
+def pack_files(files: List[FileDiff], token_budget: int, max_file_lines: int = 0) -> PackedDiff:
+    """
+    Select what to review of a PR within ``token_budget`` estimated tokens.
+
+    Files are taken highest risk first (see ``rank_files``), each as many of
+    its whole hunks as still fit, and at most ``max_file_lines`` changed lines
+    per file (0: no limit). Files that don't fit at all are skipped.
+    """
+    ranked = sorted(range(len(files)), key=lambda index: file_priority(files[index]))
+    selected = {}
+    skipped, truncated = [], []
+    remaining = token_budget
+
+    for index in ranked:
+        file = files[index]
+        piece = _fit_hunks(file, remaining, max_file_lines)
+        if piece is None:
+            skipped.append(file.filename)
+            continue
+        if piece is not file:
+            truncated.append(file.filename)
+        selected[index] = piece
+        remaining -= estimate_tokens(render_file(piece))
+
+    return PackedDiff(
+        files=[selected[index] for index in sorted(selected)],
+        skipped=skipped,
+        truncated=truncated,
+    )
+
+
+def commentable_lines(patch: str) -> Set[int]:
+    """
+    Line numbers on the new side of a patch that GitHub accepts review
+    comments on (added and context lines inside a hunk).
+    """
+    lines: Set[int] = set()
+    line_number = None
+    for line in patch.splitlines():
+        header = HUNK_HEADER.match(line)
+        if header:
+            line_number = int(header.group(1))
+        elif line_number is None or line.startswith("-") or line.startswith("\\"):
+            continue
+        else:
+            lines.add(line_number)
+            line_number += 1
+    return lines
+
+
+def shift_line(patch: str, line_number: int) -> Optional[int]:
+    """
+    Follow a line of the old side of a patch to the new side.
+
+    Returns:
+        The line's number after the patch, or None if it lies inside one of
+        the patch's hunks (changed, or shown as context around a change).
+    """
+    offset = 0
+    for line in patch.splitlines():
+        header = HUNK_RANGES.match(line)
+        if not header:
+            continue
+        old_start = int(header.group(1))
+        old_count = int(header.group(2) or 1)
+        new_count = int(header.group(3) or 1)
+        if old_count == 0:
+            # Pure insertion after old_start
+            if line_number <= old_start:
+                break
+        elif line_number < old_start:
+            break
+        elif line_number < old_start + old_count:
+            return None
+        offset += new_count - old_count
+    return line_number + offset
+
+
+def _split_file(file: FileDiff, token_budget: int) -> List[FileDiff]:
+    """Split an oversized file into hunk groups that each fit the budget."""
+    if not file.patch or estimate_tokens(render_file(file)) <= token_budget:
+        return [file]
+
+    groups: List[List[str]] = [[]]
+    group_tokens = 0
+    for hunk in split_hunks(file.patch):
+        hunk_tokens = estimate_tokens(hunk)
+        if groups[-1] and group_tokens + hunk_tokens > token_budget:
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(hunk)
+        group_tokens += hunk_tokens
+
+    return [
+        file.model_copy(update={"patch": "\n".join(hunks)})
+        for hunks in groups
+    ]
+
+
+def chunk_files(files: List[FileDiff], token_budget: int) -> List[List[FileDiff]]:
+    """
+    Group file diffs into chunks of at most ``token_budget`` estimated tokens.
+
+    Oversized files are split on hunk boundaries. Chunks are packed
+    first-fit-decreasing so they come out roughly the same size.
+    """
+    pieces: List[FileDiff] = []
+    for file in files:
+        pieces.extend(_split_file(file, token_budget))
+
+    pieces.sort(key=lambda piece: estimate_tokens(render_file(piece)), reverse=True)
+
+    chunks: List[List[FileDiff]] = []
+    chunk_tokens: List[int] = []
+    for piece in pieces:
+        tokens = estimate_tokens(render_file(piece))
+        for i, used in enumerate(chunk_tokens):
+            if used + tokens <= token_budget:
+                chunks[i].append(piece)
+                chunk_tokens[i] += tokens
+                break
+        else:
+            chunks.append([piece])
+            chunk_tokens.append(tokens)
+
+    return chunks
@@ -0,0 +1,82 @@
+import json
+from typing import List
+
+
+class IssueStreamParser:
+    """
+    Incrementally extracts the elements of the top-level ``"issues"`` array
+    from Claude's JSON response while it is still being streamed.
+
+    Feed text deltas in order; each call returns the issue objects that were
+    completed by that delta. Text before the first ``{`` (prose, a code fence)
+    is skipped. Elements that are not valid JSON objects are dropped.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_key = None  # Last string closed directly inside the top-level object
+        self._array_depth = None  # Depth of the issues array's elements, while inside it
+        self._item_start = None
+
+    def feed(self, text: str) -> List[dict]:
+        """
+        Returns:
+            Issue objects completed by ``text``.
+        """
+        self._buffer += text
+        completed = []
+
+        while self._pos < len(self._buffer):
+            pos = self._pos
+            char = self._buffer[pos]
+            self._pos += 1
+
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = self._buffer[self._string_start:pos]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos + 1
+            elif char in "{[":
+                if self._array_depth is None and char == "[" and self._depth == 1 and self._last_key == "issues":
+                    self._array_depth = 2
+                elif char == "{" and self._depth == self._array_depth:
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._depth == self._array_depth and self._item_start is not None:
+                    item = self._decode(self._buffer[self._item_start:pos + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = None
+                elif char == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = -1  # Only the first issues array counts
+
+        return completed
+
+    @staticmethod
+    def _decode(text: str):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
@@ -1,3 +1,10 @@
+from typing import Dict, List, Optional
+
+from .diff import estimate_tokens
+
+# Bump whenever the prompts change so cached analyses are not reused
+PROMPT_VERSION = "4"
+
 ANALYSIS_SYSTEM_PROMPT = """You are CodeGuard, an AI code review assistant. Your job is to analyze pull request diffs and identify issues related to:
 
 1. **Security** - Hardcoded secrets, SQL injection, XSS, insecure configurations
@@ -21,19 +28,45 @@ IMPORTANT: Only report real issues. Do not fabricate problems. If the code looks
 
 Respond in JSON format only."""
 
-ANALYSIS_USER_PROMPT = """Analyze this pull request diff and identify any issues.
+ANALYSIS_REVIEW_GUIDELINES = """Review guidelines:
 
-Repository: {repo}
-PR Title: {pr_title}
-Author: {author}
+Severity
+- critical: will cause a security vulnerability, data loss or corruption, a crash, or clearly wrong behavior in production once merged. Examples: credentials or tokens committed to the repository, user input concatenated into SQL, shell commands or HTML, authentication or authorization checks that can be bypassed, unbounded recursion, a resource that is never released on a hot path.
+- warning: likely to cause bugs, maintenance problems or measurable slowness, but not an immediate failure. Examples: errors swallowed silently, race conditions under concurrent use, missing input validation at a trust boundary, queries issued inside loops, new behavior without tests.
+- suggestion: an optional improvement to readability, naming, structure or documentation. Keep these few and worthwhile; skip pure matters of taste.
 
-Files Changed:
-{diff}
+Categories
+- security: secrets, injection, unsafe deserialization, weak cryptography, insecure defaults, missing authorization, sensitive data written to logs.
+- quality: correctness bugs, error handling, complexity, duplication, dead code, naming and readability.
+- testing: changed behavior without matching tests, tests that cannot fail, brittle or order-dependent tests, missing edge cases for the new code.
+- docs: public APIs, configuration options or non-obvious behavior added without documentation, and comments or docstrings the change made wrong.
+- performance: accidental quadratic work, repeated I/O or queries, loading far more data than needed, blocking calls in asynchronous code, missing pagination or limits.
+
+Configuration, dependencies and migrations
+- New dependencies: flag ones that are unmaintained, duplicate an existing dependency, or are pinned to a version with known vulnerabilities.
+- Configuration and infrastructure files: flag debug modes left on, overly permissive CORS or network rules, disabled TLS certificate verification, and secrets committed in environment files.
+- Database migrations: flag changes that lock or rewrite large tables, drop data without a way back, or break the code still running during a deploy.
+
+Locating issues
+- Review the changed lines. Unchanged context lines only matter when the change breaks them.
+- file_path is the path exactly as it appears in the diff header, without an "a/" or "b/" prefix.
+- line_number is the line in the new version of the file, counted from the "+" side of the hunk header, and should be a line shown in the diff (added or context), so the finding can be attached to it. Use null if the issue concerns the file as a whole.
+- Report each problem once, at its most relevant line. If the same mistake is repeated across many lines, report the first occurrence and mention in the message that it recurs.
+
+Writing findings
+- The title names the problem in a few words, e.g. "SQL query built from request parameters".
+- The message says what is wrong in this specific code, referring to the variables and functions involved.
+- The explanation says what can go wrong in practice and under which conditions.
+- The suggestion describes a concrete fix and may include a short code snippet.
+- Do not report style issues an automated formatter or linter would fix, speculative problems that depend on code you cannot see, or the same issue under two categories.
+- If a diff is truncated or a file is omitted, review what is shown and do not guess at the rest.
 
-Respond with a JSON object in this exact format:
-{{
+The summary is one or two sentences on the change as a whole. has_tests is true if the diff adds or updates tests. overall_quality is "good" when there are no warnings or critical issues, "acceptable" when there are only a few warnings, and "needs_improvement" otherwise."""
+
+ANALYSIS_OUTPUT_FORMAT = """Respond with a JSON object in this exact format:
+{
   "issues": [
-    {{
+    {
       "category": "security|quality|testing|docs|performance",
       "severity": "critical|warning|suggestion",
       "file_path": "path/to/file.js",
@@ -42,15 +75,75 @@ Respond with a JSON object in this exact format:
       "message": "Clear description of the issue",
       "explanation": "Why this matters",
       "suggestion": "How to fix it"
-    }}
+    }
   ],
   "summary": "Brief overall assessment",
   "has_tests": true|false,
   "overall_quality": "good|acceptable|needs_improvement"
-}}
+}
 
 If no issues are found, return an empty issues array. Be thorough but avoid false positives."""
 
+ANALYSIS_USER_PROMPT = """Analyze this pull request diff and identify any issues.
+
+Repository: {repo}
+PR Title: {pr_title}
+Author: {author}
+
+Files Changed:
+{diff}"""
+
+# Marks the end of a prompt prefix Claude may cache and reuse across calls.
+# Cache writes cost more than plain input, so only mark prefixes that will be
+# reused and that are long enough to be cached at all. The shared instructions
+# are kept above Claude's minimum so every review can read them from the cache.
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def build_repo_guidance(custom_prompts: Optional[Dict[str, str]]) -> Optional[str]:
+    """
+    Render a repo's ``RepoConfig.custom_prompts`` (topic -> guidance) for the
+    system prompt, in a stable order so the cached prefix doesn't change.
+    """
+    lines = [
+        f"- {topic}: {text.strip()}"
+        for topic, text in sorted((custom_prompts or {}).items())
+        if isinstance(text, str) and text.strip()
+    ]
+    if not lines:
+        return None
+    return "Repository guidance from the maintainers:\n" + "\n".join(lines)
+
+
+def build_system_prompt(
+    guidance: Optional[str] = None,
+    cache_min_tokens: Optional[int] = None,
+    cache_guidance: bool = False
+) -> List[dict]:
+    """
+    Build the system prompt: the instructions, review guidelines and output
+    format shared by every repo, then the repo's guidance, if any.
+
+    With ``cache_min_tokens``, the shared block is marked cacheable, as every
+    review starts with it; with ``cache_guidance`` too, so is the prompt up to
+    the repo's guidance, e.g. when several calls of one PR or batch share it.
+    A prefix is only marked if it is at least ``cache_min_tokens`` long
+    (Claude's minimum cacheable prefix for the model).
+    """
+    shared = f"{ANALYSIS_SYSTEM_PROMPT}\n\n{ANALYSIS_REVIEW_GUIDELINES}\n\n{ANALYSIS_OUTPUT_FORMAT}"
+    blocks = [{"type": "text", "text": shared}]
+    if guidance:
+        blocks.append({"type": "text", "text": guidance})
+    if cache_min_tokens is None:
+        return blocks
+
+    prefix_tokens = 0
+    for index, block in enumerate(blocks):
+        prefix_tokens += estimate_tokens(block["text"])
+        if (index == 0 or cache_guidance) and prefix_tokens >= cache_min_tokens:
+            block["cache_control"] = CACHE_CONTROL
+    return blocks
+
 
 def build_analysis_prompt(repo: str, pr_title: str, author: str, diff: str) -> str:
     """Build the user prompt for PR analysis."""
@@ -58,5 +151,5 @@ def build_analysis_prompt(repo: str, pr_title: str, author: str, diff: str) -> s
         repo=repo,
         pr_title=pr_title or "Untitled PR",
         author=author or "Unknown",
-        diff=diff[:50000]  # Truncate very large diffs
+        diff=diff  # Already packed to the token budget (see utils.diff.pack_files)
     )
@@ -0,0 +1,133 @@
+"""
+Benchmark the dashboard metrics endpoint against a large seeded database.
+
+Usage (from backend/):
+    python -m benchmarks.metrics_benchmark [--analyses 100000] [--runs 5]
+
+Reports the time to build the metrics rollup, then the number of SQL
+statements and the latency of one /api/metrics request, with and without a
+repo filter.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.models.database import Base, PRAnalysis, Issue, make_async_engine, make_async_sessionmaker
+from app.routers.metrics import get_metrics
+from app.services.metrics_rollup import get_metrics_rollup
+from app.services.response_cache import get_response_cache
+
+CATEGORIES = ["security", "quality", "testing", "docs", "performance"]
+SEVERITIES = ["critical", "warning", "suggestion"]
+REPOS = [f"org/repo-{i}" for i in range(20)]
+
+
+def seed(engine, analyses: int, issues_per_analysis: int, batch_size: int = 10000):
+    """Insert synthetic analyses spread over the last 90 days, with their issues."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        for offset in range(0, analyses, batch_size):
+            analysis_rows = []
+            issue_rows = []
+            for i in range(offset, min(offset + batch_size, analyses)):
+                analysis_id = f"analysis-{i}"
+                severities = [rng.choice(SEVERITIES) for _ in range(issues_per_analysis)]
+                analysis_rows.append({
+                    "id": analysis_id,
+                    "repo": rng.choice(REPOS),
+                    "pr_number": i,
+                    "status": "completed",
+                    "analyzed_at": now - timedelta(minutes=rng.randrange(90 * 24 * 60)),
+                    "critical_count": severities.count("critical"),
+                    "warning_count": severities.count("warning"),
+                    "suggestion_count": severities.count("suggestion"),
+                })
+                for j, severity in enumerate(severities):
+                    issue_rows.append({
+                        "id": f"{analysis_id}-{j}",
+                        "analysis_id": analysis_id,
+                        "category": rng.choice(CATEGORIES),
+                        "severity": severity,
+                        "file_path": f"src/module_{rng.randrange(50)}.py",
+                        "title": f"Issue type {rng.randrange(40)}",
+                        "message": "Synthetic issue",
+                    })
+            conn.execute(insert(PRAnalysis), analysis_rows)
+            if issue_rows:
+                conn.execute(insert(Issue), issue_rows)
+
+
+async def measure(session_factory, statements, repo, days, runs):
+    """Run get_metrics ``runs`` times; return (queries per request, latencies in ms)."""
+    latencies = []
+    queries = 0
+    for _ in range(runs):
+        get_response_cache().clear()  # Measure the queries, not the response cache
+        async with session_factory() as db:
+            statements.clear()
+            start = time.perf_counter()
+            await get_metrics(repo=repo, days=days, db=db)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries = len(statements)
+    return queries, latencies
+
+
+async def run_requests(path, args):
+    async_engine = make_async_engine(f"sqlite:///{path}", poolclass=AsyncAdaptedQueuePool)
+    session_factory = make_async_sessionmaker(async_engine)
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+    for label, repo in (("all repos", None), ("one repo", REPOS[0])):
+        queries, latencies = await measure(session_factory, statements, repo, args.days, args.runs)
+        print(
+            f"{label:>10}: {queries} queries, "
+            f"median {statistics.median(latencies):.1f} ms, max {max(latencies):.1f} ms "
+            f"over {args.runs} runs"
+        )
+
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analyses", type=int, default=100000)
+    parser.add_argument("--issues-per-analysis", type=int, default=2)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "metrics_benchmark.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+
+    start = time.perf_counter()
+    seed(engine, args.analyses, args.issues_per_analysis)
+    print(f"Seeded {args.analyses} analyses in {time.perf_counter() - start:.1f}s ({path})")
+
+    db = session_factory()
+    start = time.perf_counter()
+    rows = get_metrics_rollup().rebuild(db)
+    db.close()
+    print(f"Built metrics rollup ({rows} repo-days) in {time.perf_counter() - start:.1f}s")
+
+    asyncio.run(run_requests(path, args))
+
+    engine.dispose()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark offset vs cursor pagination of /api/analyses.
+
+Usage (from backend/):
+    python -m benchmarks.pagination_benchmark [--analyses 100000] [--limit 10]
+
+Reports the number of SQL statements and the latency of fetching page 1 and
+a deep page (page 10,000 at the default size) in both modes.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, desc, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.models.database import Base, PRAnalysis, make_async_engine, make_async_sessionmaker
+from app.routers.analysis import encode_cursor, list_analyses
+from benchmarks.metrics_benchmark import seed
+
+
+async def measure(session_factory, statements, runs, **params):
+    """Run list_analyses ``runs`` times; return (queries per request, median latency in ms)."""
+    params = {"repo": None, "status": None, "limit": 10, "offset": 0, "cursor": None, **params}
+    latencies = []
+    for _ in range(runs):
+        async with session_factory() as db:
+            statements.clear()
+            start = time.perf_counter()
+            await list_analyses(db=db, **params)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return len(statements), statistics.median(latencies)
+
+
+async def run_requests(path, cases, args):
+    async_engine = make_async_engine(f"sqlite:///{path}", poolclass=AsyncAdaptedQueuePool)
+    session_factory = make_async_sessionmaker(async_engine)
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+    for label, params in cases:
+        queries, latency = await measure(session_factory, statements, args.runs, limit=args.limit, **params)
+        print(f"{label:>20}: {queries} queries, median {latency:.2f} ms over {args.runs} runs")
+
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analyses", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--page", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "pagination_benchmark.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    seed(engine, args.analyses, issues_per_analysis=0)
+    print(f"Seeded {args.analyses} analyses ({path})")
+
+    # Cursor for the deep page: the last row of the page before it
+    deep_offset = (args.page - 1) * args.limit
+    db = session_factory()
+    previous = (
+        db.query(PRAnalysis)
+        .order_by(desc(PRAnalysis.analyzed_at), desc(PRAnalysis.id))
+        .offset(deep_offset - 1)
+        .first()
+    )
+    deep_cursor = encode_cursor(previous)
+    db.close()
+
+    asyncio.run(run_requests(path, [
+        ("offset, page 1", {}),
+        (f"offset, page {args.page}", {"offset": deep_offset}),
+        ("cursor, page 1", {"cursor": ""}),
+        (f"cursor, page {args.page}", {"cursor": deep_cursor}),
+    ], args))
+
+    engine.dispose()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
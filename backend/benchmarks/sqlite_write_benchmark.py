@@ -0,0 +1,144 @@
+"""
+Benchmark concurrent SQLite writes in the default mode and in SQLite
+production mode (WAL, tuned pragmas, single writer connection).
+
+Usage (from backend/):
+    python -m benchmarks.sqlite_write_benchmark [--writers 16] [--ops 50] [--readers 4]
+
+Each writer runs ``--ops`` write transactions shaped like the app's: a
+webhook (insert an analysis and enqueue its job) or a feedback submission
+(read an issue, then update it and insert a feedback row), while readers
+list analyses. Reports committed writes per second, write latency and the
+number of "database is locked" failures in each mode.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import desc, select
+from sqlalchemy.exc import OperationalError
+
+from app.models import database
+from app.models.database import (
+    Base,
+    Feedback,
+    Issue,
+    PRAnalysis,
+    make_async_engine,
+    make_async_sessionmaker,
+    make_engine,
+    run_in_session,
+)
+from app.services.job_queue import JobQueue
+
+ISSUES = 100
+
+
+async def webhook(db, queue: JobQueue, pr_number: int):
+    analysis = PRAnalysis(repo="org/repo", pr_number=pr_number, status="pending")
+    db.add(analysis)
+    await db.flush()
+    await run_in_session(db, queue.enqueue, analysis)
+
+
+async def feedback(db, pr_number: int):
+    issue = await db.get(Issue, f"issue-{pr_number % ISSUES}")
+    issue.is_helpful = pr_number % 2 == 0
+    db.add(Feedback(issue_id=issue.id, repo="org/repo", is_helpful=issue.is_helpful))
+    await db.commit()
+
+
+async def run_mode(path: str, production: bool, args) -> dict:
+    database.settings.sqlite_production_mode = production
+    url = f"sqlite:///{path}"
+    engine = make_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(PRAnalysis.__table__.insert(), [{"id": "seed", "repo": "org/repo", "pr_number": 0}])
+        conn.execute(Issue.__table__.insert(), [
+            {"id": f"issue-{i}", "analysis_id": "seed", "category": "quality", "severity": "warning",
+             "file_path": "a.py", "title": "Issue", "message": "Synthetic issue"}
+            for i in range(ISSUES)
+        ])
+
+    reader = make_async_engine(url)
+    writer = make_async_engine(url, writer=True) if production else None
+    session_factory = make_async_sessionmaker(reader, writer)
+    queue = JobQueue(session_factory=session_factory)
+
+    latencies = []
+    errors = 0
+    reads = 0
+    done = asyncio.Event()
+
+    async def write_loop(worker: int):
+        nonlocal errors
+        for op in range(args.ops):
+            pr_number = worker * args.ops + op + 1
+            start = time.perf_counter()
+            try:
+                async with session_factory() as db:
+                    if op % 2:
+                        await feedback(db, pr_number)
+                    else:
+                        await webhook(db, queue, pr_number)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except OperationalError:
+                errors += 1
+
+    async def read_loop():
+        nonlocal reads
+        while not done.is_set():
+            async with session_factory() as db:
+                await db.scalars(select(PRAnalysis).order_by(desc(PRAnalysis.analyzed_at)).limit(50))
+            reads += 1
+            await asyncio.sleep(0.01)
+
+    readers = [asyncio.create_task(read_loop()) for _ in range(args.readers)]
+    start = time.perf_counter()
+    await asyncio.gather(*[write_loop(worker) for worker in range(args.writers)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*readers)
+
+    await reader.dispose()
+    if writer:
+        await writer.dispose()
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        "writes_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) if latencies else 0,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0,
+        "locked_errors": errors,
+        "reads": reads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=50, help="Write transactions per writer")
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for label, production in (("default", False), ("production", True)):
+        path = os.path.join(directory, f"{label}.db")
+        result = asyncio.run(run_mode(path, production, args))
+        print(
+            f"{label:>10}: {result['writes_per_second']:.0f} writes/s, "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+            f"{result['locked_errors']} 'database is locked' errors, {result['reads']} reads"
+        )
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,25 @@
 """Tests for API endpoints."""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import httpx
 import pytest
 from fastapi import status
 
+from app.main import app
+from app.models.database import PRAnalysis
+from app.models.schemas import FeedbackCreate
+from app.routers.analysis import (
+    all_analysis_events, analysis_events, submit_feedback, settings as analysis_settings,
+)
+from app.services.event_bus import get_event_bus
+from app.services.analyzer import AnalyzerService
+from app.services.backfill import get_backfill_service
+from app.services.github import GitHubService
+from tests.conftest import AsyncTestingSessionLocal
+
 
 class TestHealthEndpoints:
     """Test health check endpoints."""
@@ -21,6 +39,30 @@ class TestHealthEndpoints:
         assert response.status_code == status.HTTP_200_OK
         assert response.json()["status"] == "healthy"
 
+    async def test_health_responsive_during_analyses(self, slow_claude):
+        """Test /health answers in milliseconds while analyses are in flight."""
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0.5)
+
+        analyses = [
+            asyncio.create_task(analyzer.analyze_diff("owner/repo", "PR", "user", "diff"))
+            for _ in range(5)
+        ]
+        await asyncio.sleep(0.01)  # let every analysis reach its Claude call
+        assert analyzer.client.in_flight == 5
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            start = time.perf_counter()
+            response = await http.get("/health")
+            elapsed = time.perf_counter() - start
+
+        assert response.status_code == status.HTTP_200_OK
+        assert elapsed < 0.1
+        assert not any(task.done() for task in analyses)
+
+        await asyncio.gather(*analyses)
+
 
 class TestAnalysisEndpoints:
     """Test analysis-related endpoints."""
@@ -60,6 +102,65 @@ class TestAnalysisEndpoints:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.json()) == 0
 
+    def _seed_analyses(self, db_session, count):
+        from app.models.database import PRAnalysis
+
+        base = datetime(2024, 1, 1)
+        for i in range(count):
+            # Pairs share a timestamp, so the id tie-breaker matters
+            db_session.add(PRAnalysis(
+                id=f"analysis-{i:02d}", repo="owner/repo", pr_number=i, status="completed",
+                analyzed_at=base + timedelta(minutes=i // 2),
+            ))
+        db_session.commit()
+
+    def _walk(self, client, url):
+        ids, cursor, pages = [], "", 0
+        while cursor is not None:
+            data = client.get(url, params={"cursor": cursor}).json()
+            ids += [item["id"] for item in data["items"]]
+            cursor = data["next_cursor"]
+            pages += 1
+        return ids, pages
+
+    def test_list_analyses_cursor_pages(self, client, db_session):
+        """Test cursor pagination visits every analysis once, newest first."""
+        self._seed_analyses(db_session, 7)
+
+        ids, pages = self._walk(client, "/api/analyses?limit=3")
+
+        offset_ids = [item["id"] for item in client.get("/api/analyses?limit=10").json()]
+        assert ids == offset_ids
+        assert len(ids) == 7
+        assert pages == 3
+
+    def test_list_analyses_cursor_stable_under_inserts(self, client, db_session):
+        """Test new analyses don't shift the pages after the cursor."""
+        from app.models.database import PRAnalysis
+
+        self._seed_analyses(db_session, 6)
+        first = client.get("/api/analyses", params={"limit": 3, "cursor": ""}).json()
+        db_session.add(PRAnalysis(repo="owner/repo", pr_number=99, status="pending"))
+        db_session.commit()
+
+        second = client.get("/api/analyses", params={"limit": 3, "cursor": first["next_cursor"]}).json()
+
+        assert [item["id"] for item in second["items"]] == ["analysis-02", "analysis-01", "analysis-00"]
+        assert second["next_cursor"] is None
+
+    def test_list_analyses_cursor_with_filter(self, client, db_session, sample_pr_analysis):
+        """Test the cursor mode applies the repo filter."""
+        self._seed_analyses(db_session, 4)
+
+        ids, _ = self._walk(client, "/api/analyses?limit=2&repo=owner/repo")
+
+        assert ids == ["analysis-03", "analysis-02", "analysis-01", "analysis-00"]
+
+    def test_list_analyses_invalid_cursor(self, client):
+        """Test a malformed cursor is rejected."""
+        response = client.get("/api/analyses?cursor=not-a-cursor")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
     def test_get_analysis_by_id(self, client, sample_pr_analysis):
         """Test getting a specific analysis by ID."""
         response = client.get(f"/api/analysis/{sample_pr_analysis.id}")
@@ -74,6 +175,77 @@ class TestAnalysisEndpoints:
         assert data["summary"]["total_issues"] == 4
         assert len(data["issues"]) == 4
 
+    def test_completed_analysis_has_etag(self, client, sample_pr_analysis, query_log):
+        """Test a completed analysis is revalidated with 304 without loading its issues."""
+        response = client.get(f"/api/analysis/{sample_pr_analysis.id}")
+        etag = response.headers["ETag"]
+        assert etag == '"test-analysis-123.0"'
+        query_log.clear()
+
+        response = client.get(f"/api/analysis/{sample_pr_analysis.id}", headers={"If-None-Match": etag})
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers["ETag"] == etag
+        assert not any("FROM issues" in sql for sql, _ in query_log)
+
+    def test_completed_analysis_body_cached(self, client, sample_pr_analysis, query_log):
+        """Test a repeat request without If-None-Match is served from the body cache."""
+        first = client.get(f"/api/analysis/{sample_pr_analysis.id}")
+        query_log.clear()
+
+        second = client.get(f"/api/analysis/{sample_pr_analysis.id}")
+
+        assert second.json() == first.json()
+        assert len(second.json()["issues"]) == 4
+        assert not any("FROM issues" in sql for sql, _ in query_log)
+
+    def test_feedback_changes_etag(self, client, sample_pr_analysis):
+        """Test feedback produces a new ETag and fresh body."""
+        etag = client.get(f"/api/analysis/{sample_pr_analysis.id}").headers["ETag"]
+        client.post("/api/feedback", json={"issue_id": "issue-1", "is_helpful": False})
+
+        response = client.get(f"/api/analysis/{sample_pr_analysis.id}", headers={"If-None-Match": etag})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
+        issue = next(i for i in response.json()["issues"] if i["id"] == "issue-1")
+        assert issue["is_helpful"] is False
+
+    def test_pr_analysis_etag(self, client, sample_pr_analysis):
+        """Test the latest-analysis-for-PR endpoint supports revalidation too."""
+        etag = client.get("/api/pr/test-owner/test-repo/42").headers["ETag"]
+
+        response = client.get("/api/pr/test-owner/test-repo/42", headers={"If-None-Match": etag})
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_pending_analysis_has_no_etag(self, client, db_session):
+        """Test analyses that can still change are not given an ETag."""
+        from app.models.database import PRAnalysis
+
+        db_session.add(PRAnalysis(id="pending-1", repo="owner/repo", pr_number=1, status="pending"))
+        db_session.commit()
+
+        response = client.get("/api/analysis/pending-1")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert "ETag" not in response.headers
+
+    def test_running_analysis_counts_streamed_findings(self, client, db_session):
+        """Test the summary of a running analysis counts the findings stored so far."""
+        from app.models.database import Issue
+
+        db_session.add(PRAnalysis(id="running-1", repo="owner/repo", pr_number=1, status="processing"))
+        db_session.add(Issue(analysis_id="running-1", category="security", severity="critical",
+                             file_path="a.py", title="Early", message="Streamed"))
+        db_session.commit()
+
+        data = client.get("/api/analysis/running-1").json()
+
+        assert data["summary"]["critical"] == 1
+        assert data["summary"]["total_issues"] == 1
+        assert data["progress"] == {"chunks_done": 0, "chunks_total": 0}
+
     def test_get_analysis_not_found(self, client):
         """Test getting non-existent analysis returns 404."""
         response = client.get("/api/analysis/non-existent-id")
@@ -92,6 +264,118 @@ class TestAnalysisEndpoints:
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
+def parse_events(body: str):
+    """Split a Server-Sent Events body into (event, data) pairs, skipping comments."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestAnalysisEvents:
+    """Test the live analysis event streams."""
+
+    async def next_events(self, stream, count=1):
+        events = []
+        while len(events) < count:
+            events += parse_events(await asyncio.wait_for(stream.__anext__(), 2))
+        return events
+
+    def test_finished_analysis_stream_completes(self, client, sample_pr_analysis):
+        """Test a finished analysis gets one complete event and the stream ends."""
+        response = client.get(f"/api/analysis/{sample_pr_analysis.id}/events")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        assert [event for event, _ in events] == ["complete"]
+        assert len(events[0][1]["issues"]) == 4
+
+    def test_events_not_found(self, client):
+        """Test subscribing to an unknown analysis returns 404."""
+        response = client.get("/api/analysis/non-existent-id/events")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    async def test_live_events(self, db_session):
+        """Test a running analysis streams a snapshot, findings and progress, then completes."""
+        db_session.add(PRAnalysis(id="live-1", repo="owner/repo", pr_number=1, status="processing"))
+        db_session.commit()
+        bus = get_event_bus()
+        response = await analysis_events("live-1", db=AsyncTestingSessionLocal())
+        stream = response.body_iterator
+
+        [(event, snapshot)] = await self.next_events(stream)
+        assert (event, snapshot["status"], snapshot["issues"]) == ("snapshot", "processing", [])
+
+        bus.publish("live-1", "progress", {"chunks_done": 1, "chunks_total": 2})
+        bus.publish("live-1", "issue", {"id": "issue-9", "title": "Found early"})
+        assert await self.next_events(stream, 2) == [
+            ("progress", {"chunks_done": 1, "chunks_total": 2}),
+            ("issue", {"id": "issue-9", "title": "Found early"}),
+        ]
+
+        db_session.query(PRAnalysis).filter_by(id="live-1").update({"status": "completed"})
+        db_session.commit()
+        bus.publish_status("live-1", "completed")
+        [(event, final)] = await self.next_events(stream)
+        assert (event, final["status"]) == ("complete", "completed")
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        assert bus.stats()["subscribers"] == 0
+
+    async def test_heartbeat_picks_up_unpublished_status(self, db_session):
+        """Test a status change made by another process ends the stream at the next heartbeat."""
+        db_session.add(PRAnalysis(id="live-2", repo="owner/repo", pr_number=1, status="processing"))
+        db_session.commit()
+
+        with patch.object(analysis_settings, "sse_heartbeat_seconds", 0.05):
+            response = await analysis_events("live-2", db=AsyncTestingSessionLocal())
+            stream = response.body_iterator
+            assert (await self.next_events(stream))[0][0] == "snapshot"
+            assert await asyncio.wait_for(stream.__anext__(), 2) == ": keep-alive\n\n"
+
+            db_session.query(PRAnalysis).filter_by(id="live-2").update({"status": "failed"})
+            db_session.commit()
+            [(event, final)] = await self.next_events(stream)
+            await stream.aclose()
+
+        assert (event, final["status"]) == ("complete", "failed")
+
+    async def test_all_analyses_stream_gets_status_changes(self, db_session):
+        """Test the dashboard stream receives status changes of every analysis, but not findings."""
+        response = await all_analysis_events(db=AsyncTestingSessionLocal())
+        stream = response.body_iterator
+        assert await stream.__anext__() == ": connected\n\n"
+
+        get_event_bus().publish("a-1", "issue", {"id": "issue-1"})
+        get_event_bus().publish_status("a-2", "completed")
+
+        assert await self.next_events(stream) == [
+            ("status", {"analysis_id": "a-2", "status": "completed", "error_message": None}),
+        ]
+        await stream.aclose()
+        assert get_event_bus().stats()["subscribers"] == 0
+
+    async def test_all_analyses_heartbeat_resyncs_on_unpublished_change(self, db_session):
+        """Test the dashboard stream asks for a resync when statuses changed in another process."""
+        db_session.add(PRAnalysis(id="live-3", repo="owner/repo", pr_number=1, status="processing"))
+        db_session.commit()
+
+        with patch.object(analysis_settings, "sse_heartbeat_seconds", 0.05):
+            response = await all_analysis_events(db=AsyncTestingSessionLocal())
+            stream = response.body_iterator
+            assert await stream.__anext__() == ": connected\n\n"
+            assert await asyncio.wait_for(stream.__anext__(), 2) == ": keep-alive\n\n"
+
+            db_session.query(PRAnalysis).filter_by(id="live-3").update({"status": "completed"})
+            db_session.commit()
+            assert await self.next_events(stream) == [("resync", None)]
+            assert await asyncio.wait_for(stream.__anext__(), 2) == ": keep-alive\n\n"
+            await stream.aclose()
+
+
 class TestFeedbackEndpoints:
     """Test feedback-related endpoints."""
 
@@ -106,6 +390,19 @@ class TestFeedbackEndpoints:
         assert data["issue_id"] == "issue-1"
         assert data["is_helpful"] is True
 
+    async def test_concurrent_feedback_bumps_version_twice(self, db_session, sample_pr_analysis):
+        """Test interleaved submissions each get their own feedback version, and so ETag."""
+        version = sample_pr_analysis.feedback_version or 0
+
+        async def submit(is_helpful):
+            async with AsyncTestingSessionLocal() as db:
+                await submit_feedback(FeedbackCreate(issue_id="issue-1", is_helpful=is_helpful), db=db)
+
+        await asyncio.gather(submit(True), submit(False))
+
+        db_session.refresh(sample_pr_analysis)
+        assert sample_pr_analysis.feedback_version == version + 2
+
     def test_submit_feedback_not_helpful(self, client, sample_pr_analysis):
         """Test submitting negative feedback with reason."""
         response = client.post("/api/feedback", json={
@@ -170,6 +467,51 @@ class TestMetricsEndpoints:
         data = response.json()
         assert len(data["daily_metrics"]) <= 7
 
+    def test_daily_metrics_zero_filled(self, client, sample_pr_analysis):
+        """Test the daily series covers every day in order, with zeros for quiet days."""
+        response = client.get("/api/metrics?days=7")
+        daily = response.json()["daily_metrics"]
+
+        assert len(daily) == 7
+        assert [day["date"] for day in daily] == sorted(day["date"] for day in daily)
+        assert daily[-1]["date"] == datetime.utcnow().strftime("%Y-%m-%d")
+        assert daily[-1]["prs_analyzed"] == 1
+        assert daily[-1]["issues_found"] == 4
+        assert daily[-1]["critical_issues"] == 1
+        assert all(day["prs_analyzed"] == 0 for day in daily[:-1])
+
+    def test_metrics_query_count_is_constant(self, client, sample_pr_analysis, query_log):
+        """Test the dashboard runs a fixed number of queries regardless of the date range."""
+        client.get("/api/metrics?days=1")
+        short_range = len(query_log)
+        query_log.clear()
+
+        client.get("/api/metrics?days=365&repo=test-owner/test-repo")
+
+        assert len(query_log) == short_range
+        assert short_range <= 5
+
+    def test_metrics_served_from_cache(self, client, sample_pr_analysis, query_log):
+        """Test repeated dashboard loads don't query the database."""
+        first = client.get("/api/metrics").json()
+        client.get("/api/repos")
+        query_log.clear()
+
+        assert client.get("/api/metrics").json() == first
+        client.get("/api/repos")
+
+        assert query_log == []
+
+    def test_feedback_invalidates_cached_metrics(self, client, sample_pr_analysis, query_log):
+        """Test feedback on a repo drops its cached responses."""
+        client.get("/api/metrics?repo=test-owner/test-repo")
+        client.post("/api/feedback", json={"issue_id": "issue-1", "is_helpful": True})
+        query_log.clear()
+
+        client.get("/api/metrics?repo=test-owner/test-repo")
+
+        assert query_log
+
     def test_list_repos(self, client, sample_pr_analysis):
         """Test listing repositories with analyses."""
         response = client.get("/api/repos")
@@ -226,6 +568,40 @@ class TestWebhookEndpoints:
         assert response.status_code == status.HTTP_200_OK
         assert response.json()["status"] == "ignored"
 
+    def test_webhook_coalesces_pushes(self, client):
+        """Test rapid pushes to a PR leave only the latest analysis queued."""
+        def push(sha):
+            return client.post(
+                "/webhook/github",
+                json={
+                    "action": "synchronize",
+                    "pull_request": {
+                        "number": 5,
+                        "title": "Feature",
+                        "html_url": "https://github.com/test/repo/pull/5",
+                        "state": "open",
+                        "head": {"sha": sha},
+                        "base": {"sha": "base"},
+                        "user": {"login": "user", "id": 1}
+                    },
+                    "repository": {"full_name": "test/repo", "name": "repo", "private": False},
+                    "sender": {"login": "user", "id": 1}
+                },
+                headers={"X-GitHub-Event": "pull_request"}
+            ).json()
+
+        first = push("sha-1")
+        second = push("sha-2")
+
+        assert client.get(f"/api/analysis/{first['analysis_id']}").json()["status"] == "superseded"
+        latest = client.get(f"/api/analysis/{second['analysis_id']}").json()
+        assert latest["status"] == "pending"
+        assert latest["metadata"]["head_sha"] == "sha-2"
+
+        stats = client.get("/api/admin/queue").json()
+        assert stats["queued"] == 1
+        assert stats["superseded"] == 1
+
     def test_test_analysis_endpoint(self, client):
         """Test manual analysis trigger endpoint."""
         response = client.post(
@@ -236,3 +612,66 @@ class TestWebhookEndpoints:
         data = response.json()
         assert data["status"] == "processing"
         assert "analysis_id" in data
+
+    def test_test_analysis_enqueues_job(self, client):
+        """Test manual trigger creates a durable queue entry."""
+        response = client.post(
+            "/webhook/test",
+            params={"repo": "test/repo", "pr_number": 1}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        stats = client.get("/api/admin/queue").json()
+        assert stats["queued"] == 1
+        assert stats["running"] == 0
+
+
+class TestAdminEndpoints:
+    """Test admin endpoints."""
+
+    def test_cache_stats(self, client):
+        """Test cache stats are exposed."""
+        response = client.get("/api/admin/cache")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["entries"] == 0
+        assert {"hits", "misses", "hit_rate", "tokens_saved"} <= set(data)
+
+    def test_response_cache_stats(self, client):
+        """Test response cache stats are exposed."""
+        client.get("/api/metrics")
+        client.get("/api/metrics")
+
+        data = client.get("/api/admin/response-cache").json()
+        assert data["hits"] >= 1
+        assert data["entries"] == 1
+
+    def test_backfill_endpoints(self, client):
+        """Test a backfill is started in the background and its progress can be read."""
+        backfill = get_backfill_service()
+        github = GitHubService()
+        github.client = None
+
+        with patch.object(backfill, "session_factory", AsyncTestingSessionLocal), \
+                patch("app.services.backfill.get_github_service", return_value=github):
+            response = client.post("/api/admin/backfill", params={"repo": "owner/repo", "limit": 5})
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            data = response.json()
+            assert (data["repo"], data["pr_limit"], data["status"]) == ("owner/repo", 5, "collecting")
+
+            # Without GitHub access the run stops at its first step, ready to resume
+            response = client.get(f"/api/admin/backfill/{data['id']}")
+            assert response.json()["error_message"] == "Could not list pull requests: GitHub token not configured"
+
+            response = client.post(f"/api/admin/backfill/{data['id']}/resume")
+            assert response.status_code == status.HTTP_202_ACCEPTED
+
+        assert client.get("/api/admin/backfill/missing").status_code == status.HTTP_404_NOT_FOUND
+
+    def test_github_stats(self, client):
+        """Test GitHub quota and throttling stats are exposed."""
+        response = client.get("/api/admin/github")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["paused_until"] is None
+        assert {"remaining", "reset_at", "throttled", "rejected", "cache_hits"} <= set(data)
@@ -0,0 +1,159 @@
+"""Tests for database engine configuration and session helpers."""
+import asyncio
+import pytest
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from app.models.database import (
+    Base,
+    PRAnalysis,
+    engine_options,
+    make_async_engine,
+    make_async_sessionmaker,
+    make_engine,
+    run_in_session,
+    to_async_url,
+    settings,
+)
+from app.services.job_queue import JobQueue
+from tests.conftest import AsyncTestingSessionLocal
+
+
+class TestEngineConfig:
+    """Test engine URLs and pool options per backend."""
+
+    def test_async_url_for_sqlite(self):
+        """Test SQLite URLs map to aiosqlite."""
+        assert to_async_url("sqlite:///./codeguard.db") == "sqlite+aiosqlite:///./codeguard.db"
+
+    def test_async_url_for_postgres(self):
+        """Test PostgreSQL URLs, with or without a sync driver, map to asyncpg."""
+        assert to_async_url("postgresql://user:secret@db/codeguard") == "postgresql+asyncpg://user:secret@db/codeguard"
+        assert to_async_url("postgresql+psycopg2://user:secret@db/codeguard") == "postgresql+asyncpg://user:secret@db/codeguard"
+
+    def test_async_url_kept(self):
+        """Test URLs that already name an async driver are unchanged."""
+        assert to_async_url("postgresql+asyncpg://db/codeguard") == "postgresql+asyncpg://db/codeguard"
+
+    def test_unsupported_backend(self):
+        """Test an unsupported database is rejected."""
+        with pytest.raises(ValueError):
+            to_async_url("mysql://db/codeguard")
+
+    def test_sqlite_options(self):
+        """Test SQLite gets check_same_thread and no pool sizing."""
+        assert engine_options("sqlite:///./codeguard.db") == {"connect_args": {"check_same_thread": False}}
+
+    def test_postgres_pool_options(self):
+        """Test PostgreSQL gets the configured pool and no SQLite arguments."""
+        options = engine_options("postgresql+asyncpg://db/codeguard")
+        assert "connect_args" not in options
+        assert options["pool_size"] == settings.db_pool_size
+        assert options["max_overflow"] == settings.db_max_overflow
+        assert options["pool_timeout"] == settings.db_pool_timeout
+        assert options["pool_recycle"] == settings.db_pool_recycle
+        assert options["pool_pre_ping"] is True
+
+
+class TestRunInSession:
+    """Test sync ORM code runs on both session types."""
+
+    @staticmethod
+    def _add_analysis(db: Session, repo: str) -> str:
+        analysis = PRAnalysis(repo=repo, pr_number=1)
+        db.add(analysis)
+        db.commit()
+        return analysis.id
+
+    async def test_sync_session(self, db_session):
+        """Test the function is called directly with a sync session."""
+        analysis_id = await run_in_session(db_session, self._add_analysis, "owner/sync")
+        assert db_session.get(PRAnalysis, analysis_id).repo == "owner/sync"
+
+    async def test_async_session(self, db_session):
+        """Test the function gets the async session's sync session."""
+        async with AsyncTestingSessionLocal() as db:
+            analysis_id = await run_in_session(db, self._add_analysis, "owner/async")
+
+        assert db_session.get(PRAnalysis, analysis_id).repo == "owner/async"
+
+
+class TestSQLiteProductionMode:
+    """Test WAL/pragmas and routing writes through the single writer connection."""
+
+    @pytest.fixture
+    async def production_db(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "sqlite_production_mode", True)
+        url = f"sqlite:///{tmp_path / 'production.db'}"
+        Base.metadata.create_all(bind=make_engine(url))
+
+        reader = make_async_engine(url)
+        writer = make_async_engine(url, writer=True)
+        statements = {"reader": [], "writer": []}
+        for name, engine in (("reader", reader), ("writer", writer)):
+            event.listen(
+                engine.sync_engine,
+                "before_cursor_execute",
+                lambda conn, cursor, statement, *args, name=name: statements[name].append(statement),
+            )
+
+        yield make_async_sessionmaker(reader, writer), statements
+        await reader.dispose()
+        await writer.dispose()
+
+    async def test_pragmas(self, production_db):
+        """Test connections use WAL, synchronous=NORMAL, a busy timeout and mmap."""
+        session_factory, _ = production_db
+        async with session_factory() as db:
+            pragma = lambda name: db.scalar(text(f"PRAGMA {name}"))
+            assert await pragma("journal_mode") == "wal"
+            assert await pragma("synchronous") == 1  # NORMAL
+            assert await pragma("busy_timeout") == settings.sqlite_busy_timeout
+            assert await pragma("mmap_size") == settings.sqlite_mmap_size
+
+    async def test_writes_go_to_writer(self, production_db):
+        """Test reads use the pool until the transaction writes, then stay on the writer."""
+        session_factory, statements = production_db
+        async with session_factory() as db:
+            await db.scalar(select(func.count(PRAnalysis.id)))
+            db.add(PRAnalysis(repo="owner/repo", pr_number=1))
+            await db.flush()
+            await db.scalar(select(func.count(PRAnalysis.id)))
+            await db.commit()
+            await db.scalar(select(func.count(PRAnalysis.id)))
+
+        writer = [sql.split()[0] for sql in statements["writer"]]
+        reader = [sql.split()[0] for sql in statements["reader"] if not sql.startswith("PRAGMA")]
+        assert writer == ["BEGIN", "INSERT", "SELECT"]
+        assert reader == ["SELECT", "SELECT"]
+
+    async def test_concurrent_writers(self, production_db):
+        """Test concurrent write transactions queue for the writer instead of failing."""
+        session_factory, _ = production_db
+
+        async def write(pr_number):
+            async with session_factory() as db:
+                db.add(PRAnalysis(repo="owner/repo", pr_number=pr_number))
+                await db.commit()
+
+        await asyncio.gather(*[write(n) for n in range(20)])
+
+        async with session_factory() as db:
+            assert await db.scalar(select(func.count(PRAnalysis.id))) == 20
+
+    async def test_job_queue(self, production_db):
+        """Test a worker claims and completes a job through routed sessions."""
+        session_factory, _ = production_db
+        queue = JobQueue(session_factory=session_factory)
+        async with session_factory() as db:
+            analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+            db.add(analysis)
+            await db.flush()
+            await run_in_session(db, queue.enqueue, analysis)
+
+        async def handler(analysis_id, repo, pr_number, db):
+            pass
+
+        assert await queue.run_next(handler, "worker-0") is True
+        async with session_factory() as db:
+            assert (await run_in_session(db, queue.stats))["done"] == 1
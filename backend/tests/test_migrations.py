@@ -0,0 +1,143 @@
+"""Tests for schema migrations and query plans of hot queries."""
+import re
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+
+from app.models.database import Base, PRAnalysis
+from app.models.migrations import MIGRATIONS, run_migrations
+from app.routers.webhook import find_previous_analysis
+from app.services.job_queue import JobQueue
+from tests.conftest import IS_SQLITE, engine as test_engine
+
+# "SCAN pr_analyses" (or "SCAN TABLE pr_analyses" on older SQLite) without an index
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?\w+( AS \w+)?$")
+
+
+@pytest.fixture
+def legacy_engine():
+    """Database created by the original schema, before any migration."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""
+            CREATE TABLE pr_analyses (
+                id VARCHAR PRIMARY KEY, repo VARCHAR NOT NULL, pr_number INTEGER NOT NULL,
+                pr_title VARCHAR, pr_url VARCHAR, author VARCHAR, analyzed_at DATETIME,
+                status VARCHAR, error_message TEXT, files_changed INTEGER, lines_added INTEGER,
+                lines_removed INTEGER, analysis_time_ms INTEGER, tokens_used INTEGER,
+                critical_count INTEGER, warning_count INTEGER, suggestion_count INTEGER
+            )
+        """)
+        conn.exec_driver_sql("INSERT INTO pr_analyses (id, repo, pr_number, status) VALUES ('a1', 'o/r', 1, 'completed')")
+    Base.metadata.create_all(bind=engine)  # What init_db does first: adds the new tables only
+    yield engine
+    engine.dispose()
+
+
+class TestMigrations:
+    """Test versioned schema migrations."""
+
+    def test_upgrades_legacy_database(self, legacy_engine):
+        """Test missing columns and indexes are added to an existing database."""
+        applied = run_migrations(legacy_engine)
+
+        assert applied == [m.version for m in MIGRATIONS]
+        inspector = inspect(legacy_engine)
+        columns = {column["name"] for column in inspector.get_columns("pr_analyses")}
+        assert {"head_sha", "incremental_from_sha", "github_requests", "review_complete"} <= columns
+        indexes = {index["name"] for index in inspector.get_indexes("pr_analyses")}
+        assert "ix_pr_analyses_repo_pr_number_analyzed_at" in indexes
+        assert "ix_issues_analysis_id" in {index["name"] for index in inspector.get_indexes("issues")}
+
+        with legacy_engine.connect() as conn:
+            assert conn.execute(text("SELECT github_requests FROM pr_analyses")).scalar() == 0
+
+    def test_migrations_run_once(self, legacy_engine):
+        """Test applied versions are recorded and not re-run."""
+        run_migrations(legacy_engine)
+
+        assert run_migrations(legacy_engine) == []
+        with legacy_engine.connect() as conn:
+            versions = conn.execute(text("SELECT version FROM schema_migrations ORDER BY version")).scalars().all()
+        assert versions == [m.version for m in MIGRATIONS]
+
+    def test_fresh_database_just_records_versions(self):
+        """Test a database created from the current models needs no changes."""
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+
+        assert run_migrations(engine) == [m.version for m in MIGRATIONS]
+
+    def test_versions_are_unique_and_ordered(self):
+        """Test migration versions are unique and listed in order."""
+        versions = [m.version for m in MIGRATIONS]
+        assert versions == sorted(set(versions))
+
+
+@pytest.mark.skipif(not IS_SQLITE, reason="Reads SQLite's EXPLAIN QUERY PLAN output")
+class TestQueryPlans:
+    """Fail if a hot query regresses to a full table scan."""
+
+    @pytest.fixture
+    def seeded(self, client, db_session, sample_pr_analysis):
+        for pr_number in range(5):
+            db_session.add(PRAnalysis(repo=f"owner/repo-{pr_number}", pr_number=pr_number, status="completed"))
+        db_session.commit()
+        return sample_pr_analysis
+
+    def _assert_no_full_scans(self, statements):
+        selects = [(sql, params) for sql, params in statements if sql.lstrip().upper().startswith("SELECT")]
+        assert selects, "no queries were captured"
+
+        with test_engine.connect() as conn:
+            for sql, params in selects:
+                plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).all()
+                scans = [row[-1] for row in plan if FULL_SCAN.match(row[-1])]
+                assert not scans, f"Full table scan {scans} in:\n{sql}"
+
+    @pytest.mark.parametrize("url", [
+        "/api/analyses",
+        "/api/analyses?repo=test-owner/test-repo",
+        "/api/analyses?status=completed",
+        "/api/analyses?repo=test-owner/test-repo&status=completed",
+        "/api/analysis/test-analysis-123",
+        "/api/pr/test-owner/test-repo/42",
+        "/api/metrics",
+        "/api/metrics?repo=test-owner/test-repo&days=365",
+        "/api/repos",
+    ])
+    def test_read_endpoints(self, client, seeded, query_log, url):
+        """Test dashboard read endpoints use indexes."""
+        assert client.get(url).status_code == 200
+
+        self._assert_no_full_scans(query_log)
+
+    def test_cursor_pages(self, client, seeded, query_log):
+        """Test keyset pages seek through the (analyzed_at, id) indexes."""
+        for url in ["/api/analyses?limit=2", "/api/analyses?limit=2&repo=owner/repo-1",
+                    "/api/analyses?limit=2&status=completed"]:
+            first = client.get(url, params={"cursor": ""}).json()
+            client.get(url, params={"cursor": first["next_cursor"] or ""})
+
+        self._assert_no_full_scans(query_log)
+
+    def test_feedback(self, client, seeded, query_log):
+        """Test feedback lookups use indexes."""
+        response = client.post("/api/feedback", json={"issue_id": "issue-1", "is_helpful": True})
+        assert response.status_code == 200
+
+        self._assert_no_full_scans(query_log)
+
+    def test_pipeline_queries(self, db_session, session_factory, seeded, query_log):
+        """Test the previous-review lookup and job claiming use indexes."""
+        analysis = PRAnalysis(repo="test-owner/test-repo", pr_number=42)
+        db_session.add(analysis)
+        db_session.flush()
+        queue = JobQueue(session_factory=session_factory)
+        queue.enqueue(db_session, analysis, supersede=True)
+        query_log.clear()
+
+        find_previous_analysis(db_session, analysis)
+        queue.claim(db_session, "worker-0")
+
+        self._assert_no_full_scans(query_log)
@@ -1,11 +1,30 @@
 """Tests for service modules."""
+import asyncio
+import json
+import time
+import anthropic
+from contextlib import contextmanager
+import httpx
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 
-from app.services.analyzer import AnalyzerService
-from app.services.github import GitHubService
-from app.models.schemas import ClaudeAnalysisResult, IssueResponse, Category, Severity
-from datetime import datetime
+from app.services.analyzer import AnalyzerService, settings as analyzer_settings
+from app.services.github import GitHubService, GitHubUnavailable, settings as github_settings
+from app.services.job_queue import JobQueue, DeferJob, settings as job_queue_settings
+from app.services.rate_limit import GitHubRateLimiter, RateLimitExceeded
+from app.services.metrics_rollup import MetricsRollup
+from app.services.response_cache import ResponseCache, get_response_cache
+from app.services.event_bus import AnalysisEventBus, get_event_bus
+from app.services.analysis_cache import AnalysisCache, settings as cache_settings
+from app.services.backfill import BackfillService, claim_run, store_results, settings as backfill_settings
+from app.services.message_batches import MessageBatchClient
+from app.models.database import (
+    PRAnalysis, AnalysisJob, AnalysisCacheEntry, BackfillRun, Issue, MetricsDaily, MetricsDailyIssue, RepoConfig,
+)
+from app.routers.webhook import process_pr_analysis
+from app.models.schemas import ClaudeAnalysisResult, ClaudeIssue, IssueResponse, Category, Severity, FileDiff, PRContext
+from datetime import datetime, timedelta
+from tests.conftest import AsyncTestingSessionLocal
 
 
 class TestAnalyzerService:
@@ -104,6 +123,168 @@ class TestAnalyzerService:
         assert result.issues[0].category == "quality"
 
 
+    async def test_analyze_diff_awaits_async_client(self, slow_claude):
+        """Test analyze_diff awaits the async Claude client."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0)
+
+        result, _, tokens_used = await service.analyze_diff("owner/repo", "PR", "user", "diff")
+
+        assert result.summary == "Looks good"
+        assert tokens_used == 150
+        assert service.client.calls == 1
+
+    async def test_analyze_diff_respects_concurrency_cap(self, slow_claude):
+        """Test no more than anthropic_max_concurrency calls are in flight."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0.05)
+
+        with patch('app.services.analyzer.settings') as mock_settings:
+            mock_settings.anthropic_max_concurrency = 2
+            mock_settings.prompt_cache_min_tokens = 1024
+            await asyncio.gather(*[
+                service.analyze_diff("owner/repo", "PR", "user", "diff")
+                for _ in range(6)
+            ])
+
+        assert service.client.calls == 6
+        assert service.client.max_in_flight == 2
+
+    async def test_analyze_files_fans_out_large_pr(self, slow_claude):
+        """Test a large PR is analyzed in concurrent chunks, not serially."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0.2)
+        files = [
+            FileDiff(filename=f"src/module_{i}.py", patch="@@ -1,1 +1,1 @@\n+" + "x" * 400)
+            for i in range(40)
+        ]
+
+        with patch.object(analyzer_settings, "analysis_chunk_token_budget", 600), \
+                patch.object(analyzer_settings, "analysis_fanout_workers", 8):
+            start = time.perf_counter()
+            result, analysis_time_ms, tokens_used = await service.analyze_files(
+                "owner/repo", "Big PR", "user", files
+            )
+            elapsed = time.perf_counter() - start
+
+        assert service.client.calls == 8
+        assert service.client.max_in_flight == 8
+        assert elapsed < 0.2 * 3  # one round of chunk calls, not eight
+        assert tokens_used == 8 * 150
+        assert result.summary.startswith("Reviewed in 8 parts.")
+
+    async def test_analyze_files_small_pr_single_call(self, slow_claude):
+        """Test a PR that fits the budget is sent as one call."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0)
+        files = [FileDiff(filename="a.py", patch="@@ -1 +1 @@\n+x")]
+
+        result, _, _ = await service.analyze_files("owner/repo", "PR", "user", files)
+
+        assert service.client.calls == 1
+        assert result.summary == "Looks good"
+
+    async def test_analyze_files_reports_skipped_files(self, slow_claude):
+        """Test files over the token budget are not sent and are listed in the summary."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0)
+        files = [
+            FileDiff(filename="src/auth.py", patch="@@ -1 +1 @@\n+" + "x" * 400),
+            FileDiff(filename="docs/guide.md", patch="@@ -1 +1 @@\n+" + "y" * 4000),
+        ]
+        sent = []
+        analyze_diff = service.analyze_diff
+
+        async def record(repo, pr_title, author, diff, *args, **kwargs):
+            sent.append(diff)
+            return await analyze_diff(repo, pr_title, author, diff, *args, **kwargs)
+
+        with patch.object(service, "analyze_diff", record), \
+                patch.object(analyzer_settings, "analysis_token_budget", 500):
+            result, _, _ = await service.analyze_files("owner/repo", "PR", "user", files)
+
+        assert len(sent) == 1
+        assert "src/auth.py" in sent[0] and "docs/guide.md" not in sent[0]
+        assert result.summary == "Looks good Not reviewed (over the review budget): docs/guide.md."
+
+    async def test_analyze_diff_streams_issues(self, slow_claude):
+        """Test with on_issue each finding is passed on while the response is still streaming."""
+        service = AnalyzerService()
+        text = json.dumps({
+            "issues": [
+                {"category": "quality", "severity": "warning", "file_path": "a.py", "title": "First", "message": "m"},
+                {"category": "docs", "severity": "suggestion", "file_path": "a.py", "title": "Second", "message": "m"},
+            ],
+            "summary": "Two findings",
+            "has_tests": True,
+        })
+        service.client = slow_claude(delay=0, text=text, pieces=len(text))
+        received = []
+
+        async def on_issue(issue):
+            received.append((issue.title, service.client.in_flight))
+
+        result, _, tokens_used = await service.analyze_diff("owner/repo", "PR", "user", "diff", on_issue=on_issue)
+
+        assert received == [("First", 1), ("Second", 1)]
+        assert [issue.title for issue in result.issues] == ["First", "Second"]
+        assert result.summary == "Two findings"
+        assert result.has_tests is True
+        assert tokens_used == 150
+
+    async def test_analyze_files_caches_prompt_prefix_across_chunks(self, db_session, slow_claude):
+        """Test chunks of one PR share a cacheable system prompt and cache usage is recorded."""
+        db_session.add(RepoConfig(repo="owner/repo", custom_prompts={"style": "Prefer f-strings. " * 300}))
+        db_session.commit()
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0, usage={"cache_read_input_tokens": 1200, "cache_creation_input_tokens": 0})
+        files = [FileDiff(filename=f"m{i}.py", patch="@@ -1 +1 @@\n+" + "x" * 400) for i in range(2)]
+
+        with patch.object(analyzer_settings, "analysis_cache_enabled", False), \
+                patch.object(analyzer_settings, "analysis_chunk_token_budget", 150):
+            result, _, tokens_used = await service.analyze_files("owner/repo", "PR", "user", files, db=db_session)
+
+        assert service.client.calls == 2
+        for request in service.client.requests:
+            guidance = request["system"][-1]
+            assert guidance["text"].startswith("Repository guidance from the maintainers:")
+            assert guidance["cache_control"] == {"type": "ephemeral"}
+        assert result.cache_read_tokens == 2 * 1200
+        assert result.cache_creation_tokens == 0
+        assert tokens_used == 2 * 150
+
+    async def test_single_call_caches_only_shared_instructions(self, db_session, slow_claude):
+        """Test a one-call PR caches the instructions every review shares, not its repo guidance."""
+        db_session.add(RepoConfig(repo="owner/repo", custom_prompts={"style": "Prefer f-strings. " * 300}))
+        db_session.commit()
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0)
+        files = [FileDiff(filename="a.py", patch="@@ -1 +1 @@\n+a = 1")]
+
+        with patch.object(analyzer_settings, "analysis_cache_enabled", False):
+            await service.analyze_files("owner/repo", "PR", "user", files, db=db_session)
+
+        shared, guidance = service.client.requests[0]["system"]
+        assert shared["cache_control"] == {"type": "ephemeral"}
+        assert "cache_control" not in guidance
+
+    def test_merge_results(self):
+        """Test chunk results are merged into one result."""
+        service = AnalyzerService()
+        issue = ClaudeIssue(category="quality", severity="warning", file_path="a.py", title="t", message="m")
+
+        merged = service._merge_results([
+            ClaudeAnalysisResult(issues=[issue], summary="A is fine.", overall_quality="good"),
+            ClaudeAnalysisResult(issues=[issue], summary="B needs work.", has_tests=True,
+                                 overall_quality="needs_improvement"),
+        ])
+
+        assert len(merged.issues) == 2
+        assert merged.has_tests is True
+        assert merged.overall_quality == "needs_improvement"
+        assert "A is fine." in merged.summary and "B needs work." in merged.summary
+
+
 class TestGitHubService:
     """Test GitHub service."""
 
@@ -114,12 +295,12 @@ class TestGitHubService:
             service = GitHubService()
             assert service.client is None
 
-    def test_get_pr_diff_no_client(self):
+    async def test_get_pr_diff_no_client(self):
         """Test getting PR diff without client returns error."""
         service = GitHubService()
         service.client = None
 
-        diff, info = service.get_pr_diff("owner/repo", 1)
+        diff, info = await service.get_pr_diff("owner/repo", 1)
 
         assert diff == ""
         assert "error" in info
@@ -134,6 +315,15 @@ class TestGitHubService:
         assert "No issues found" in comment
         assert "Great job" in comment
 
+    def test_format_partial_review_comment(self):
+        """Test a review whose output was cut off says so instead of reporting a clean PR."""
+        service = GitHubService()
+
+        comment = service.format_review_comment([], "Could not parse response", complete=False)
+
+        assert "Partial review" in comment
+        assert "Great job" not in comment
+
     def test_format_review_comment_with_issues(self):
         """Test formatting review comment with issues."""
         service = GitHubService()
@@ -196,11 +386,1707 @@ class TestGitHubService:
         assert "SQL Injection" in formatted
         assert "Use parameterized queries" in formatted
 
-    def test_post_review_comment_no_client(self):
+    async def test_post_review_comment_no_client(self):
         """Test posting comment without client returns None."""
         service = GitHubService()
         service.client = None
 
-        result = service.post_review_comment("owner/repo", 1, "Test comment")
+        result = await service.post_review_comment("owner/repo", 1, "Test comment")
 
         assert result is None
+
+    async def test_get_pr_files_follows_pagination(self, github_api):
+        """Test PR files are fetched across every page."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        files, info = await service.get_pr_files("owner/repo", 7)
+
+        assert [file.filename for file in files] == ["a.py", "b.py", "c.py"]
+        assert files[0].patch == "@@ -1 +1 @@\n+a"
+        assert info["title"] == "Add feature"
+        assert info["head_sha"] == "head-sha"
+        assert github_api.paths == [
+            "/repos/owner/repo/pulls/7",
+            "/repos/owner/repo/pulls/7/files",
+            "/repos/owner/repo/pulls/7/files",
+        ]
+
+    async def test_get_pr_diff_renders_files(self, github_api):
+        """Test the concatenated diff is rendered from the file list."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        diff, _ = await service.get_pr_diff("owner/repo", 7)
+
+        assert "--- a.py\n+++ a.py\n@@ -1 +1 @@\n+a" in diff
+        assert "--- c.py" in diff
+
+    async def test_list_pull_numbers(self, github_api):
+        """Test PRs are listed newest first, up to the limit."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        assert await service.list_pull_numbers("owner/repo", 10) == ([8, 7], None)
+        assert await service.list_pull_numbers("owner/repo", 1) == ([8], None)
+        numbers, error = await service.list_pull_numbers("owner/missing", 10)
+        assert numbers == [] and "Not Found" in error
+
+    async def test_get_compare_files(self, github_api):
+        """Test compare returns the delta files and status."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        files, info = await service.get_compare_files("owner/repo", "old", "new")
+
+        assert info == {"status": "ahead"}
+        assert [file.filename for file in files] == ["b.py"]
+
+    async def test_api_error_returns_error_info(self, github_api):
+        """Test error responses are reported instead of raised."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        files, info = await service.get_pr_files("owner/missing", 1)
+
+        assert files == []
+        assert "Not Found" in info["error"]
+
+    async def test_get_pr_context(self, github_api):
+        """Test the PR context carries metadata, head commit and files."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        context, error = await service.get_pr_context("owner/repo", 7)
+
+        assert error is None
+        assert context.head_sha == "head-sha"
+        assert context.base_sha == "base-sha"
+        assert [file.filename for file in context.files] == ["a.py", "b.py", "c.py"]
+
+    async def test_get_pr_context_errors(self, github_api):
+        """Test a missing PR is reported as an error while a GitHub 5xx raises for a retry."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        context, error = await service.get_pr_context("owner/repo", 8)
+        assert context is None
+        assert error.startswith("404")
+
+        with pytest.raises(GitHubUnavailable, match="502"):
+            await service.get_pr_context("owner/repo", 9)
+
+    async def test_track_requests_counts_per_run(self, github_api):
+        """Test request counting is scoped to the tracking block."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        with service.track_requests() as first:
+            await service.get_pr_context("owner/repo", 7)
+        with service.track_requests() as second:
+            await service.get_pr_context("owner/repo", 7)
+            await service.post_review_comment("owner/repo", 7, "body")
+        await service.get_pr_context("owner/repo", 7)
+
+        assert first.requests == 3
+        assert second.requests == 4
+        assert second.not_modified == 3
+
+    async def test_repeat_reads_use_conditional_requests(self, github_api):
+        """Test a re-analysis revalidates cached responses and gets 304s."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        first, _ = await service.get_pr_files("owner/repo", 7)
+        second, info = await service.get_pr_files("owner/repo", 7)
+
+        assert [file.filename for file in second] == [file.filename for file in first]
+        assert info["head_sha"] == "head-sha"
+        assert github_api.not_modified == 3  # PR + both pages of files
+        assert service.cache_hits == 3
+
+    async def test_etag_cache_is_lru_bounded(self, github_api):
+        """Test the response cache evicts the least recently used URLs."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        with patch('app.services.github.settings') as mock_settings:
+            mock_settings.github_cache_max_entries = 2
+            await service.get_pr_files("owner/repo", 7)
+
+        assert len(service._etag_cache) == 2
+        assert all("/files" in url for url in service._etag_cache)
+
+    async def test_etag_cache_persists(self, github_api, tmp_path):
+        """Test the response cache can be saved and reloaded."""
+        path = str(tmp_path / "github-cache.json")
+        with patch.object(github_settings, "github_cache_path", path):
+            service = GitHubService()
+            service.client = github_api.client()
+            await service.get_pr_files("owner/repo", 7)
+            await service.close()
+
+            reloaded = GitHubService()
+            reloaded.client = github_api.client()
+            await reloaded.get_pr_files("owner/repo", 7)
+
+        assert reloaded.cache_hits == 3
+
+    async def test_post_review_comment(self, github_api):
+        """Test a review is created with body, event and commit."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        review_id = await service.post_review_comment("owner/repo", 7, "Looks good", commit_sha="head-sha")
+
+        assert review_id == "99"
+        assert github_api.posted == [(
+            "/repos/owner/repo/pulls/7/reviews",
+            {"body": "Looks good", "event": "COMMENT", "commit_id": "head-sha"},
+        )]
+
+    async def test_post_review_with_inline_comments(self, github_api):
+        """Test the summary and inline comments are published in one request."""
+        service = GitHubService()
+        service.client = github_api.client()
+        comments = [{"path": "a.py", "line": 1, "side": "RIGHT", "body": "Fix this"}]
+
+        review_id = await service.post_review_comment(
+            "owner/repo", 7, "Summary", commit_sha="head-sha", comments=comments
+        )
+
+        assert review_id == "99"
+        assert len(github_api.posted) == 1
+        assert github_api.posted[0][1]["comments"] == comments
+
+    async def test_rejected_inline_comments_fall_back_to_summary(self, github_api):
+        """Test a 422 for the inline comments still publishes the summary."""
+        service = GitHubService()
+        service.client = github_api.client()
+        github_api.reject_comments = True
+
+        review_id = await service.post_review_comment(
+            "owner/repo", 7, "Summary", commit_sha="head-sha",
+            comments=[{"path": "a.py", "line": 500, "side": "RIGHT", "body": "Stale"}],
+        )
+
+        assert review_id == "99"
+        assert len(github_api.posted) == 2
+        assert "comments" not in github_api.posted[1][1]
+
+    def test_build_inline_comments_ranks_and_limits(self):
+        """Test inline comments go to the most severe issues on diff lines only."""
+        service = GitHubService()
+        files = [FileDiff(filename="a.py", patch="@@ -1,2 +1,4 @@\n x\n+y\n+z\n w")]
+
+        def issue(severity, line, file_path="a.py"):
+            return IssueResponse(
+                id=f"{severity}-{line}", category=Category.quality, severity=severity,
+                file_path=file_path, line_number=line, title=f"{severity} issue",
+                message="Message", created_at=datetime.utcnow(),
+            )
+
+        issues = [
+            issue(Severity.suggestion, 1),
+            issue(Severity.warning, 3),
+            issue(Severity.critical, 2),
+            issue(Severity.critical, 40),  # Outside the diff
+            issue(Severity.critical, 2, file_path="other.py"),  # File not in the diff
+        ]
+
+        comments = service.build_inline_comments(issues, files, limit=2)
+
+        assert [(c["path"], c["line"]) for c in comments] == [("a.py", 2), ("a.py", 3)]
+        assert comments[0]["side"] == "RIGHT"
+        assert "critical issue" in comments[0]["body"]
+
+    async def test_post_inline_comment(self, github_api):
+        """Test an inline comment targets the given file, line and commit."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        comment_id = await service.post_inline_comment("owner/repo", 7, "Fix this", "a.py", 1, "head-sha")
+
+        assert comment_id == "101"
+        path, payload = github_api.posted[0]
+        assert path == "/repos/owner/repo/pulls/7/comments"
+        assert payload["path"] == "a.py" and payload["line"] == 1 and payload["commit_id"] == "head-sha"
+
+
+class TestGitHubRateLimiter:
+    """Test the shared GitHub request scheduler."""
+
+    def _response(self, status_code=200, **headers):
+        return httpx.Response(status_code, headers=headers)
+
+    def test_update_reads_quota_headers(self):
+        """Test quota headers are recorded and slow the refill rate near exhaustion."""
+        limiter = GitHubRateLimiter(rate=10, burst=5)
+        reset = time.time() + 100
+
+        limited = limiter.update(self._response(**{
+            "X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "50",
+            "X-RateLimit-Used": "4950", "X-RateLimit-Reset": str(int(reset)),
+        }))
+
+        assert limited is False
+        assert limiter.remaining == 50
+        assert limiter.used == 4950
+        assert limiter.current_rate() < 1
+
+    def test_exhausted_quota_pauses_until_reset(self):
+        """Test a 403 with no remaining quota pauses until the reset time."""
+        limiter = GitHubRateLimiter()
+        reset = int(time.time()) + 600
+
+        limited = limiter.update(self._response(403, **{
+            "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset),
+        }))
+
+        assert limited is True
+        assert limiter.paused_until == reset
+        assert limiter.stats()["paused_until"] is not None
+
+    def test_forbidden_without_rate_limit_is_not_limited(self):
+        """Test an ordinary 403 is left to the caller."""
+        limiter = GitHubRateLimiter()
+        assert limiter.update(self._response(403, **{"X-RateLimit-Remaining": "4000"})) is False
+
+    async def test_acquire_throttles_bursts(self):
+        """Test requests beyond the burst wait for the bucket to refill."""
+        limiter = GitHubRateLimiter(rate=50, burst=2)
+
+        start = time.monotonic()
+        for _ in range(4):
+            await limiter.acquire()
+
+        assert limiter.throttled >= 1
+        assert time.monotonic() - start >= 0.02
+
+    async def test_acquire_waits_out_short_pause(self):
+        """Test a short Retry-After is slept through."""
+        limiter = GitHubRateLimiter()
+        limiter.update(self._response(429, **{"Retry-After": "0.05"}))
+
+        await limiter.acquire()
+
+        assert limiter.throttled == 1
+
+    async def test_acquire_rejects_long_pause(self):
+        """Test a pause longer than the max wait raises instead of blocking a worker."""
+        limiter = GitHubRateLimiter()
+        limiter.update(self._response(429, **{"Retry-After": "3600"}))
+
+        with pytest.raises(RateLimitExceeded) as exc:
+            await limiter.acquire()
+
+        assert exc.value.retry_at > time.time() + 3000
+        assert limiter.rejected == 1
+
+    async def test_service_raises_on_rate_limit(self, github_api):
+        """Test a rate-limited PR fetch raises rather than reporting a PR error."""
+        service = GitHubService()
+        service.client = github_api.client()
+
+        with pytest.raises(RateLimitExceeded):
+            await service.get_pr_context("owner/limited", 1)
+
+        # Later requests wait for the pause without hitting the API
+        with pytest.raises(RateLimitExceeded):
+            await service.get_pr_context("owner/repo", 7)
+        assert github_api.paths == ["/repos/owner/limited/pulls/1"]
+
+    async def test_service_tracks_quota(self, github_api):
+        """Test quota headers from every response reach the limiter."""
+        service = GitHubService()
+        service.client = github_api.client()
+        github_api.headers = {"X-RateLimit-Remaining": "4321", "X-RateLimit-Limit": "5000"}
+
+        await service.get_pr_context("owner/repo", 7)
+
+        assert service.rate_limiter.remaining == 4321
+
+
+class TestJobQueue:
+    """Test the durable analysis job queue."""
+
+    def _enqueue(self, db_session, queue):
+        analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+        db_session.add(analysis)
+        db_session.flush()
+        return analysis, queue.enqueue(db_session, analysis)
+
+    def test_enqueue_persists_job_with_analysis(self, db_session):
+        """Test enqueue commits the job and the analysis together."""
+        queue = JobQueue()
+        analysis, job = self._enqueue(db_session, queue)
+
+        db_session.rollback()
+        assert db_session.query(PRAnalysis).count() == 1
+        stored = db_session.query(AnalysisJob).one()
+        assert stored.analysis_id == analysis.id
+        assert stored.status == "queued"
+
+    def test_claim_leases_job_once(self, db_session):
+        """Test a claimed job is invisible to other workers."""
+        queue = JobQueue()
+        _, job = self._enqueue(db_session, queue)
+
+        claimed = queue.claim(db_session, "worker-0")
+        assert claimed.id == job.id
+        assert claimed.status == "running"
+        assert claimed.attempts == 1
+        assert claimed.leased_until > datetime.utcnow()
+
+        assert queue.claim(db_session, "worker-1") is None
+
+    def test_expired_lease_is_reclaimed(self, db_session):
+        """Test a job whose worker died is picked up after its visibility timeout."""
+        queue = JobQueue()
+        _, job = self._enqueue(db_session, queue)
+        claimed = queue.claim(db_session, "worker-0")
+        claimed.leased_until = datetime.utcnow() - timedelta(seconds=1)
+        db_session.commit()
+
+        reclaimed = queue.claim(db_session, "worker-1")
+        assert reclaimed.id == job.id
+        assert reclaimed.worker_id == "worker-1"
+        assert reclaimed.attempts == 2
+
+    def test_expired_lease_on_last_attempt_fails(self, db_session):
+        """Test a job that keeps taking its worker down is given up on, not retried forever."""
+        queue = JobQueue()
+        analysis, job = self._enqueue(db_session, queue)
+        job.max_attempts = 1
+        db_session.commit()
+        claimed = queue.claim(db_session, "worker-0")
+        claimed.leased_until = datetime.utcnow() - timedelta(seconds=1)
+        db_session.commit()
+
+        assert queue.claim(db_session, "worker-1") is None
+
+        db_session.expire_all()
+        assert job.status == "failed"
+        assert job.finished_at is not None
+        assert analysis.status == "failed"
+        assert "last attempt" in analysis.error_message
+
+    async def test_lease_renewed_while_job_runs(self, db_session, any_session_factory):
+        """Test a job running past its visibility timeout is not claimed by a second worker."""
+        queue = JobQueue(session_factory=any_session_factory)
+        self._enqueue(db_session, queue)
+        claims = []
+
+        async def handler(analysis_id, repo, pr_number, db):
+            await asyncio.sleep(0.5)
+            db_session.expire_all()
+            claims.append(queue.claim(db_session, "worker-1"))
+
+        with patch.object(job_queue_settings, "job_visibility_timeout", 0.3):
+            await queue.run_next(handler, "worker-0")
+
+        assert claims == [None]
+        db_session.expire_all()
+        job = db_session.query(AnalysisJob).one()
+        assert (job.status, job.attempts) == ("done", 1)
+
+    def test_fail_schedules_retry_then_gives_up(self, db_session):
+        """Test failures are retried with backoff until max_attempts."""
+        queue = JobQueue()
+        analysis, job = self._enqueue(db_session, queue)
+        job.max_attempts = 2
+        db_session.commit()
+
+        queue.fail(db_session, queue.claim(db_session, "w"), "boom")
+        assert job.status == "queued"
+        assert job.available_at > datetime.utcnow()
+        assert analysis.status == "pending"
+
+        job.available_at = datetime.utcnow()
+        db_session.commit()
+        queue.fail(db_session, queue.claim(db_session, "w"), "boom again")
+        assert job.status == "failed"
+        assert analysis.status == "failed"
+        assert analysis.error_message == "boom again"
+
+    async def test_run_next_runs_handler_and_completes(self, db_session, any_session_factory):
+        """Test a worker runs the handler in its own session and marks the job done."""
+        queue = JobQueue(session_factory=any_session_factory)
+        analysis, job = self._enqueue(db_session, queue)
+        calls = []
+
+        async def handler(analysis_id, repo, pr_number, db):
+            calls.append((analysis_id, repo, pr_number))
+
+        assert await queue.run_next(handler, "worker-0") is True
+        assert calls == [(analysis.id, "owner/repo", 1)]
+
+        db_session.expire_all()
+        assert db_session.query(AnalysisJob).one().status == "done"
+        assert await queue.run_next(handler, "worker-0") is False
+
+    async def test_run_next_retries_on_error(self, db_session, any_session_factory):
+        """Test a handler exception requeues the job instead of losing it."""
+        queue = JobQueue(session_factory=any_session_factory)
+        self._enqueue(db_session, queue)
+
+        async def handler(analysis_id, repo, pr_number, db):
+            raise RuntimeError("GitHub unavailable")
+
+        await queue.run_next(handler, "worker-0")
+
+        db_session.expire_all()
+        job = db_session.query(AnalysisJob).one()
+        assert job.status == "queued"
+        assert job.last_error == "GitHub unavailable"
+
+    async def test_deferred_job_keeps_its_attempt(self, db_session, any_session_factory):
+        """Test a deferred job is requeued for later and pauses the queue."""
+        queue = JobQueue(session_factory=any_session_factory)
+        analysis, _ = self._enqueue(db_session, queue)
+        retry_at = datetime.utcnow() + timedelta(minutes=10)
+
+        async def handler(analysis_id, repo, pr_number, db):
+            raise DeferJob(retry_at, reason="GitHub rate limit exceeded", pause_queue=True)
+
+        assert await queue.run_next(handler, "worker-0") is True
+
+        db_session.expire_all()
+        job = db_session.query(AnalysisJob).one()
+        assert job.status == "queued"
+        assert job.attempts == 0
+        assert job.available_at == retry_at
+        assert db_session.get(PRAnalysis, analysis.id).status == "pending"
+        assert queue.stats(db_session)["paused_until"] == retry_at
+        assert await queue.run_next(handler, "worker-0") is False
+
+    def test_enqueue_delay_debounces(self, db_session):
+        """Test a delayed job is not claimable during the quiet window."""
+        queue = JobQueue()
+        analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+        db_session.add(analysis)
+        db_session.flush()
+        queue.enqueue(db_session, analysis, delay=60)
+
+        assert queue.claim(db_session, "worker-0") is None
+
+    def test_supersede_queued_job(self, db_session):
+        """Test a newer push supersedes the queued job for the same PR."""
+        queue = JobQueue()
+        old_analysis, old_job = self._enqueue(db_session, queue)
+        other = PRAnalysis(repo="owner/repo", pr_number=2)
+        db_session.add(other)
+        db_session.flush()
+        queue.enqueue(db_session, other)
+
+        new_analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+        db_session.add(new_analysis)
+        db_session.flush()
+        queue.enqueue(db_session, new_analysis, supersede=True)
+
+        db_session.expire_all()
+        assert old_job.status == "superseded"
+        assert old_analysis.status == "superseded"
+        statuses = {job.analysis_id: job.status for job in db_session.query(AnalysisJob).all()}
+        assert statuses[other.id] == "queued"
+        assert statuses[new_analysis.id] == "queued"
+
+    async def test_enqueue_publishes_status(self, db_session):
+        """Test enqueueing publishes the new analysis and the ones it superseded."""
+        queue = JobQueue()
+        old_analysis, _ = self._enqueue(db_session, queue)
+        events = get_event_bus().subscribe()
+        new_analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+        db_session.add(new_analysis)
+        db_session.flush()
+
+        try:
+            queue.enqueue(db_session, new_analysis, supersede=True)
+        finally:
+            get_event_bus().unsubscribe(events)
+
+        published = [events.get_nowait()[1] for _ in range(events.qsize())]
+        assert [(data["analysis_id"], data["status"]) for data in published] == [
+            (new_analysis.id, "pending"),
+            (old_analysis.id, "superseded"),
+        ]
+
+    async def test_supersede_cancels_in_flight_job(self, db_session, any_session_factory):
+        """Test a newer push cancels the running analysis of the same PR."""
+        queue = JobQueue(session_factory=any_session_factory)
+        old_analysis, old_job = self._enqueue(db_session, queue)
+        started = asyncio.Event()
+        cancelled = []
+
+        async def handler(analysis_id, repo, pr_number, db):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(analysis_id)
+                raise
+
+        worker = asyncio.create_task(queue.run_next(handler, "worker-0"))
+        await started.wait()
+
+        new_analysis = PRAnalysis(repo="owner/repo", pr_number=1)
+        db_session.add(new_analysis)
+        db_session.flush()
+        queue.enqueue(db_session, new_analysis, supersede=True)
+
+        assert await asyncio.wait_for(worker, timeout=1) is True
+        assert cancelled == [old_analysis.id]
+        db_session.expire_all()
+        assert old_job.status == "superseded"
+        assert old_analysis.status == "superseded"
+
+    def test_stats(self, db_session):
+        """Test queue stats report depth and job age."""
+        queue = JobQueue()
+        self._enqueue(db_session, queue)
+        self._enqueue(db_session, queue)
+        queue.claim(db_session, "worker-0")
+
+        stats = queue.stats(db_session)
+        assert stats["queued"] == 1
+        assert stats["running"] == 1
+        assert stats["oldest_queued_age_seconds"] >= 0
+        assert stats["oldest_running_age_seconds"] >= 0
+
+
+class TestMetricsRollup:
+    """Test the daily metrics rollup."""
+
+    def _analysis(self, db_session, repo="owner/repo", days_ago=0, issues=(("security", "critical", "Leak"),)):
+        analysis = PRAnalysis(
+            repo=repo, pr_number=1, status="completed", tokens_used=100, analysis_time_ms=50,
+            analyzed_at=datetime.utcnow() - timedelta(days=days_ago),
+        )
+        db_session.add(analysis)
+        db_session.flush()
+        rows = [
+            Issue(analysis_id=analysis.id, category=category, severity=severity,
+                  file_path="a.py", title=title, message="m")
+            for category, severity, title in issues
+        ]
+        db_session.add_all(rows)
+        return analysis, rows
+
+    def _snapshot(self, db_session):
+        days = {
+            (row.repo, row.date): (row.prs_analyzed, row.issues_found, row.critical_count,
+                                   row.warning_count, row.security_count, row.quality_count,
+                                   row.tokens_used, row.analysis_time_ms)
+            for row in db_session.query(MetricsDaily).all()
+        }
+        titles = {
+            (row.repo, row.date, row.title, row.category, row.severity): row.count
+            for row in db_session.query(MetricsDailyIssue).all()
+        }
+        return days, titles
+
+    def test_record_analysis_accumulates(self, db_session):
+        """Test completed analyses add to their repo and day's rollup."""
+        rollup = MetricsRollup()
+        for issues in [
+            [("security", "critical", "Leak")],
+            [("security", "critical", "Leak"), ("quality", "warning", "Naming")],
+        ]:
+            analysis, rows = self._analysis(db_session, issues=issues)
+            rollup.record_analysis(db_session, analysis, rows)
+        db_session.commit()
+
+        day = db_session.query(MetricsDaily).one()
+        assert day.date == datetime.utcnow().date()
+        assert (day.prs_analyzed, day.issues_found) == (2, 3)
+        assert (day.critical_count, day.warning_count, day.suggestion_count) == (2, 1, 0)
+        assert (day.security_count, day.quality_count) == (2, 1)
+        assert day.tokens_used == 200
+        titles = {row.title: row.count for row in db_session.query(MetricsDailyIssue).all()}
+        assert titles == {"Leak": 2, "Naming": 1}
+
+    def test_completion_recorded_once(self, db_session):
+        """Test completing an analysis again doesn't count it twice."""
+        rollup = MetricsRollup()
+        analysis, rows = self._analysis(db_session)
+        analysis.status = "processing"
+        db_session.commit()
+
+        assert rollup.record_completion(db_session, analysis, rows) is True
+        db_session.commit()
+        assert rollup.record_completion(db_session, analysis, rows) is False
+        db_session.commit()
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        day = db_session.query(MetricsDaily).one()
+        assert (day.prs_analyzed, day.issues_found) == (1, 1)
+
+    def test_superseded_analysis_not_completed(self, db_session):
+        """Test an analysis superseded while it ran is neither completed nor counted."""
+        rollup = MetricsRollup()
+        analysis, rows = self._analysis(db_session)
+        analysis.status = "superseded"
+        db_session.commit()
+
+        assert rollup.record_completion(db_session, analysis, rows) is False
+        db_session.commit()
+
+        db_session.refresh(analysis)
+        assert analysis.status == "superseded"
+        assert db_session.query(MetricsDaily).count() == 0
+
+    def test_rebuild_matches_incremental_updates(self, db_session):
+        """Test a rebuild from the analyses table reproduces the live rollup."""
+        rollup = MetricsRollup()
+        for repo, days_ago in [("owner/repo", 0), ("owner/repo", 3), ("other/repo", 0)]:
+            analysis, rows = self._analysis(
+                db_session, repo=repo, days_ago=days_ago,
+                issues=[("security", "critical", "Leak"), ("quality", "warning", "Naming")],
+            )
+            rollup.record_analysis(db_session, analysis, rows)
+        db_session.add(PRAnalysis(repo="owner/repo", pr_number=2, status="failed"))
+        db_session.commit()
+        live = self._snapshot(db_session)
+
+        assert rollup.rebuild(db_session) == 3
+        assert self._snapshot(db_session) == live
+
+    def test_rebuild_single_repo(self, db_session):
+        """Test rebuilding one repo leaves other repos' rollups alone."""
+        rollup = MetricsRollup()
+        self._analysis(db_session, repo="owner/repo")
+        other, rows = self._analysis(db_session, repo="other/repo")
+        rollup.record_analysis(db_session, other, rows)
+        db_session.commit()
+
+        rollup.rebuild(db_session, repo="owner/repo")
+
+        assert sorted(row.repo for row in db_session.query(MetricsDaily).all()) == ["other/repo", "owner/repo"]
+
+    def test_ensure_built_only_when_empty(self, db_session):
+        """Test the rollup is built on first start after an upgrade, and only then."""
+        rollup = MetricsRollup()
+        assert rollup.ensure_built(db_session) is False
+
+        self._analysis(db_session)
+        db_session.commit()
+        assert rollup.ensure_built(db_session) is True
+        assert db_session.query(MetricsDaily).count() == 1
+        assert rollup.ensure_built(db_session) is False
+
+    def test_rebuild_metrics_cli(self, db_session, session_factory, capsys):
+        """Test the rebuild-metrics command rebuilds the rollup."""
+        from app import cli
+
+        self._analysis(db_session)
+        db_session.commit()
+
+        with patch.object(cli, "SessionLocal", session_factory), patch.object(cli, "init_db"):
+            cli.main(["rebuild-metrics"])
+
+        assert "1 day(s)" in capsys.readouterr().out
+        assert db_session.query(MetricsDaily).count() == 1
+
+
+class TestResponseCache:
+    """Test the dashboard response cache."""
+
+    def test_get_and_set(self):
+        """Test cached values are returned and counted."""
+        cache = ResponseCache(ttl=60, max_entries=10)
+
+        assert cache.get("k") is None
+        cache.set("k", {"value": 1})
+
+        assert cache.get("k") == {"value": 1}
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_entries_expire(self):
+        """Test entries are dropped after their TTL."""
+        cache = ResponseCache(ttl=0.01, max_entries=10)
+        cache.set("k", 1)
+
+        time.sleep(0.02)
+
+        assert cache.get("k") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_lru_bound(self):
+        """Test the least recently used entry is evicted beyond the size limit."""
+        cache = ResponseCache(ttl=60, max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_invalidate_repo(self):
+        """Test a write drops that repo's entries and all-repo entries only."""
+        cache = ResponseCache(ttl=60, max_entries=10)
+        cache.set("metrics-a", 1, repo="owner/a")
+        cache.set("metrics-b", 2, repo="owner/b")
+        cache.set("metrics-all", 3)
+
+        cache.invalidate("owner/a")
+
+        assert cache.get("metrics-a") is None
+        assert cache.get("metrics-all") is None
+        assert cache.get("metrics-b") == 2
+
+    def test_disabled(self):
+        """Test a zero size or TTL disables caching."""
+        cache = ResponseCache(ttl=60, max_entries=0)
+        cache.set("k", 1)
+        assert cache.get("k") is None
+
+
+class TestAnalysisEventBus:
+    """Test the in-process analysis event bus."""
+
+    async def test_publish_to_analysis_subscribers(self):
+        """Test events reach the analysis' subscribers only; status changes also reach ALL."""
+        bus = AnalysisEventBus(queue_size=10)
+        watcher = bus.subscribe("a-1")
+        other = bus.subscribe("a-2")
+        everything = bus.subscribe()
+
+        bus.publish("a-1", "issue", {"id": "issue-1"})
+        bus.publish_status("a-1", "completed")
+
+        assert [watcher.get_nowait()[0] for _ in range(watcher.qsize())] == ["issue", "status"]
+        assert other.empty()
+        assert everything.get_nowait() == (
+            "status", {"analysis_id": "a-1", "status": "completed", "error_message": None}
+        )
+        assert everything.empty()
+
+    async def test_slow_subscriber_resyncs(self):
+        """Test a full queue is replaced by a single resync event."""
+        bus = AnalysisEventBus(queue_size=2)
+        queue = bus.subscribe("a-1")
+
+        for n in range(3):
+            bus.publish("a-1", "issue", {"id": f"issue-{n}"})
+
+        assert queue.get_nowait() == ("resync", None)
+        assert queue.empty()
+        assert bus.stats()["resyncs"] == 1
+
+    async def test_unsubscribe(self):
+        """Test unsubscribed queues get nothing and are not counted."""
+        bus = AnalysisEventBus(queue_size=10)
+        queue = bus.subscribe("a-1")
+        bus.unsubscribe(queue, "a-1")
+
+        bus.publish("a-1", "issue", {"id": "issue-1"})
+
+        assert queue.empty()
+        assert bus.stats()["subscribers"] == 0
+
+
+class TestAnalysisCache:
+    """Test the per-file analysis cache."""
+
+    ISSUE_TEXT = """{"issues": [{"category": "security", "severity": "critical", "file_path": "a.py",
+        "line_number": 1, "title": "Secret", "message": "Hardcoded secret"}], "summary": "1 issue"}"""
+
+    def _files(self, b_patch="@@ -1 +1 @@\n+b = 2"):
+        return [
+            FileDiff(filename="a.py", patch="@@ -1 +1 @@\n+TOKEN = 'abc'"),
+            FileDiff(filename="b.py", patch=b_patch),
+        ]
+
+    def test_store_and_lookup(self, db_session):
+        """Test stored issues are returned for an identical patch."""
+        cache = AnalysisCache()
+        files = self._files()
+        issue = ClaudeIssue(category="security", severity="critical", file_path="a.py", title="t", message="m")
+
+        cache.store(db_session, files, [issue], tokens_used=100)
+        hits = cache.lookup(db_session, files)
+
+        assert hits["a.py"][0].title == "t"
+        assert hits["b.py"] == []
+        assert cache.hits == 2
+        assert 0 < cache.tokens_saved <= 100
+
+    def test_store_matches_prefixed_paths(self, db_session):
+        """Test issues reported with a "./" or git "a/" prefix are cached under their file."""
+        cache = AnalysisCache()
+        files = self._files()
+        issues = [
+            ClaudeIssue(category="security", severity="critical", file_path="./a.py", title="t", message="m"),
+            ClaudeIssue(category="quality", severity="warning", file_path="b/b.py", title="u", message="m"),
+        ]
+
+        cache.store(db_session, files, issues, tokens_used=100)
+        hits = cache.lookup(db_session, files)
+
+        assert [issue.title for issue in hits["a.py"]] == ["t"]
+        assert [issue.title for issue in hits["b.py"]] == ["u"]
+
+    def test_unmatched_issue_prevents_caching(self, db_session):
+        """Test a call with an issue on no file of the call caches nothing rather than a clean file."""
+        cache = AnalysisCache()
+        issue = ClaudeIssue(category="security", severity="critical", file_path="unknown", title="t", message="m")
+
+        cache.store(db_session, self._files(), [issue], tokens_used=100)
+
+        assert db_session.query(AnalysisCacheEntry).count() == 0
+
+    def test_changed_patch_misses(self, db_session):
+        """Test a changed patch is a cache miss."""
+        cache = AnalysisCache()
+        cache.store(db_session, self._files(), [], tokens_used=100)
+
+        hits = cache.lookup(db_session, self._files(b_patch="@@ -1 +1 @@\n+b = 3"))
+
+        assert set(hits) == {"a.py"}
+        assert cache.misses == 1
+
+    def test_key_includes_model(self, db_session):
+        """Test entries from another model are not reused."""
+        cache = AnalysisCache()
+        cache.store(db_session, self._files(), [], tokens_used=100)
+
+        with patch.object(cache_settings, "anthropic_model", "another-model"):
+            assert cache.lookup(db_session, self._files()) == {}
+
+    def test_key_includes_repo_guidance(self, db_session):
+        """Test entries reviewed under different repo guidance are not reused."""
+        cache = AnalysisCache()
+        cache.store(db_session, self._files(), [], tokens_used=100, variant="guidance A")
+
+        assert cache.lookup(db_session, self._files(), "guidance B") == {}
+        assert cache.lookup(db_session, self._files()) == {}
+        assert set(cache.lookup(db_session, self._files(), "guidance A")) == {"a.py", "b.py"}
+
+    async def test_unparseable_response_not_cached(self, db_session, slow_claude):
+        """Test files whose review couldn't be parsed are reviewed again next time."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0, text="Sorry, I can't review this.")
+
+        first, _, _ = await service.analyze_files("owner/repo", "PR", "user", self._files(), db=db_session)
+        service.client.text = self.ISSUE_TEXT
+        second, _, _ = await service.analyze_files("owner/repo", "PR", "user", self._files(), db=db_session)
+
+        assert first.complete is False
+        assert service.client.calls == 2
+        assert db_session.query(AnalysisCacheEntry).count() == 2
+        assert [issue.title for issue in second.issues] == ["Secret"]
+
+    async def test_truncated_response_not_cached(self, db_session, slow_claude):
+        """Test a response cut off at max_tokens is not cached."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0, text=self.ISSUE_TEXT, stop_reason="max_tokens")
+
+        result, _, _ = await service.analyze_files("owner/repo", "PR", "user", self._files(), db=db_session)
+
+        assert result.complete is False
+        assert db_session.query(AnalysisCacheEntry).count() == 0
+
+    def test_evict_by_age_and_size(self, db_session):
+        """Test eviction removes expired and least recently used entries."""
+        cache = AnalysisCache()
+        files = [FileDiff(filename=f"f{i}.py", patch=f"+{i}") for i in range(5)]
+        cache.store(db_session, files, [], tokens_used=50)
+        entries = db_session.query(AnalysisCacheEntry).order_by(AnalysisCacheEntry.file_path).all()
+        entries[0].last_used_at = datetime.utcnow() - timedelta(days=400)
+        entries[1].last_used_at = datetime.utcnow() - timedelta(days=2)
+        db_session.commit()
+
+        with patch.object(cache_settings, "analysis_cache_max_entries", 3):
+            removed = cache.evict(db_session)
+
+        assert removed == 2
+        remaining = {entry.file_path for entry in db_session.query(AnalysisCacheEntry).all()}
+        assert remaining == {"f2.py", "f3.py", "f4.py"}
+
+    async def test_analyze_files_reuses_unchanged_files(self, db_session, slow_claude):
+        """Test a re-push only sends changed files to Claude."""
+        service = AnalyzerService()
+        service.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        first, _, _ = await service.analyze_files("owner/repo", "PR", "user", self._files(), db=db_session)
+        service.client.text = '{"issues": [], "summary": "b.py looks fine"}'
+        second, _, second_tokens = await service.analyze_files(
+            "owner/repo", "PR", "user", self._files(b_patch="@@ -1 +1 @@\n+b = 3"), db=db_session
+        )
+        third, _, third_tokens = await service.analyze_files(
+            "owner/repo", "PR", "user", self._files(b_patch="@@ -1 +1 @@\n+b = 3"), db=db_session
+        )
+
+        assert service.client.calls == 2
+        assert [issue.file_path for issue in first.issues] == ["a.py"]
+        assert second_tokens == 150
+        assert third_tokens == 0
+        assert [issue.file_path for issue in third.issues] == ["a.py"]
+
+
+class FakeGitHubService(GitHubService):
+    """GitHubService with canned PR data instead of API calls."""
+
+    def __init__(self, files, head_sha="head-2", compare_files=None, compare_status="ahead"):
+        super().__init__()
+        self.files = files
+        self.head_sha = head_sha
+        self.compare_files = compare_files or []
+        self.compare_status = compare_status
+        self.compared = []
+        self.comments = []
+        self.rate_limited = False  # Refuse the review as if the quota ran out
+
+    async def get_pr_context(self, repo, pr_number):
+        return PRContext(
+            repo=repo,
+            pr_number=pr_number,
+            title="Add feature",
+            author="dev",
+            url=f"https://github.com/{repo}/pull/{pr_number}",
+            head_sha=self.head_sha,
+            changed_files=len(self.files),
+            files=self.files,
+        ), None
+
+    async def get_compare_files(self, repo, base_sha, head_sha):
+        self.compared.append((base_sha, head_sha))
+        return self.compare_files, {"status": self.compare_status}
+
+    async def post_review_comment(self, repo, pr_number, body, commit_sha=None, comments=None):
+        if self.rate_limited:
+            raise RateLimitExceeded(time.time() + 3600)
+        self.comments.append(body)
+        self.inline_comments = comments
+        return "review-1"
+
+
+class TestProcessPRAnalysis:
+    """Test the PR analysis pipeline."""
+
+    ISSUE_TEXT = """{"issues": [{"category": "quality", "severity": "warning", "file_path": "b.py",
+        "line_number": 3, "title": "New problem", "message": "Found in the new push"}], "summary": "ok"}"""
+
+    def _previous_review(self, db_session):
+        previous = PRAnalysis(
+            repo="owner/repo", pr_number=7, status="completed", head_sha="head-1",
+            analyzed_at=datetime.utcnow() - timedelta(hours=1),
+        )
+        db_session.add(previous)
+        db_session.flush()
+        db_session.add_all([
+            Issue(analysis_id=previous.id, category="security", severity="critical", file_path="a.py",
+                  title="Still valid", message="a.py did not change", is_helpful=True),
+            Issue(analysis_id=previous.id, category="quality", severity="warning", file_path="b.py",
+                  title="Outdated", message="b.py changed"),
+        ])
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.commit()
+        return analysis
+
+    def _files(self):
+        return [
+            FileDiff(filename="a.py", patch="@@ -1 +1 @@\n+a = 1"),
+            FileDiff(filename="b.py", patch="@@ -1 +1 @@\n+b = 2"),
+        ]
+
+    async def test_synchronize_reviews_only_delta(self, db_session, slow_claude):
+        """Test a new push analyzes only changed files and carries over the rest."""
+        analysis = self._previous_review(db_session)
+        delta = [FileDiff(filename="b.py", patch="@@ -1 +1 @@\n+b = 2")]
+        github = FakeGitHubService(self._files(), compare_files=delta)
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert github.compared == [("head-1", "head-2")]
+        assert analysis.status == "completed"
+        assert analysis.incremental_from_sha == "head-1"
+        assert sorted(issue.title for issue in analysis.issues) == ["New problem", "Still valid"]
+        carried = next(issue for issue in analysis.issues if issue.title == "Still valid")
+        assert carried.is_helpful is True
+        assert analysis.critical_count == 1
+        assert analysis.warning_count == 1
+        assert "1 earlier finding(s) carried over" in github.comments[0]
+        # Only the new finding is on a line of the diff
+        assert github.inline_comments == []
+
+    async def test_synchronize_keeps_findings_outside_changed_hunks(self, db_session, slow_claude):
+        """Test a finding on an untouched line of a changed file is carried over, following the line."""
+        analysis = self._previous_review(db_session)
+        previous = db_session.query(PRAnalysis).filter_by(head_sha="head-1").one()
+        db_session.add_all([
+            Issue(analysis_id=previous.id, category="security", severity="critical", file_path="b.py",
+                  line_number=40, title="Below the change", message="b.py line 40 did not change"),
+            Issue(analysis_id=previous.id, category="quality", severity="warning", file_path="b.py",
+                  line_number=2, title="In the change", message="b.py line 2 changed"),
+        ])
+        db_session.commit()
+        delta = [FileDiff(filename="b.py", patch="@@ -1,3 +1,5 @@\n b = 2\n-c = 3\n+c = 4\n+d = 5\n+e = 6\n f = 7")]
+        github = FakeGitHubService(self._files(), compare_files=delta)
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.incremental_from_sha == "head-1"
+        assert sorted(issue.title for issue in analysis.issues) == ["Below the change", "New problem", "Still valid"]
+        carried = next(issue for issue in analysis.issues if issue.title == "Below the change")
+        assert carried.line_number == 42
+        assert "2 earlier finding(s) carried over" in github.comments[0]
+
+    async def test_pipeline_on_async_session(self, db_session, slow_claude):
+        """Test the pipeline works the same on an async session, as run by the workers."""
+        analysis = self._previous_review(db_session)
+        delta = [FileDiff(filename="b.py", patch="@@ -1 +1 @@\n+b = 2")]
+        github = FakeGitHubService(self._files(), compare_files=delta)
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            async with AsyncTestingSessionLocal() as db:
+                await process_pr_analysis(analysis.id, "owner/repo", 7, db)
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        assert analysis.incremental_from_sha == "head-1"
+        assert sorted(issue.title for issue in analysis.issues) == ["New problem", "Still valid"]
+        assert len(github.comments) == 1
+
+    async def test_truncated_review_published_as_partial(self, db_session, slow_claude):
+        """Test a review cut off at max_tokens is stored as incomplete and flagged on the PR."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT, stop_reason="max_tokens")
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        assert analysis.review_complete is False
+        assert "Partial review" in github.comments[0]
+
+    async def test_rate_limited_review_keeps_analysis(self, db_session, slow_claude):
+        """Test running out of quota while publishing neither defers nor redoes the stored analysis."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        github.rate_limited = True
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+            db_session.refresh(analysis)
+            issue_ids = [issue.id for issue in analysis.issues]
+            # A retried job leaves the completed analysis alone
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        assert [issue.id for issue in analysis.issues] == issue_ids
+        assert analyzer.client.calls == 1
+        assert db_session.query(MetricsDaily).one().prs_analyzed == 1
+
+    async def test_pipeline_records_prompt_cache_tokens(self, db_session, slow_claude):
+        """Test prompt cache reads and writes are stored apart from tokens_used."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(
+            delay=0, text=self.ISSUE_TEXT,
+            usage={"cache_read_input_tokens": 0, "cache_creation_input_tokens": 1300},
+        )
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer), \
+                patch.object(analyzer_settings, "analysis_cache_enabled", False):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.tokens_used == 150
+        assert analysis.cache_creation_tokens == 1300
+        assert analysis.cache_read_tokens == 0
+
+    def _queued(self, db_session, max_attempts=2):
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.flush()
+        queue = JobQueue(session_factory=AsyncTestingSessionLocal)
+        job = queue.enqueue(db_session, analysis)
+        job.max_attempts = max_attempts
+        db_session.commit()
+        return analysis, job, queue
+
+    async def test_github_outage_retried_until_attempts_run_out(self, db_session):
+        """Test a GitHub 5xx requeues the job; only the last failed attempt fails the analysis."""
+        analysis, job, queue = self._queued(db_session)
+        github = FakeGitHubService(self._files())
+        github.get_pr_context = AsyncMock(side_effect=GitHubUnavailable("502: Bad Gateway"))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github):
+            await queue.run_next(process_pr_analysis, "worker-0")
+            db_session.expire_all()
+            assert (job.status, job.attempts) == ("queued", 1)
+            assert (analysis.status, analysis.error_message) == ("pending", None)
+
+            job.available_at = datetime.utcnow()
+            db_session.commit()
+            await queue.run_next(process_pr_analysis, "worker-0")
+
+        db_session.expire_all()
+        assert job.status == "failed"
+        assert (analysis.status, analysis.error_message) == ("failed", "502: Bad Gateway")
+        assert github.comments == []
+
+    async def test_claude_outage_is_retried_not_reviewed(self, db_session, slow_claude):
+        """Test a Claude connection error requeues the job instead of publishing an empty review."""
+        analysis, job, queue = self._queued(db_session)
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, error=anthropic.APIConnectionError(
+            request=httpx.Request("POST", "https://api.anthropic.test/v1/messages"),
+        ))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await queue.run_next(process_pr_analysis, "worker-0")
+
+        db_session.expire_all()
+        assert job.status == "queued"
+        assert job.last_error.startswith("Claude API error")
+        assert analysis.status == "pending"
+        assert github.comments == []
+        assert db_session.query(MetricsDaily).count() == 0
+
+    async def test_rejected_claude_request_fails_without_review(self, db_session, slow_claude):
+        """Test a Claude error a retry can't fix fails the analysis at once and posts nothing."""
+        analysis, job, queue = self._queued(db_session, max_attempts=3)
+        request = httpx.Request("POST", "https://api.anthropic.test/v1/messages")
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, error=anthropic.BadRequestError(
+            "prompt is too long", response=httpx.Response(400, request=request), body=None,
+        ))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await queue.run_next(process_pr_analysis, "worker-0")
+
+        db_session.expire_all()
+        assert job.status == "done"
+        assert analysis.status == "failed"
+        assert "prompt is too long" in analysis.error_message
+        assert github.comments == []
+        assert db_session.query(MetricsDaily).count() == 0
+
+    async def test_issues_saved_in_one_insert(self, db_session, slow_claude, query_log):
+        """Test without streaming, hundreds of findings are stored in one insert and published without re-reading them."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        findings = [
+            {"category": "quality", "severity": "critical" if n < 10 else "warning", "file_path": "b.py",
+             "line_number": n, "title": f"Problem {n}", "message": "Found by a fan-out chunk"}
+            for n in range(200)
+        ]
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=json.dumps({"issues": findings, "summary": "ok"}))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer), \
+                patch.object(analyzer_settings, "analysis_streaming_enabled", False):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        statements = [sql for sql, _ in query_log]
+        assert len([sql for sql in statements if sql.startswith("INSERT INTO issues")]) == 1
+        assert not [sql for sql in statements if sql.startswith("SELECT") and "FROM issues" in sql]
+        assert len([sql for sql in statements if "metrics_daily_issues" in sql]) <= 3
+
+        db_session.refresh(analysis)
+        assert (analysis.critical_count, analysis.warning_count) == (10, 190)
+        assert len(analysis.issues) == 200
+        rollup = db_session.query(MetricsDailyIssue).filter_by(repo="owner/repo").all()
+        assert len(rollup) == 200
+
+    async def test_cached_findings_stored_in_one_insert(self, db_session, slow_claude, query_log):
+        """Test with streaming, findings reused from the cache are inserted and published as one batch."""
+        findings = [
+            {"category": "quality", "severity": "warning", "file_path": "b.py",
+             "line_number": n, "title": f"Problem {n}", "message": "Found on the first push"}
+            for n in range(50)
+        ]
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=json.dumps({"issues": findings, "summary": "ok"}))
+        first, second = PRAnalysis(repo="owner/repo", pr_number=7), PRAnalysis(repo="owner/repo", pr_number=8)
+        db_session.add_all([first, second])
+        db_session.commit()
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(first.id, "owner/repo", 7, db_session)
+            query_log.clear()
+            queue = get_event_bus().subscribe(second.id)
+            try:
+                await process_pr_analysis(second.id, "owner/repo", 8, db_session)
+            finally:
+                get_event_bus().unsubscribe(queue, second.id)
+
+        events = [queue.get_nowait() for _ in range(queue.qsize())]
+        inserts = [sql for sql, _ in query_log if sql.startswith("INSERT INTO issues")]
+        assert analyzer.client.calls == 1
+        assert len(inserts) == 1
+        assert [event for event, _ in events if event.startswith("issue")] == ["issues"]
+        assert len(next(data for event, data in events if event == "issues")) == 50
+        db_session.refresh(second)
+        assert len(second.issues) == 50
+
+    async def test_findings_visible_before_completion(self, db_session, session_factory, slow_claude):
+        """Test streamed findings and progress are committed while the analysis is still running."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        findings = [
+            {"category": "quality", "severity": "warning", "file_path": "b.py", "title": f"Problem {n}", "message": "m"}
+            for n in range(2)
+        ]
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=1.0, pieces=20, text=json.dumps({"issues": findings, "summary": "ok"}))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            task = asyncio.create_task(process_pr_analysis(analysis.id, "owner/repo", 7, db_session))
+            seen = None
+            while seen is None and not task.done():
+                await asyncio.sleep(0.02)
+                with session_factory() as db:
+                    running = db.get(PRAnalysis, analysis.id)
+                    if running.issues:
+                        seen = (running.status, len(running.issues), running.chunks_done, running.chunks_total,
+                                running.first_issue_ms)
+            await task
+
+        status, issues, chunks_done, chunks_total, first_issue_ms = seen
+        assert (status, chunks_done, chunks_total) == ("processing", 0, 1)
+        assert issues >= 1
+        assert first_issue_ms < 1000
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        assert (analysis.chunks_done, analysis.chunks_total) == (1, 1)
+        assert sorted(issue.title for issue in analysis.issues) == ["Problem 0", "Problem 1"]
+        assert analysis.warning_count == 2
+
+    async def test_pipeline_publishes_events(self, db_session, slow_claude):
+        """Test the pipeline publishes status, each stored finding and progress, in order."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+        events = get_event_bus().subscribe(analysis.id)
+
+        try:
+            with patch('app.routers.webhook.get_github_service', return_value=github), \
+                    patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+                await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+        finally:
+            get_event_bus().unsubscribe(events, analysis.id)
+
+        published = [events.get_nowait() for _ in range(events.qsize())]
+        assert [event for event, _ in published] == ["status", "progress", "issue", "progress", "status"]
+        assert published[0][1]["status"] == "processing"
+        assert published[2][1]["title"] == "New problem"
+        assert published[2][1]["id"] == db_session.query(Issue.id).filter_by(analysis_id=analysis.id).scalar()
+        assert published[3][1] == {"chunks_done": 1, "chunks_total": 1}
+        assert published[4][1]["status"] == "completed"
+
+    async def test_retry_replaces_streamed_findings(self, db_session, slow_claude):
+        """Test findings stored by a failed attempt are not duplicated by the retry."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, status="failed")
+        db_session.add(analysis)
+        db_session.flush()
+        db_session.add(Issue(analysis_id=analysis.id, category="quality", severity="warning", file_path="b.py",
+                             title="New problem", message="Stored before the first attempt failed"))
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert [issue.message for issue in analysis.issues] == ["Found in the new push"]
+        assert analysis.warning_count == 1
+
+    async def test_review_includes_inline_comments(self, db_session, slow_claude):
+        """Test findings on diff lines are published inline in the same review."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT.replace('"line_number": 3', '"line_number": 1'))
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        assert len(github.comments) == 1
+        assert [(c["path"], c["line"]) for c in github.inline_comments] == [("b.py", 1)]
+
+    async def test_completion_updates_metrics_rollup(self, db_session, slow_claude):
+        """Test a completed analysis is counted in the dashboard rollup and cached metrics are dropped."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        get_response_cache().set(("metrics", "owner/repo", 30), "stale", repo="owner/repo")
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        day = db_session.query(MetricsDaily).one()
+        assert (day.repo, day.prs_analyzed, day.issues_found, day.warning_count) == ("owner/repo", 1, 1, 1)
+        assert get_response_cache().get(("metrics", "owner/repo", 30)) is None
+        assert db_session.query(MetricsDailyIssue).one().title == "New problem"
+
+    async def test_force_push_falls_back_to_full_review(self, db_session, slow_claude):
+        """Test a diverged history re-reviews the whole PR."""
+        analysis = self._previous_review(db_session)
+        github = FakeGitHubService(self._files(), compare_status="diverged")
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.incremental_from_sha is None
+        assert [issue.title for issue in analysis.issues] == ["New problem"]
+
+    async def test_partial_review_not_used_as_incremental_base(self, db_session, slow_claude):
+        """Test a push after a partial review re-reviews the whole PR rather than only the delta."""
+        analysis = self._previous_review(db_session)
+        db_session.query(PRAnalysis).filter_by(head_sha="head-1").update({"review_complete": False})
+        db_session.commit()
+        delta = [FileDiff(filename="b.py", patch="@@ -1 +1 @@\n+b = 2")]
+        github = FakeGitHubService(self._files(), compare_files=delta)
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0, text=self.ISSUE_TEXT)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert github.compared == []
+        assert analysis.incremental_from_sha is None
+        assert "+a = 1" in analyzer.client.requests[0]["messages"][0]["content"]
+
+    async def test_review_over_budget_is_partial(self, db_session, slow_claude):
+        """Test files left out over the review budget make the review partial."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7, head_sha="head-2")
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files())
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer), \
+                patch.object(analyzer_settings, "analysis_token_budget", 10):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.review_complete is False
+        assert "Not reviewed" in github.comments[0]
+
+    async def test_first_review_records_head_sha(self, db_session, slow_claude):
+        """Test the reviewed head SHA is recorded when the trigger didn't carry one."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        github = FakeGitHubService(self._files(), head_sha="abc123")
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.head_sha == "abc123"
+        assert github.compared == []
+
+    async def test_rate_limit_defers_analysis(self, db_session, slow_claude, github_api):
+        """Test running out of GitHub quota defers the job instead of failing the analysis."""
+        analysis = PRAnalysis(repo="owner/limited", pr_number=1)
+        db_session.add(analysis)
+        db_session.commit()
+        github = GitHubService()
+        github.client = github_api.client()
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                pytest.raises(DeferJob) as exc:
+            await process_pr_analysis(analysis.id, "owner/limited", 1, db_session)
+
+        assert exc.value.pause_queue is True
+        assert exc.value.retry_at > datetime.utcnow() + timedelta(minutes=50)
+        db_session.refresh(analysis)
+        assert analysis.status == "processing"
+
+    async def test_github_requests_recorded(self, db_session, slow_claude, github_api):
+        """Test one analysis fetches the PR once and records its GitHub request count."""
+        analysis = PRAnalysis(repo="owner/repo", pr_number=7)
+        db_session.add(analysis)
+        db_session.commit()
+        github = GitHubService()
+        github.client = github_api.client()
+        analyzer = AnalyzerService()
+        analyzer.client = slow_claude(delay=0)
+
+        with patch('app.routers.webhook.get_github_service', return_value=github), \
+                patch('app.routers.webhook.get_analyzer_service', return_value=analyzer):
+            await process_pr_analysis(analysis.id, "owner/repo", 7, db_session)
+
+        db_session.refresh(analysis)
+        assert analysis.status == "completed"
+        # PR + 2 pages of files + 1 review
+        assert analysis.github_requests == 4
+        assert github_api.paths.count("/repos/owner/repo/pulls/7") == 1
+
+
+class TestBackfill:
+    """Test bulk analysis of past PRs through the Message Batches API."""
+
+    ISSUE_TEXT = """{"issues": [{"category": "quality", "severity": "warning", "file_path": "a.py",
+        "line_number": 1, "title": "Old problem", "message": "Found by the backfill"}], "summary": "ok"}"""
+
+    @contextmanager
+    def _stub_apis(self, github_api, batch_api):
+        github = GitHubService()
+        github.client = github_api.client()
+        batches = MessageBatchClient()
+        batches.client = batch_api.client()
+        batch_api.text = self.ISSUE_TEXT
+        with patch("app.services.backfill.get_github_service", return_value=github), \
+                patch("app.services.backfill.get_message_batch_client", return_value=batches), \
+                patch.object(backfill_settings, "backfill_poll_interval", 0):
+            yield
+
+    async def test_backfill_analyzes_prs_in_one_batch(self, db_session, github_api, batch_api):
+        """Test listed PRs are submitted as one batch and its results stored."""
+        batch_api.usage = {"input_tokens": 100, "output_tokens": 50, "cache_read_input_tokens": 900}
+        service = BackfillService()
+        run = service.create_run(db_session, "owner/repo")
+
+        with self._stub_apis(github_api, batch_api):
+            run = await service.run(db_session, run.id)
+
+        analysis = db_session.query(PRAnalysis).filter_by(pr_number=7).one()
+        requests = batch_api.batches["msgbatch_1"]
+        assert list(batch_api.batches) == ["msgbatch_1"]
+        assert [request["custom_id"] for request in requests] == [analysis.id]
+        assert "+a" in requests[0]["params"]["messages"][0]["content"]
+        assert requests[0]["params"]["system"][0]["text"].startswith("You are CodeGuard")
+        assert batch_api.retrieved == 2
+
+        assert analysis.status == "completed"
+        assert analysis.backfill_run_id == run.id
+        assert analysis.author == "dev"
+        assert [issue.title for issue in analysis.issues] == ["Old problem"]
+        assert analysis.warning_count == 1
+        assert analysis.tokens_used == 150
+        assert analysis.cache_read_tokens == 900
+        unavailable = db_session.query(PRAnalysis).filter_by(pr_number=8).one()
+        assert unavailable.status == "failed"
+        assert "Not Found" in unavailable.error_message
+
+        assert run.status == "completed"
+        assert (run.prs_found, run.prs_submitted, run.prs_completed, run.prs_failed) == (2, 1, 1, 1)
+        assert run.tokens_used == 150
+        assert db_session.query(MetricsDaily).one().prs_analyzed == 1
+        # Reviews are not posted to the PRs
+        assert github_api.posted == []
+
+    async def test_backfill_skips_analyzed_prs(self, db_session, github_api, batch_api):
+        """Test PRs that already have a completed analysis are not analyzed again."""
+        db_session.add(PRAnalysis(repo="owner/repo", pr_number=7, status="completed"))
+        db_session.commit()
+        service = BackfillService()
+        run = service.create_run(db_session, "owner/repo")
+
+        with self._stub_apis(github_api, batch_api):
+            run = await service.run(db_session, run.id)
+
+        assert batch_api.batches == {}
+        assert run.status == "completed"
+        assert (run.prs_submitted, run.prs_failed) == (0, 1)
+        assert db_session.query(PRAnalysis).filter_by(pr_number=7).count() == 1
+
+    async def test_interrupted_backfill_resumes(self, db_session, github_api, batch_api):
+        """Test a run stopped while waiting polls its batch on resume instead of resubmitting."""
+        batch_api.unavailable = True
+        run = BackfillService().create_run(db_session, "owner/repo")
+
+        with self._stub_apis(github_api, batch_api):
+            stopped = await BackfillService().run(db_session, run.id)
+            assert stopped.status == "submitted"
+            assert "Overloaded" in stopped.error_message
+
+            batch_api.unavailable = False
+            resumed = await BackfillService().run(db_session, run.id)
+
+        assert resumed.status == "completed"
+        assert resumed.error_message is None
+        assert len(batch_api.batches) == 1
+        analyses = db_session.query(PRAnalysis).filter_by(pr_number=7).all()
+        assert [analysis.status for analysis in analyses] == ["completed"]
+        assert db_session.query(Issue).count() == 1
+
+    async def test_unfinished_runs_resumed_on_startup(self, db_session, github_api, batch_api):
+        """Test a restart resumes runs left unfinished and leaves completed ones alone."""
+        batch_api.unavailable = True
+        run = BackfillService().create_run(db_session, "owner/repo")
+        with self._stub_apis(github_api, batch_api):
+            await BackfillService().run(db_session, run.id)
+        done = BackfillRun(repo="owner/other", pr_limit=10, status="completed")
+        db_session.add(done)
+        db_session.commit()
+
+        # A fresh process, as after a restart
+        service = BackfillService(session_factory=AsyncTestingSessionLocal)
+        batch_api.unavailable = False
+        with self._stub_apis(github_api, batch_api):
+            tasks = await service.resume_unfinished()
+            await asyncio.gather(*tasks)
+            await service.stop()
+
+        db_session.refresh(run)
+        assert len(tasks) == 1
+        assert run.status == "completed"
+        assert len(batch_api.batches) == 1
+        assert db_session.query(PRAnalysis).filter_by(pr_number=7).one().status == "completed"
+
+    async def test_errored_request_fails_its_analysis(self, db_session, github_api, batch_api):
+        """Test a request that failed inside the batch only fails its own analysis."""
+        batch_api.unavailable = True
+        service = BackfillService()
+        run = service.create_run(db_session, "owner/repo")
+
+        with self._stub_apis(github_api, batch_api):
+            await service.run(db_session, run.id)
+            analysis = db_session.query(PRAnalysis).filter_by(pr_number=7).one()
+            batch_api.errored.add(analysis.id)
+            batch_api.unavailable = False
+            run = await service.run(db_session, run.id)
+
+        db_session.refresh(analysis)
+        assert analysis.status == "failed"
+        assert analysis.error_message == "Batch request failed: prompt is too long"
+        assert run.status == "completed"
+        assert (run.prs_completed, run.prs_failed) == (0, 2)
+
+    async def test_concurrent_runs_submit_one_batch(self, db_session, github_api, batch_api):
+        """Test two processes resuming the same run don't both submit and store it."""
+        run = BackfillService().create_run(db_session, "owner/repo")
+        first = BackfillService(session_factory=AsyncTestingSessionLocal)
+        second = BackfillService(session_factory=AsyncTestingSessionLocal)
+
+        with self._stub_apis(github_api, batch_api):
+            await asyncio.gather(first.run_detached(run.id), second.run_detached(run.id))
+
+        db_session.refresh(run)
+        assert len(batch_api.batches) == 1
+        assert run.status == "completed"
+        assert (run.prs_completed, run.prs_failed) == (1, 1)
+        assert run.leased_by is None
+        assert db_session.query(Issue).count() == 1
+
+    async def test_results_stored_once(self, db_session, github_api, batch_api):
+        """Test storing a run's results again neither stores nor recounts them."""
+        service = BackfillService()
+        run = service.create_run(db_session, "owner/repo")
+        with self._stub_apis(github_api, batch_api):
+            await service.run(db_session, run.id)
+
+        store_results(db_session, run.id, [])
+
+        db_session.refresh(run)
+        assert (run.prs_completed, run.prs_failed, run.tokens_used) == (1, 1, 150)
+        assert db_session.query(Issue).count() == 1
+
+    def test_leased_run_not_claimed_until_lease_expires(self, db_session):
+        """Test a run held by another process can only be claimed once its lease expired."""
+        run = BackfillService().create_run(db_session, "owner/repo")
+
+        assert claim_run(db_session, run.id, "first") is True
+        assert claim_run(db_session, run.id, "second") is False
+
+        run.leased_until = datetime.utcnow() - timedelta(seconds=1)
+        db_session.commit()
+        assert claim_run(db_session, run.id, "second") is True
+        db_session.refresh(run)
+        assert run.leased_by == "second"
+
+    async def test_backfill_on_async_session(self, db_session, github_api, batch_api):
+        """Test a backfill runs the same on an async session, as run by the admin endpoint."""
+        service = BackfillService(session_factory=AsyncTestingSessionLocal)
+        run = service.create_run(db_session, "owner/repo")
+
+        with self._stub_apis(github_api, batch_api):
+            await service.run_detached(run.id)
+
+        db_session.refresh(run)
+        assert run.status == "completed"
+        assert run.prs_completed == 1
+
+    def test_backfill_cli(self, db_session, session_factory, github_api, batch_api, capsys):
+        """Test the backfill command runs a backfill and can resume it."""
+        from app import cli
+
+        with self._stub_apis(github_api, batch_api), \
+                patch.object(cli, "SessionLocal", session_factory), patch.object(cli, "init_db"):
+            batch_api.unavailable = True
+            cli.main(["backfill", "owner/repo", "--limit", "5"])
+            run = db_session.query(BackfillRun).one()
+            assert f"--resume {run.id}" in capsys.readouterr().out
+
+            batch_api.unavailable = False
+            cli.main(["backfill", "--resume", run.id])
+
+        assert "1 PR(s) analyzed, 1 failed" in capsys.readouterr().out
+        db_session.refresh(run)
+        assert run.pr_limit == 5
+        assert run.status == "completed"
@@ -0,0 +1,298 @@
+"""Tests for utility modules."""
+import json
+import pytest
+
+from app.models.schemas import FileDiff
+from app.utils.diff import (
+    RISK_DOCS,
+    RISK_GENERATED,
+    RISK_SENSITIVE,
+    RISK_SOURCE,
+    RISK_TEST,
+    chunk_files,
+    commentable_lines,
+    estimate_tokens,
+    pack_files,
+    rank_files,
+    render_diff,
+    render_file,
+    resolve_path,
+    risk_tier,
+    shift_line,
+    split_hunks,
+)
+from app.utils.json_stream import IssueStreamParser
+from app.utils.prompts import (
+    CACHE_CONTROL,
+    build_analysis_prompt,
+    build_repo_guidance,
+    build_system_prompt,
+)
+
+
+def make_file(name: str, hunks: int = 1, lines_per_hunk: int = 10) -> FileDiff:
+    patch = "\n".join(
+        f"@@ -{i * 100},{lines_per_hunk} +{i * 100},{lines_per_hunk} @@\n"
+        + "\n".join(f"+line {j} of {name}" for j in range(lines_per_hunk))
+        for i in range(hunks)
+    )
+    return FileDiff(filename=name, patch=patch, additions=hunks * lines_per_hunk)
+
+
+class TestDiffUtils:
+    """Test diff splitting and chunking."""
+
+    def test_render_diff_matches_legacy_format(self):
+        """Test rendered diff keeps the ---/+++ header format."""
+        files = [FileDiff(filename="a.py", patch="@@ -1 +1 @@\n+x"), FileDiff(filename="b.bin")]
+
+        diff = render_diff(files)
+
+        assert diff == "--- a.py\n+++ a.py\n@@ -1 +1 @@\n+x\n\n--- b.bin\n+++ b.bin\n"
+
+    def test_split_hunks(self):
+        """Test a patch is split on @@ hunk headers."""
+        hunks = split_hunks(make_file("a.py", hunks=3).patch)
+
+        assert len(hunks) == 3
+        assert all(hunk.startswith("@@") for hunk in hunks)
+
+    def test_commentable_lines(self):
+        """Test added and context lines map to new-side line numbers; removed lines don't."""
+        patch = "@@ -10,3 +10,3 @@ def f():\n context\n-old\n+new\n tail\n@@ -40 +40,2 @@\n+a\n+b"
+
+        assert commentable_lines(patch) == {10, 11, 12, 40, 41}
+
+    def test_resolve_path(self):
+        """Test reported paths are matched to diff filenames despite common prefixes."""
+        filenames = {"src/app.py", "a.py"}
+        assert resolve_path("src/app.py", filenames) == "src/app.py"
+        assert resolve_path("./src/app.py", filenames) == "src/app.py"
+        assert resolve_path("/src/app.py", filenames) == "src/app.py"
+        assert resolve_path("b/src/app.py", filenames) == "src/app.py"
+        assert resolve_path("a.py", filenames) == "a.py"
+        assert resolve_path("app.py", filenames) is None
+
+    def test_shift_line(self):
+        """Test lines outside the hunks follow the patch and lines inside them are dropped."""
+        patch = "@@ -10,3 +10,4 @@\n a\n+b\n c\n d\n@@ -40,2 +41,0 @@\n-e\n-f"
+        assert shift_line(patch, 5) == 5
+        assert shift_line(patch, 11) is None
+        assert shift_line(patch, 20) == 21
+        assert shift_line(patch, 41) is None
+        assert shift_line(patch, 50) == 49
+        # Pure insertion after line 3
+        assert shift_line("@@ -3,0 +4,2 @@\n+x\n+y", 3) == 3
+        assert shift_line("@@ -3,0 +4,2 @@\n+x\n+y", 4) == 6
+
+    def test_chunk_files_fits_budget(self):
+        """Test every chunk stays within the token budget."""
+        files = [make_file(f"src/file_{i}.py") for i in range(50)]
+        budget = estimate_tokens(render_file(files[0])) * 4
+
+        chunks = chunk_files(files, budget)
+
+        assert 1 < len(chunks) < len(files)
+        assert sum(len(chunk) for chunk in chunks) == 50
+        assert all(estimate_tokens(render_diff(chunk)) <= budget + len(chunk) for chunk in chunks)
+
+    def test_chunk_files_splits_large_file_on_hunks(self):
+        """Test a file larger than the budget is split into hunk groups."""
+        big = make_file("big.py", hunks=10, lines_per_hunk=20)
+        budget = estimate_tokens(split_hunks(big.patch)[0]) * 3
+
+        chunks = chunk_files([big], budget)
+
+        assert len(chunks) > 1
+        assert all(piece.filename == "big.py" for chunk in chunks for piece in chunk)
+        rejoined = "\n".join(piece.patch for chunk in chunks for piece in chunk)
+        assert sorted(split_hunks(rejoined)) == sorted(split_hunks(big.patch))
+
+    def test_chunk_files_small_pr_single_chunk(self):
+        """Test a small PR stays in one chunk."""
+        assert len(chunk_files([make_file("a.py"), make_file("b.py")], 10000)) == 1
+
+
+class TestDiffPacking:
+    """Test risk ranking and token-budgeted packing of PR diffs."""
+
+    @pytest.mark.parametrize("filename, tier", [
+        ("src/auth/login.py", RISK_SENSITIVE),
+        ("backend/app/config.py", RISK_SENSITIVE),
+        ("src/tokenizer.py", RISK_SOURCE),
+        ("app/main.py", RISK_SOURCE),
+        ("tests/test_auth.py", RISK_TEST),
+        ("web/src/App.test.jsx", RISK_TEST),
+        ("docs/security.md", RISK_DOCS),
+        ("README.md", RISK_DOCS),
+        ("frontend/package-lock.json", RISK_GENERATED),
+        ("static/app.min.js", RISK_GENERATED),
+    ])
+    def test_risk_tier(self, filename, tier):
+        """Test files are classified by path."""
+        assert risk_tier(filename) == tier
+
+    def test_rank_by_tier_then_churn(self):
+        """Test sensitive files come first and larger churn wins within a tier."""
+        files = [
+            make_file("tests/test_a.py", lines_per_hunk=50),
+            make_file("src/small.py", lines_per_hunk=2),
+            make_file("src/big.py", lines_per_hunk=20),
+            make_file("src/auth.py", lines_per_hunk=1),
+            make_file("yarn.lock", lines_per_hunk=90),
+        ]
+
+        ranked = [file.filename for file in rank_files(files)]
+
+        assert ranked == ["src/auth.py", "src/big.py", "src/small.py", "tests/test_a.py", "yarn.lock"]
+
+    def test_everything_fits(self):
+        """Test a PR within the budget is returned unchanged."""
+        files = [make_file("b.py"), make_file("a.py", hunks=3)]
+
+        packed = pack_files(files, token_budget=10000)
+
+        assert packed.files == files
+        assert (packed.skipped, packed.truncated) == ([], [])
+
+    def test_budget_keeps_high_risk_files(self):
+        """Test low-risk files are skipped first when over budget, and order is preserved."""
+        files = [make_file("docs/guide.md", lines_per_hunk=40), make_file("src/app.py"), make_file("src/auth.py")]
+        budget = estimate_tokens(render_file(files[1])) + estimate_tokens(render_file(files[2])) + 5
+
+        packed = pack_files(files, token_budget=budget)
+
+        assert [file.filename for file in packed.files] == ["src/app.py", "src/auth.py"]
+        assert packed.skipped == ["docs/guide.md"]
+
+    def test_partial_file_keeps_whole_hunks(self):
+        """Test a file that doesn't fit is cut between hunks, never inside one."""
+        file = make_file("src/app.py", hunks=4)
+        hunks = split_hunks(file.patch)
+        budget = estimate_tokens(render_file(file)) - estimate_tokens(hunks[-1]) // 2
+
+        packed = pack_files([file], token_budget=budget)
+
+        assert packed.truncated == ["src/app.py"]
+        assert split_hunks(packed.files[0].patch) == hunks[:3]
+        assert estimate_tokens(render_diff(packed.files)) <= budget
+
+    def test_max_file_lines(self):
+        """Test at most max_file_lines changed lines of a file are kept."""
+        file = make_file("src/app.py", hunks=5, lines_per_hunk=10)
+
+        packed = pack_files([file], token_budget=10000, max_file_lines=25)
+
+        assert len(split_hunks(packed.files[0].patch)) == 2
+        assert packed.truncated == ["src/app.py"]
+
+
+def feed_in_pieces(text: str, size: int):
+    parser = IssueStreamParser()
+    found = []
+    for start in range(0, len(text), size):
+        found.append(parser.feed(text[start:start + size]))
+    return found
+
+
+class TestPrompts:
+    """Test the cacheable prompt layout."""
+
+    def test_system_prompt_holds_instructions_and_format(self):
+        """Test the instructions and output format form one block, not cacheable by default."""
+        blocks = build_system_prompt()
+
+        assert len(blocks) == 1
+        assert '"issues"' in blocks[0]["text"]
+        assert "cache_control" not in blocks[0]
+
+    def test_shared_instructions_long_enough_to_cache(self):
+        """Test the instructions every review shares reach the cache minimum and are marked cacheable."""
+        blocks = build_system_prompt(cache_min_tokens=1024)
+
+        assert estimate_tokens(blocks[0]["text"]) >= 1024
+        assert blocks[0]["cache_control"] == CACHE_CONTROL
+
+    def test_short_prompt_not_marked_cacheable(self):
+        """Test a prompt under the cache minimum is sent without a cache marker."""
+        blocks = build_system_prompt(cache_min_tokens=100_000)
+
+        assert "cache_control" not in blocks[0]
+
+    def test_prompt_cached_up_to_guidance(self):
+        """Test the guidance is marked cacheable too only when several calls share it."""
+        guidance = build_repo_guidance({"style": "Prefer f-strings. " * 300})
+
+        blocks = build_system_prompt(guidance, cache_min_tokens=1024, cache_guidance=True)
+
+        assert blocks[0]["cache_control"] == CACHE_CONTROL
+        assert blocks[1]["cache_control"] == CACHE_CONTROL
+        assert "cache_control" not in build_system_prompt(guidance, cache_min_tokens=1024)[1]
+
+    def test_repo_guidance_is_a_separate_block(self):
+        """Test repo guidance follows the shared block, sorted so the prefix is stable."""
+        guidance = build_repo_guidance({"style": "Prefer f-strings.", "security": " Use the vault client. ", "empty": ""})
+
+        blocks = build_system_prompt(guidance)
+
+        assert guidance == (
+            "Repository guidance from the maintainers:\n"
+            "- security: Use the vault client.\n"
+            "- style: Prefer f-strings."
+        )
+        assert [block["text"] for block in blocks[1:]] == [guidance]
+        assert build_system_prompt(guidance)[0] == build_system_prompt()[0]
+
+    def test_no_guidance(self):
+        """Test repos without custom prompts get no guidance block."""
+        assert build_repo_guidance(None) is None
+        assert build_repo_guidance({}) is None
+
+    def test_user_prompt_holds_only_the_pr(self):
+        """Test the per-PR message carries the PR, not the static instructions."""
+        prompt = build_analysis_prompt("owner/repo", "Fix login", "alice", "+x = 1")
+
+        assert "owner/repo" in prompt and "+x = 1" in prompt
+        assert '"issues"' not in prompt
+
+
+class TestIssueStreamParser:
+    """Test incremental extraction of the issues array."""
+
+    ISSUES = [
+        {"title": "Brace { in a string }", "message": 'Escaped \\" quote and ] bracket', "line_number": 1},
+        {"title": "Nested", "message": "ok", "tags": [["a"], {"b": [1, 2]}]},
+    ]
+
+    @pytest.mark.parametrize("size", [1, 3, 7, 1000])
+    def test_issues_parsed_regardless_of_split(self, size):
+        """Test every issue is found whatever the size of the deltas."""
+        text = "Here is the review:\n```json\n" + json.dumps(
+            {"summary": "issues", "issues": self.ISSUES, "has_tests": False}
+        ) + "\n```"
+
+        found = [issue for batch in feed_in_pieces(text, size) for issue in batch]
+
+        assert found == self.ISSUES
+
+    def test_issue_returned_when_its_object_closes(self):
+        """Test an issue is returned by the delta that completes it, before the response ends."""
+        text = json.dumps({"issues": self.ISSUES, "summary": "x" * 100})
+        first_end = text.index(json.dumps(self.ISSUES[0])) + len(json.dumps(self.ISSUES[0]))
+        parser = IssueStreamParser()
+
+        assert parser.feed(text[:first_end - 1]) == []
+        assert parser.feed(text[first_end - 1:first_end]) == [self.ISSUES[0]]
+        assert parser.feed(text[first_end:]) == [self.ISSUES[1]]
+
+    def test_only_top_level_issues_array(self):
+        """Test issues keys elsewhere in the response are ignored."""
+        text = json.dumps({
+            "meta": {"issues": [{"title": "nested"}]},
+            "issues": [{"title": "real"}, "not an object"],
+            "extra": {"issues": [{"title": "late"}]},
+        })
+
+        found = [issue for batch in feed_in_pieces(text, 5) for issue in batch]
+
+        assert found == [{"title": "real"}]
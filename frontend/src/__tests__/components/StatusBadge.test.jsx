@@ -30,4 +30,11 @@ describe('StatusBadge', () => {
     expect(screen.getByText('failed')).toBeInTheDocument()
     expect(screen.getByText('✕')).toBeInTheDocument()
   })
+
+  it('renders superseded status', () => {
+    render(<StatusBadge status="superseded" />)
+
+    expect(screen.getByText('superseded')).toBeInTheDocument()
+    expect(screen.getByText('↷')).toBeInTheDocument()
+  })
 })
@@ -0,0 +1,160 @@
+import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest'
+import { renderHook, waitFor, act } from '@testing-library/react'
+import { QueryClient, QueryClientProvider } from '@tanstack/react-query'
+import api from '../../api/client'
+import { useAnalysesEvents, useAnalysis, queryKeys } from '../../hooks/useApi'
+
+vi.mock('../../api/client', () => ({
+  default: {
+    getAnalysis: vi.fn(),
+    analysisEventsUrl: (id) => `/api/analysis/${id}/events`,
+    analysesEventsUrl: () => '/api/analyses/events',
+  },
+}))
+
+class FakeEventSource {
+  static instances = []
+
+  constructor(url) {
+    this.url = url
+    this.listeners = {}
+    this.closed = false
+    FakeEventSource.instances.push(this)
+  }
+
+  addEventListener(type, listener) {
+    this.listeners[type] = [...(this.listeners[type] || []), listener]
+  }
+
+  emit(type, data = null) {
+    act(() => {
+      (this.listeners[type] || []).forEach((listener) => listener({ data: JSON.stringify(data) }))
+    })
+  }
+
+  close() {
+    this.closed = true
+  }
+}
+
+const runningAnalysis = {
+  id: 'analysis-1',
+  status: 'processing',
+  issues: [],
+  summary: { critical: 0, warnings: 0, suggestions: 0, total_issues: 0 },
+}
+
+function renderWithClient(hook) {
+  const queryClient = new QueryClient({ defaultOptions: { queries: { retry: false } } })
+  const wrapper = ({ children }) => <QueryClientProvider client={queryClient}>{children}</QueryClientProvider>
+  return { ...renderHook(hook, { wrapper }), queryClient }
+}
+
+describe('useAnalysesEvents', () => {
+  beforeEach(() => {
+    FakeEventSource.instances = []
+    vi.stubGlobal('EventSource', FakeEventSource)
+  })
+
+  afterEach(() => {
+    vi.unstubAllGlobals()
+  })
+
+  it('refreshes analyses and metrics on status changes and resyncs', () => {
+    const { queryClient, unmount } = renderWithClient(() => useAnalysesEvents())
+    const invalidate = vi.spyOn(queryClient, 'invalidateQueries')
+    const [source] = FakeEventSource.instances
+
+    expect(source.url).toBe('/api/analyses/events')
+    source.emit('status', { analysis_id: 'analysis-1', status: 'completed', error_message: null })
+    source.emit('resync')
+
+    expect(invalidate).toHaveBeenCalledTimes(4)
+    expect(invalidate).toHaveBeenCalledWith({ queryKey: ['analyses'] })
+    expect(invalidate).toHaveBeenCalledWith({ queryKey: ['metrics'] })
+
+    unmount()
+    expect(source.closed).toBe(true)
+  })
+
+  it('refreshes on reconnect but not on the first connection', () => {
+    const { queryClient } = renderWithClient(() => useAnalysesEvents())
+    const invalidate = vi.spyOn(queryClient, 'invalidateQueries')
+    const [source] = FakeEventSource.instances
+
+    source.onopen()
+    expect(invalidate).not.toHaveBeenCalled()
+
+    source.onopen()
+    expect(invalidate).toHaveBeenCalledWith({ queryKey: ['analyses'] })
+  })
+
+  it('does nothing without EventSource', () => {
+    vi.stubGlobal('EventSource', undefined)
+
+    expect(() => renderWithClient(() => useAnalysesEvents())).not.toThrow()
+    expect(FakeEventSource.instances).toHaveLength(0)
+  })
+})
+
+describe('useAnalysis', () => {
+  beforeEach(() => {
+    FakeEventSource.instances = []
+    vi.stubGlobal('EventSource', FakeEventSource)
+    api.getAnalysis.mockReset()
+  })
+
+  afterEach(() => {
+    vi.unstubAllGlobals()
+  })
+
+  it('applies streamed findings and progress to a running analysis', async () => {
+    api.getAnalysis.mockResolvedValue(runningAnalysis)
+    const { result, queryClient } = renderWithClient(() => useAnalysis('analysis-1'))
+
+    await waitFor(() => expect(FakeEventSource.instances).toHaveLength(1))
+    const [source] = FakeEventSource.instances
+    expect(source.url).toBe('/api/analysis/analysis-1/events')
+
+    const issue = { id: 'issue-1', severity: 'critical', title: 'SQL injection' }
+    source.emit('issue', issue)
+    source.emit('issue', issue)
+    source.emit('progress', { chunks_done: 1, chunks_total: 2 })
+
+    const analysis = queryClient.getQueryData(queryKeys.analysis('analysis-1'))
+    expect(analysis.issues).toEqual([issue])
+    expect(analysis.summary.critical).toBe(1)
+    expect(analysis.summary.total_issues).toBe(1)
+
+    source.emit('issues', [issue, { id: 'issue-2', severity: 'warning', title: 'Reused' }])
+    const batched = queryClient.getQueryData(queryKeys.analysis('analysis-1'))
+    expect(batched.issues.map((found) => found.id)).toEqual(['issue-1', 'issue-2'])
+    expect(batched.summary.warnings).toBe(1)
+    await waitFor(() => expect(result.current.data.progress).toEqual({ chunks_done: 1, chunks_total: 2 }))
+  })
+
+  it('replaces the analysis with snapshots and stops streaming once complete', async () => {
+    api.getAnalysis.mockResolvedValue(runningAnalysis)
+    const { result, queryClient } = renderWithClient(() => useAnalysis('analysis-1'))
+    const invalidate = vi.spyOn(queryClient, 'invalidateQueries')
+
+    await waitFor(() => expect(FakeEventSource.instances).toHaveLength(1))
+    const [source] = FakeEventSource.instances
+
+    source.emit('snapshot', { ...runningAnalysis, issues: [{ id: 'issue-2', severity: 'warning' }] })
+    await waitFor(() => expect(result.current.data.issues).toHaveLength(1))
+
+    source.emit('complete', { ...runningAnalysis, status: 'completed' })
+    expect(source.closed).toBe(true)
+    await waitFor(() => expect(result.current.data.status).toBe('completed'))
+    expect(invalidate).toHaveBeenCalledWith({ queryKey: ['analyses'] })
+  })
+
+  it('does not stream a finished analysis', async () => {
+    api.getAnalysis.mockResolvedValue({ ...runningAnalysis, status: 'completed' })
+    const { result } = renderWithClient(() => useAnalysis('analysis-1'))
+
+    await waitFor(() => expect(result.current.isSuccess).toBe(true))
+    expect(FakeEventSource.instances).toHaveLength(0)
+  })
+})
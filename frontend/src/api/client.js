@@ -28,6 +28,11 @@ export const api = {
     return data
   },
 
+  // Server-Sent Events streams (for EventSource)
+  analysisEventsUrl: (id) => `${API_BASE_URL}/api/analysis/${id}/events`,
+
+  analysesEventsUrl: () => `${API_BASE_URL}/api/analyses/events`,
+
   getPRAnalysis: async (repo, prNumber) => {
     const { data } = await apiClient.get(`/api/pr/${repo}/${prNumber}`)
     return data
@@ -3,6 +3,7 @@ const statusStyles = {
   processing: 'bg-gray-400 text-white',
   completed: 'bg-black text-white',
   failed: 'bg-gray-600 text-white',
+  superseded: 'bg-gray-100 text-gray-500',
 }
 
 const statusIcons = {
@@ -10,6 +11,7 @@ const statusIcons = {
   processing: '◐',
   completed: '●',
   failed: '✕',
+  superseded: '↷',
 }
 
 function StatusBadge({ status }) {
@@ -1,6 +1,35 @@
+import { useEffect } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import api from '../api/client'
 
+// Statuses after which an analysis no longer changes
+const FINISHED_STATUSES = ['completed', 'failed', 'superseded']
+
+const SUMMARY_KEYS = { critical: 'critical', warning: 'warnings', suggestion: 'suggestions' }
+
+// EventSource is missing in some environments (e.g. jsdom); live updates are skipped there
+const canStream = () => typeof EventSource !== 'undefined'
+
+// Slow polling behind the event streams, in case a stream is down or misses a change
+const FALLBACK_REFETCH_INTERVAL = 60000
+
+// Add a streamed finding to a cached analysis (it may already be in a snapshot)
+function addIssue(analysis, issue) {
+  if (!analysis || analysis.issues.some((existing) => existing.id === issue.id)) {
+    return analysis
+  }
+  const key = SUMMARY_KEYS[issue.severity]
+  return {
+    ...analysis,
+    issues: [...analysis.issues, issue],
+    summary: {
+      ...analysis.summary,
+      [key]: analysis.summary[key] + 1,
+      total_issues: analysis.summary.total_issues + 1,
+    },
+  }
+}
+
 // Query keys
 export const queryKeys = {
   metrics: (params) => ['metrics', params],
@@ -14,7 +43,7 @@ export function useMetrics(params = {}) {
   return useQuery({
     queryKey: queryKeys.metrics(params),
     queryFn: () => api.getMetrics(params),
-    refetchInterval: 30000, // Refresh every 30 seconds
+    refetchInterval: FALLBACK_REFETCH_INTERVAL,
   })
 }
 
@@ -23,16 +52,63 @@ export function useAnalyses(params = {}) {
   return useQuery({
     queryKey: queryKeys.analyses(params),
     queryFn: () => api.getAnalyses(params),
-    refetchInterval: 10000, // Refresh every 10 seconds
+    refetchInterval: FALLBACK_REFETCH_INTERVAL,
   })
 }
 
+// Refresh analyses and metrics as soon as any analysis changes status
+export function useAnalysesEvents() {
+  const queryClient = useQueryClient()
+
+  useEffect(() => {
+    if (!canStream()) return undefined
+
+    const refresh = () => {
+      queryClient.invalidateQueries({ queryKey: ['analyses'] })
+      queryClient.invalidateQueries({ queryKey: ['metrics'] })
+    }
+    const source = new EventSource(api.analysesEventsUrl())
+    source.addEventListener('status', refresh)
+    source.addEventListener('resync', refresh)
+    // Changes made while disconnected were missed; reload on reconnect
+    let connected = false
+    source.onopen = () => {
+      if (connected) refresh()
+      connected = true
+    }
+    return () => source.close()
+  }, [queryClient])
+}
+
 export function useAnalysis(id) {
-  return useQuery({
+  const queryClient = useQueryClient()
+  const query = useQuery({
     queryKey: queryKeys.analysis(id),
     queryFn: () => api.getAnalysis(id),
     enabled: !!id,
   })
+  const live = !!query.data && !FINISHED_STATUSES.includes(query.data.status)
+
+  // While the analysis runs, apply its snapshots, findings and progress as they arrive
+  useEffect(() => {
+    if (!live || !canStream()) return undefined
+
+    const key = queryKeys.analysis(id)
+    const update = (fn) => (event) => queryClient.setQueryData(key, (analysis) => fn(analysis, JSON.parse(event.data)))
+    const source = new EventSource(api.analysisEventsUrl(id))
+    source.addEventListener('snapshot', update((_, analysis) => analysis))
+    source.addEventListener('issue', update(addIssue))
+    source.addEventListener('issues', update((analysis, issues) => issues.reduce(addIssue, analysis)))
+    source.addEventListener('progress', update((analysis, progress) => analysis && { ...analysis, progress }))
+    source.addEventListener('complete', (event) => {
+      source.close()
+      update((_, analysis) => analysis)(event)
+      queryClient.invalidateQueries({ queryKey: ['analyses'] })
+    })
+    return () => source.close()
+  }, [id, live, queryClient])
+
+  return query
 }
 
 // Repos hook
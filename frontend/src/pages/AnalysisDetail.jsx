@@ -126,7 +126,7 @@ function AnalysisDetail() {
     )
   }
 
-  const { summary, issues, metadata } = analysis
+  const { summary, issues, metadata, progress } = analysis
 
   return (
     <div>
@@ -157,6 +157,12 @@ function AnalysisDetail() {
                 </>
               )}
             </div>
+            {analysis.status === 'processing' && progress?.chunks_total > 0 && (
+              <p className="mt-2 text-sm text-gray-500">
+                Reviewing… {progress.chunks_done} of {progress.chunks_total} part
+                {progress.chunks_total === 1 ? '' : 's'} done
+              </p>
+            )}
             {analysis.pr_url && (
               <a
                 href={analysis.pr_url}
@@ -1,5 +1,5 @@
 import { useState } from 'react'
-import { useMetrics, useAnalyses, useRepos } from '../hooks/useApi'
+import { useMetrics, useAnalyses, useAnalysesEvents, useRepos } from '../hooks/useApi'
 import MetricsGrid from '../components/MetricsGrid'
 import IssuesOverTimeChart from '../components/IssuesOverTimeChart'
 import IssuesByCategoryChart from '../components/IssuesByCategoryChart'
@@ -21,6 +21,7 @@ function Dashboard() {
     limit: 10
   })
   const { data: repos } = useRepos()
+  useAnalysesEvents()
 
   return (
     <div>